@@ -1,7 +1,8 @@
 """
 Servicio siempre-activo (FastAPI) que:
   1. Recibe el webhook de mensajes entrantes de Evolution API.
-  2. Genera un borrador de respuesta con Gemini.
+  2. Genera un borrador de respuesta con Gemini (en segundo plano, vía una
+     cola acotada con workers; el webhook responde apenas persiste el mensaje).
   3. Expone endpoints internos para que el dashboard de Streamlit (app.py)
      muestre la cola de borradores y permita aprobar/rechazar/enviar.
 
@@ -19,21 +20,21 @@ import asyncio
 import json
 import logging
 import os
-from datetime import datetime
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
 from typing import Optional
 
 import pandas as pd
-from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 
 import conversation_store as store
-from evo_client import (
-    enviar_alerta_whatsapp,
-    enviar_mensaje_texto as _evo_enviar_mensaje_texto,
-    normalizar_telefono_chile,
-    verificar_estado_conexion,
-)
-from gemini_client import generar_borrador
+from diario_leads import CSVS_POR_LINEA
+from evo_client import EvolutionClientAsync, normalizar_telefono_chile
+from gobernador_envios import PRIORIDAD_OPERADOR, PRIORIDADES, GobernadorEnvios
+from gemini_client import cerrar_cliente_async, generar_borrador_async
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
@@ -45,12 +46,15 @@ NUMERO_OPERADOR = os.getenv("NUMERO_OPERADOR", "")
 CHEQUEO_SALUD_INTERVALO_SEG = int(os.getenv("CHEQUEO_SALUD_INTERVALO_SEG", str(20 * 60)))
 ARCHIVO_ALERTA_AGENTE = "alert_status_agente.json"
 
-CSVS_POR_LINEA = {
-    "clinicas": "prospeccion_gestionvital_pro.csv",
-    "almacenes": "prospeccion_almacenes_pro.csv",
-}
 
-app = FastAPI(title="GestiónVital Pro - Agente Conversacional")
+# Cliente async compartido (conexiones reutilizadas, reintentos y circuit
+# breaker; ver evo_client): el chequeo de salud y los envíos aprobados no
+# ocupan un thread mientras esperan a Evolution API.
+evo = EvolutionClientAsync(EVO_URL, EVO_TOKEN, EVO_INSTANCE)
+
+# Cupo de envíos de la instancia: este proceso guarda el estado autoritativo y
+# los workers de GitHub Actions lo consultan por POST /governor/acquire.
+gobernador = GobernadorEnvios()
 
 
 async def _chequeo_salud_periodico():
@@ -61,29 +65,223 @@ async def _chequeo_salud_periodico():
     antes que el próximo ciclo del worker.
     """
     while True:
+        await _chequear_salud()
+        await asyncio.sleep(CHEQUEO_SALUD_INTERVALO_SEG)
+
+
+async def _chequear_salud():
+    try:
+        estado = await evo.estado_conexion()
+        if estado != "open":
+            motivo = f"Chequeo periódico del agente: estado de sesión = '{estado}'."
+            logging.error(motivo)
+            # Los archivos van en un thread para no congelar el event loop.
+            await asyncio.to_thread(_escribir_alerta_agente, motivo)
+            await evo.enviar_alerta(NUMERO_OPERADOR, f"⚠️ GestiónVital: {motivo}")
+        elif os.path.exists(ARCHIVO_ALERTA_AGENTE):
+            await asyncio.to_thread(os.remove, ARCHIVO_ALERTA_AGENTE)
+    except Exception:
+        logging.exception("Error en el chequeo de salud periódico.")
+
+
+def _escribir_alerta_agente(motivo):
+    with open(ARCHIVO_ALERTA_AGENTE, "w", encoding="utf-8") as f:
+        json.dump(
+            {"motivo": "sesion_whatsapp_caida", "detalle": motivo,
+             "timestamp": datetime.utcnow().isoformat()},
+            f, ensure_ascii=False, indent=2,
+        )
+
+
+# --- COLA DE GENERACIÓN DE BORRADORES ---
+# El webhook solo persiste el mensaje entrante y lo encola; la generación del
+# borrador (búsqueda del lead, historial, Gemini, que puede tardar decenas de
+# segundos) la hacen BORRADOR_WORKERS tareas de fondo: lo bloqueante (SQLite)
+# va en un thread y la llamada a Gemini usa el cliente async. La cola es
+# acotada (BORRADOR_COLA_MAX): si se llena, el webhook espera turno
+# (backpressure) sin bloquear el event loop.
+BORRADOR_WORKERS = int(os.getenv("BORRADOR_WORKERS", "2"))
+BORRADOR_COLA_MAX = int(os.getenv("BORRADOR_COLA_MAX", "200"))
+# Ventana de agrupación: los prospectos suelen mandar 3-4 mensajes seguidos.
+# Los mensajes de un mismo teléfono que llegan con menos de
+# BORRADOR_DEBOUNCE_SEG entre sí se juntan en un solo borrador (una sola
+# llamada a Gemini); BORRADOR_DEBOUNCE_MAX_SEG acota la espera total si el
+# prospecto no para de escribir. Con 0 se desactiva la agrupación.
+BORRADOR_DEBOUNCE_SEG = float(os.getenv("BORRADOR_DEBOUNCE_SEG", "20"))
+BORRADOR_DEBOUNCE_MAX_SEG = float(os.getenv("BORRADOR_DEBOUNCE_MAX_SEG", "60"))
+# Mensajes entrantes sin borrador más antiguos que esto no se re-encolan al reiniciar.
+BORRADOR_RECUPERAR_HORAS = int(os.getenv("BORRADOR_RECUPERAR_HORAS", "24"))
+
+_cola_borradores: Optional[asyncio.Queue] = None
+_metricas_lock = threading.Lock()
+_metricas = {
+    "encolados": 0, "procesados": 0, "errores": 0, "recuperados": 0,
+    "mensajes_agrupados": 0, "llamadas_gemini_ahorradas": 0, "borradores_reemplazados": 0,
+    "borradores_obsoletos": 0,
+    "etapas": {},
+}
+# Ráfagas abiertas por teléfono: {"msg_ids", "textos", "inicio", "timer"}.
+_rafagas = {}
+_tareas_rafaga = set()
+
+
+@contextmanager
+def _medir(etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _registrar_duracion(etapa, time.perf_counter() - inicio)
+
+
+def _registrar_duracion(etapa, duracion):
+    with _metricas_lock:
+        m = _metricas["etapas"].setdefault(etapa, {"n": 0, "total_seg": 0.0, "max_seg": 0.0})
+        m["n"] += 1
+        m["total_seg"] += duracion
+        m["max_seg"] = max(m["max_seg"], duracion)
+
+
+def _contar(clave, n=1):
+    with _metricas_lock:
+        _metricas[clave] += n
+
+
+def _contexto_para_borrador(telefono, primer_msg_id):
+    """
+    Parte bloqueante previa a Gemini (corre en un thread). El historial llega
+    hasta antes del primer mensaje que cubre el borrador: esos mensajes van
+    juntos como mensaje entrante y no deben aparecer dos veces en el prompt.
+    """
+    with _medir("busqueda_lead"):
+        _linea, _archivo, contexto_lead = _buscar_lead_por_telefono(telefono)
+    with _medir("historial"):
+        historial = store.historial_conversacion(telefono, limite=20, antes_de_id=primer_msg_id)
+    return historial, contexto_lead
+
+
+async def _generar_y_guardar_borrador(telefono, msg_id, texto, primer_msg_id=None):
+    historial, contexto_lead = await asyncio.to_thread(
+        _contexto_para_borrador, telefono, primer_msg_id if primer_msg_id is not None else msg_id
+    )
+    # Cliente async: bajo carga, el worker espera su turno del limitador de
+    # Gemini con asyncio.sleep en vez de bloquear un thread.
+    with _medir("gemini"):
+        borrador = await generar_borrador_async(historial, contexto_lead, texto)
+    with _medir("guardar_borrador"):
+        draft_id, vigente, reemplazados = await asyncio.to_thread(store.crear_borrador, telefono, msg_id, borrador)
+    if not vigente:
+        _contar("borradores_obsoletos")
+        logging.info("Borrador %s de %s llegó después de uno más nuevo: queda como 'superseded'.", draft_id, telefono)
+    if reemplazados:
+        _contar("borradores_reemplazados", reemplazados)
+    return draft_id
+
+
+async def _worker_borradores(n):
+    while True:
+        item = await _cola_borradores.get()
+        _registrar_duracion("espera_en_cola", time.perf_counter() - item["encolado_en"])
         try:
-            estado = verificar_estado_conexion(EVO_URL, EVO_INSTANCE, EVO_TOKEN)
-            if estado != "open":
-                motivo = f"Chequeo periódico del agente: estado de sesión = '{estado}'."
-                logging.error(motivo)
-                with open(ARCHIVO_ALERTA_AGENTE, "w", encoding="utf-8") as f:
-                    json.dump(
-                        {"motivo": "sesion_whatsapp_caida", "detalle": motivo,
-                         "timestamp": datetime.utcnow().isoformat()},
-                        f, ensure_ascii=False, indent=2,
-                    )
-                enviar_alerta_whatsapp(EVO_URL, EVO_TOKEN, EVO_INSTANCE, NUMERO_OPERADOR, f"⚠️ GestiónVital: {motivo}")
-            elif os.path.exists(ARCHIVO_ALERTA_AGENTE):
-                os.remove(ARCHIVO_ALERTA_AGENTE)
+            with _medir("total_borrador"):
+                await _generar_y_guardar_borrador(item["telefono"], item["msg_id"], item["texto"], item["primer_msg_id"])
+            _contar("procesados")
         except Exception:
-            logging.exception("Error en el chequeo de salud periódico.")
-        await asyncio.sleep(CHEQUEO_SALUD_INTERVALO_SEG)
+            _contar("errores")
+            logging.exception("Worker de borradores %s: error procesando mensaje %s.", n, item["msg_id"])
+        finally:
+            _cola_borradores.task_done()
+
+
+async def _encolar_borrador(telefono, msg_id, texto, primer_msg_id=None):
+    await _cola_borradores.put({
+        "telefono": telefono, "msg_id": msg_id, "texto": texto,
+        "primer_msg_id": primer_msg_id if primer_msg_id is not None else msg_id,
+        "encolado_en": time.perf_counter(),
+    })
+    _contar("encolados")
+
+
+def _programar_borrador(telefono, msg_id, texto):
+    """
+    Agrega el mensaje a la ráfaga abierta del teléfono y re-arma el timer:
+    el borrador se encola recién cuando pasan BORRADOR_DEBOUNCE_SEG sin
+    mensajes nuevos (o se cumple BORRADOR_DEBOUNCE_MAX_SEG desde el primero).
+    Debe llamarse desde el event loop.
+    """
+    if BORRADOR_DEBOUNCE_SEG <= 0:
+        _lanzar(_encolar_borrador(telefono, msg_id, texto))
+        return
+
+    loop = asyncio.get_running_loop()
+    rafaga = _rafagas.get(telefono)
+    if rafaga is None:
+        rafaga = _rafagas[telefono] = {"msg_ids": [], "textos": [], "inicio": loop.time(), "timer": None}
+    else:
+        rafaga["timer"].cancel()
+    rafaga["msg_ids"].append(msg_id)
+    rafaga["textos"].append(texto)
 
+    restante_max = rafaga["inicio"] + BORRADOR_DEBOUNCE_MAX_SEG - loop.time()
+    espera = max(0.0, min(BORRADOR_DEBOUNCE_SEG, restante_max))
+    rafaga["timer"] = loop.call_later(espera, lambda: _lanzar(_cerrar_rafaga(telefono)))
 
-@app.on_event("startup")
-def _startup():
+
+def _lanzar(corutina):
+    # Se guarda referencia a la tarea para que el GC no la cancele a medio camino.
+    tarea = asyncio.ensure_future(corutina)
+    _tareas_rafaga.add(tarea)
+    tarea.add_done_callback(_tareas_rafaga.discard)
+
+
+async def _cerrar_rafaga(telefono):
+    rafaga = _rafagas.pop(telefono, None)
+    if not rafaga:
+        return
+    agrupados = len(rafaga["msg_ids"])
+    if agrupados > 1:
+        _contar("mensajes_agrupados", agrupados)
+        _contar("llamadas_gemini_ahorradas", agrupados - 1)
+        logging.info("Ráfaga de %s mensajes de %s agrupada en un solo borrador.", agrupados, telefono)
+    # El borrador queda asociado al último mensaje; los de la ráfaga van
+    # juntos como mensaje entrante (el historial termina antes del primero).
+    await _encolar_borrador(telefono, rafaga["msg_ids"][-1], "\n".join(rafaga["textos"]), rafaga["msg_ids"][0])
+
+
+async def _recuperar_pendientes():
+    """
+    Re-encola los mensajes entrantes que quedaron sin borrador (ej. el servicio
+    se reinició con items en la cola, que vive solo en memoria).
+    """
+    desde = (datetime.utcnow() - timedelta(hours=BORRADOR_RECUPERAR_HORAS)).isoformat()
+    pendientes = await asyncio.to_thread(store.mensajes_sin_borrador, desde)
+    for m in pendientes:
+        _programar_borrador(m["telefono_normalizado"], m["id"], m["texto"])
+    if pendientes:
+        _contar("recuperados", len(pendientes))
+        logging.info("Re-encolados %s mensajes entrantes sin borrador.", len(pendientes))
+
+
+@asynccontextmanager
+async def _lifespan(app):
+    """Arranca el chequeo de salud y los workers de borradores; al cerrar los detiene y cierra los clientes HTTP."""
+    global _cola_borradores
     store.inicializar_db()
-    asyncio.create_task(_chequeo_salud_periodico())
+    _cola_borradores = asyncio.Queue(maxsize=BORRADOR_COLA_MAX)
+    tareas = [asyncio.create_task(_chequeo_salud_periodico())]
+    tareas += [asyncio.create_task(_worker_borradores(n)) for n in range(BORRADOR_WORKERS)]
+    tareas.append(asyncio.create_task(_recuperar_pendientes()))
+    try:
+        yield
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        await cerrar_cliente_async()
+        await evo.cerrar()
+
+
+app = FastAPI(title="GestiónVital Pro - Agente Conversacional", lifespan=_lifespan)
 
 
 def _requerir_token(x_agent_token: Optional[str]):
@@ -94,28 +292,89 @@ def _requerir_token(x_agent_token: Optional[str]):
         raise HTTPException(status_code=401, detail="Token inválido.")
 
 
-def _buscar_lead_por_telefono(telefono_normalizado):
-    """Busca el lead en cualquiera de los dos CSV por teléfono normalizado."""
+# Índice en memoria (por proceso) teléfono normalizado -> (linea, archivo,
+# valores de _COLUMNAS_CONTEXTO_LEAD).
+# Se reconstruye solo cuando alguno de los CSV cambia en disco (mtime/tamaño),
+# así cada webhook es una búsqueda en un dict en vez de una consulta/lectura.
+# La reconstrucción lee de cada CSV solo las columnas que se usan y normaliza
+# todos los teléfonos de una pasada (ver bench/bench_indice_telefonos.py).
+_COLUMNAS_CONTEXTO_LEAD = ["Evento", "Ubicacion", "Estado", "Dia_Secuencia"]
+_indice_telefonos = {"firma": None, "leads": {}}
+_indice_lock = threading.Lock()
+
+
+def _firma_csvs():
+    firma = []
+    for archivo in CSVS_POR_LINEA.values():
+        try:
+            stat = os.stat(archivo)
+            firma.append((archivo, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            firma.append((archivo, None, None))
+    return tuple(firma)
+
+
+def _leads_con_telefono(archivo):
+    """Teléfonos normalizados ("" si no hay) y valores de contexto de cada fila del CSV."""
+    columnas = ["Telefono"] + _COLUMNAS_CONTEXTO_LEAD
+    textos = {c: str for c in columnas if c != "Dia_Secuencia"}
+    df = pd.read_csv(archivo, usecols=lambda c: c in columnas, dtype=textos, keep_default_na=False)
+    for col in columnas:
+        if col not in df.columns:
+            df[col] = ""
+    if not pd.api.types.is_integer_dtype(df["Dia_Secuencia"]):
+        df["Dia_Secuencia"] = pd.to_numeric(df["Dia_Secuencia"], errors="coerce").fillna(0).astype(int)
+    # Tuplas de valores: el dict de contexto se arma recién al resolver el lead.
+    valores = zip(*(df[col].tolist() for col in _COLUMNAS_CONTEXTO_LEAD))
+    return [normalizar_telefono_chile(t) for t in df["Telefono"].tolist()], valores
+
+
+def _construir_indice_telefonos():
+    leads = {}
     for linea, archivo in CSVS_POR_LINEA.items():
         if not os.path.exists(archivo):
             continue
-        try:
-            df = pd.read_csv(archivo)
-        except Exception:
-            continue
-        if "Telefono" not in df.columns:
-            continue
-        telefonos = df["Telefono"].astype(str).apply(normalizar_telefono_chile)
-        coincidencias = df[telefonos == telefono_normalizado]
-        if not coincidencias.empty:
-            row = coincidencias.iloc[0]
-            return linea, archivo, {
-                "Evento": row.get("Evento", ""),
-                "Ubicacion": row.get("Ubicacion", ""),
-                "Estado": row.get("Estado", ""),
-                "Dia_Secuencia": row.get("Dia_Secuencia", ""),
-            }
-    return None, None, {}
+        telefonos, valores = _leads_con_telefono(archivo)
+        for telefono, fila in zip(telefonos, valores):
+            # Si el teléfono está repetido, gana la primera línea de
+            # CSVS_POR_LINEA y la primera fila del CSV (igual que antes).
+            if telefono:
+                leads.setdefault(telefono, (linea, archivo, fila))
+    return leads
+
+
+def _obtener_indice_telefonos():
+    firma = _firma_csvs()
+    with _indice_lock:
+        if _indice_telefonos["firma"] != firma:
+            _indice_telefonos["leads"] = _construir_indice_telefonos()
+            _indice_telefonos["firma"] = firma
+            logging.info("Índice de teléfonos reconstruido: %s leads.", len(_indice_telefonos["leads"]))
+        return _indice_telefonos["leads"]
+
+
+def _resolver_leads(telefonos):
+    """
+    Resuelve varios teléfonos normalizados de una vez contra el índice (un solo
+    chequeo de cambios en los CSV para todo el lote). Devuelve
+    {telefono: (linea, archivo, contexto)} con (None, None, {}) si no está.
+    """
+    try:
+        indice = _obtener_indice_telefonos()
+    except Exception:
+        logging.exception("Error al construir el índice de teléfonos de leads.")
+        indice = {}
+    resueltos = {}
+    for telefono in telefonos:
+        linea, archivo, fila = indice.get(telefono, (None, None, None))
+        contexto = dict(zip(_COLUMNAS_CONTEXTO_LEAD, fila)) if fila else {}
+        resueltos[telefono] = (linea, archivo, contexto)
+    return resueltos
+
+
+def _buscar_lead_por_telefono(telefono_normalizado):
+    """Busca el lead en cualquiera de las dos líneas por teléfono normalizado."""
+    return _resolver_leads([telefono_normalizado])[telefono_normalizado]
 
 
 def _extraer_mensaje_entrante(payload: dict):
@@ -167,23 +426,66 @@ async def webhook_evolution(request: Request):
         # No es un error: Evolution manda varios tipos de eventos por el mismo webhook.
         return {"status": "ignorado"}
 
-    msg_id = store.guardar_mensaje(telefono, "in", texto)
+    with _medir("guardar_mensaje"):
+        msg_id = await asyncio.to_thread(store.guardar_mensaje, telefono, "in", texto)
+    _programar_borrador(telefono, msg_id, texto)
 
-    _linea, _archivo, contexto_lead = _buscar_lead_por_telefono(telefono)
-    historial = store.historial_conversacion(telefono, limite=20)
+    # El borrador se genera en segundo plano (tras la ventana de agrupación);
+    # aparece en /pending-drafts al terminar.
+    return {"status": "encolado", "message_id": msg_id}
 
-    borrador = generar_borrador(historial, contexto_lead, texto)
-    draft_id = store.crear_borrador(telefono, msg_id, borrador)
 
-    return {"status": "ok", "draft_id": draft_id}
+@app.get("/metrics")
+def metrics(x_agent_token: Optional[str] = Header(default=None)):
+    _requerir_token(x_agent_token)
+    with _metricas_lock:
+        etapas = {
+            etapa: {
+                "n": m["n"],
+                "promedio_seg": round(m["total_seg"] / m["n"], 4) if m["n"] else 0.0,
+                "max_seg": round(m["max_seg"], 4),
+            }
+            for etapa, m in _metricas["etapas"].items()
+        }
+        contadores = {k: v for k, v in _metricas.items() if k != "etapas"}
+    return {
+        "cola": {
+            "profundidad": _cola_borradores.qsize() if _cola_borradores else 0,
+            "rafagas_abiertas": len(_rafagas),
+            "capacidad": BORRADOR_COLA_MAX,
+            "workers": BORRADOR_WORKERS,
+        },
+        **contadores,
+        "etapas": etapas,
+        "envios_disponibles": gobernador.disponibles(),
+    }
 
 
 @app.get("/pending-drafts")
-def pending_drafts(x_agent_token: Optional[str] = Header(default=None)):
+def pending_drafts(
+    response: Response,
+    limit: Optional[int] = Query(default=None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    x_agent_token: Optional[str] = Header(default=None),
+):
+    """
+    Sin `limit` devuelve todos los pendientes (compatibilidad). Con `limit`
+    devuelve una página; si hay más, el cursor de la siguiente va en el
+    header X-Next-Cursor (el cuerpo sigue siendo una lista).
+    """
     _requerir_token(x_agent_token)
-    borradores = store.listar_borradores_pendientes()
+    if limit is None:
+        borradores = store.listar_borradores_pendientes()
+    else:
+        try:
+            borradores, siguiente = store.pagina_borradores_pendientes(limit, cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido.")
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+    leads = _resolver_leads({b["telefono_normalizado"] for b in borradores})
     for b in borradores:
-        _linea, _archivo, contexto = _buscar_lead_por_telefono(b["telefono_normalizado"])
+        _linea, _archivo, contexto = leads[b["telefono_normalizado"]]
         b["lead"] = contexto
     return borradores
 
@@ -193,9 +495,9 @@ class DecisionBorrador(BaseModel):
 
 
 @app.post("/drafts/{draft_id}/approve")
-def approve_draft(draft_id: int, decision: DecisionBorrador, x_agent_token: Optional[str] = Header(default=None)):
+async def approve_draft(draft_id: int, decision: DecisionBorrador, x_agent_token: Optional[str] = Header(default=None)):
     _requerir_token(x_agent_token)
-    borrador = store.obtener_borrador(draft_id)
+    borrador = await asyncio.to_thread(store.obtener_borrador, draft_id)
     if not borrador:
         raise HTTPException(status_code=404, detail="Borrador no encontrado.")
     if borrador["estado"] != "pending":
@@ -205,18 +507,44 @@ def approve_draft(draft_id: int, decision: DecisionBorrador, x_agent_token: Opti
     if not texto_envio:
         raise HTTPException(status_code=400, detail="El texto a enviar no puede estar vacío.")
 
-    enviado = _evo_enviar_mensaje_texto(
-        EVO_URL, EVO_TOKEN, EVO_INSTANCE, borrador["telefono_normalizado"], texto_envio
-    )
+    # El operador tiene prioridad sobre la prospección, pero igual respeta el
+    # tope de la instancia; el borrador queda pendiente para reintentar.
+    permitido, espera = await asyncio.to_thread(gobernador.adquirir, PRIORIDAD_OPERADOR)
+    if not permitido:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Tope de envíos de la instancia alcanzado. Reintentar en ~{espera / 60:.0f} min.",
+            headers={"Retry-After": str(int(espera) + 1)},
+        )
+
+    # La pausa "escribiendo..." (15-35 s) es un asyncio.sleep: no ocupa un
+    # thread del pool de FastAPI mientras espera.
+    enviado = await evo.enviar_texto(borrador["telefono_normalizado"], texto_envio)
     if not enviado:
-        store.marcar_borrador(draft_id, "approved")
+        # El mensaje no salió: el cupo vuelve al gobernador para el reintento.
+        await asyncio.to_thread(gobernador.devolver)
+        await asyncio.to_thread(store.marcar_borrador, draft_id, "approved")
         raise HTTPException(status_code=502, detail="Aprobado pero falló el envío por Evolution API. Reintentar.")
 
-    store.guardar_mensaje(borrador["telefono_normalizado"], "out", texto_envio)
-    store.marcar_borrador(draft_id, "sent")
+    await asyncio.to_thread(store.guardar_mensaje, borrador["telefono_normalizado"], "out", texto_envio)
+    await asyncio.to_thread(store.marcar_borrador, draft_id, "sent")
     return {"status": "enviado"}
 
 
+class SolicitudEnvio(BaseModel):
+    prioridad: str
+
+
+@app.post("/governor/acquire")
+def governor_acquire(solicitud: SolicitudEnvio, x_agent_token: Optional[str] = Header(default=None)):
+    """Toma un envío del cupo de la instancia (lo usan los workers; ver gobernador_envios)."""
+    _requerir_token(x_agent_token)
+    if solicitud.prioridad not in PRIORIDADES:
+        raise HTTPException(status_code=400, detail=f"Prioridad inválida. Usar una de: {', '.join(PRIORIDADES)}.")
+    permitido, espera = gobernador.adquirir(solicitud.prioridad)
+    return {"permitido": permitido, "espera_seg": round(espera, 1)}
+
+
 @app.post("/drafts/{draft_id}/reject")
 def reject_draft(draft_id: int, x_agent_token: Optional[str] = Header(default=None)):
     _requerir_token(x_agent_token)
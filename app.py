@@ -1,14 +1,20 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import json
 import time
 import requests
 import unicodedata
-import base64
+import string
 from datetime import datetime
+from functools import lru_cache
 from urllib.parse import quote
 
+import diario_leads
+from consulta_leads import ConsultaLeads
+from sincronizador_github import GITHUB_API_URL, SincronizadorGitHub
+
 # --- CONFIGURACIÓN ---
 MODOS = {
     "🏥 Clínicas Estéticas": "prospeccion_gestionvital_pro.csv",
@@ -37,6 +43,17 @@ COLUMNAS_REQUERIDAS = [
 ]
 NUMERO_PRUEBA = "56971394997"
 
+# Orden de la tabla del Dashboard: etiqueta -> (columnas, ascendente).
+# "_prioridad_email" (tiene email y aún no se le escribió) no es columna del
+# CSV, se calcula al cargar la base.
+ORDENES_DASHBOARD = {
+    "⭐ Prioridad email": (["_prioridad_email", "Estado"], [False, False]),
+    "🔤 Nombre": (["Evento"], [True]),
+    "📍 Comuna": (["Ubicacion", "Evento"], [True, True]),
+    "📈 Madurez": (["Dia_Secuencia"], [False]),
+}
+FILAS_POR_PAGINA = [50, 100, 200]
+
 # Conexión Segura a Secrets
 try:
     EVO_URL = st.secrets["EVO_URL"]
@@ -57,6 +74,8 @@ st.set_page_config(page_title="GestiónVital Pro Multi-SaaS", layout="wide", pag
 def limpiar_acentos(text):
     if not isinstance(text, str):
         return str(text)
+    if text.isascii():
+        return text
     return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
 
 
@@ -116,8 +135,15 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Guardar a Git
-def push_to_github(filename, content):
+# Guardar a Git: un solo commit por guardado vía la Git Data API (ver
+# sincronizador_github), con la sesión HTTP reutilizada entre reruns.
+@st.cache_resource(show_spinner=False)
+def _sincronizador_github(repo, token, api_url):
+    return SincronizadorGitHub(repo, token, api_url=api_url)
+
+
+def push_to_github(archivos, mensaje=None):
+    """Sube `archivos` ({ruta en el repo: contenido}) en un solo commit. Devuelve True si quedó en GitHub."""
     try:
         token = st.secrets["GITHUB_TOKEN"]
         repo = st.secrets["GITHUB_REPO"]
@@ -128,49 +154,45 @@ def push_to_github(filename, content):
         )
         return False
 
-    try:
-        url = f"https://api.github.com/repos/{repo}/contents/{filename}"
-        headers = {
-            "Authorization": f"token {token}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        res = requests.get(url, headers=headers)
-        sha = res.json().get("sha") if res.status_code == 200 else None
-        data = {
-            "message": f"Sincronización {filename} {datetime.now().strftime('%d/%m/%Y %H:%M')}",
-            "content": base64.b64encode(content.encode('utf-8')).decode('utf-8'),
-        }
-        if sha: data["sha"] = sha
-        res = requests.put(url, json=data, headers=headers)
-        if res.status_code not in [200, 201]:
-            st.error(
-                f"❌ GitHub respondió HTTP {res.status_code} al intentar subir `{filename}` "
-                f"a `{repo}`: {res.text[:400]}"
-            )
-        return res.status_code in [200, 201]
-    except Exception as e:
-        st.error(f"Error de conexión: {str(e)}")
-        return False
+    sincronizador = _sincronizador_github(repo, token, st.secrets.get("GITHUB_API_URL", GITHUB_API_URL))
+    mensaje = mensaje or f"Sincronización {', '.join(archivos)} {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+    ok, detalle = sincronizador.subir(archivos, mensaje)
+    if not ok:
+        st.error(f"❌ No se pudo subir {', '.join(f'`{a}`' for a in archivos)} a `{repo}`: {detalle}")
+    return ok
 
 # --- CLIENTE DEL AGENTE CONVERSACIONAL (agent_service.py, corre en el VPS) ---
 def _agent_headers():
     return {"x-agent-token": AGENT_SERVICE_TOKEN} if AGENT_SERVICE_TOKEN else {}
 
 
-def obtener_borradores_pendientes():
+BANDEJA_POR_PAGINA = 20
+
+
+def obtener_borradores_pendientes(cursor=None):
+    """
+    Trae una página de borradores pendientes. Devuelve (borradores,
+    cursor_siguiente), con cursor_siguiente None si es la última página.
+    """
     if not AGENT_SERVICE_URL:
-        return None
+        return None, None
+    params = {"limit": BANDEJA_POR_PAGINA}
+    if cursor:
+        params["cursor"] = cursor
     try:
         res = requests.get(
-            f"{AGENT_SERVICE_URL.rstrip('/')}/pending-drafts", headers=_agent_headers(), timeout=10
+            f"{AGENT_SERVICE_URL.rstrip('/')}/pending-drafts",
+            params=params,
+            headers=_agent_headers(),
+            timeout=10,
         )
         if res.status_code == 200:
-            return res.json()
+            return res.json(), res.headers.get("X-Next-Cursor")
         st.error(f"El agente respondió HTTP {res.status_code}: {res.text[:300]}")
-        return []
+        return [], None
     except Exception as e:
         st.error(f"No se pudo conectar con el servicio del agente: {e}")
-        return []
+        return [], None
 
 
 def aprobar_borrador(draft_id, texto_final):
@@ -278,38 +300,79 @@ PLANTILLAS_EMAIL = {
 }
 
 
-def _detectar_categoria(ministerio, plantillas):
+def _mapear_unicos(serie, funcion):
+    """serie.map(funcion), pero llamando a `funcion` una sola vez por valor distinto."""
+    unicos = pd.unique(serie)
+    return serie.map(dict(zip(unicos, map(funcion, unicos))))
+
+
+def _rellenar_quoted(plantilla, campos, indice):
+    """
+    quote(plantilla.format(**campos)) para muchas filas a la vez: `campos`
+    son Series ya url-encodeadas. quote codifica carácter por carácter, así
+    que encodear las partes y concatenarlas da lo mismo que encodear el todo.
+    """
+    resultado = pd.Series("", index=indice, dtype=object)
+    for literal, campo, _, _ in string.Formatter().parse(plantilla):
+        if literal:
+            resultado = resultado + quote(literal)
+        if campo:
+            resultado = resultado + campos[campo].loc[indice]
+    return resultado
+
+
+@lru_cache(maxsize=None)
+def _claves_normalizadas(claves):
+    return tuple((limpiar_acentos(clave).lower(), clave) for clave in claves if clave != "_default")
+
+
+@lru_cache(maxsize=4096)
+def _detectar_categoria(ministerio, claves):
     """
     Detecta a qué término de búsqueda (Clínica Estética, Spa Facial, etc.)
     corresponde un lead a partir de la columna Ministerio, para elegir la
-    plantilla de contacto (email o WhatsApp) más relevante. `plantillas` es
-    el diccionario de plantillas (sus claves son los términos posibles).
+    plantilla de contacto (email o WhatsApp) más relevante. `claves` son las
+    claves del diccionario de plantillas (los términos posibles), como tupla.
     """
     if isinstance(ministerio, str):
         texto = limpiar_acentos(ministerio).lower()
-        for clave in plantillas:
-            if clave == "_default":
-                continue
-            if limpiar_acentos(clave).lower() in texto:
+        for clave_normalizada, clave in _claves_normalizadas(claves):
+            if clave_normalizada in texto:
                 return clave
     return "_default"
 
 
-def generar_mailto(email, nombre, ubicacion, ministerio=""):
+def categorias_de(ministerios, plantillas):
+    """Categoría (clave de `plantillas`) de cada lead, a partir de la columna Ministerio."""
+    claves = tuple(plantillas)
+    return _mapear_unicos(ministerios, lambda m: _detectar_categoria(m, claves))
+
+
+def links_mailto(df, categorias):
     """
-    Genera un link mailto: con asunto y cuerpo precargados, usando la plantilla
-    que corresponde al término de búsqueda que originó el lead (columna
-    Ministerio). Abre el cliente de correo del usuario con un borrador editable
-    — no envía nada automáticamente, el operador revisa y presiona enviar él mismo.
+    Links mailto: con asunto y cuerpo precargados para cada fila de `df`
+    (None si no tiene email), usando la plantilla que corresponde al término
+    de búsqueda que originó el lead (`categorias`, ver categorias_de). Abren el
+    cliente de correo del usuario con un borrador editable — no envían nada
+    automáticamente, el operador revisa y presiona enviar él mismo.
     """
-    if not isinstance(email, str) or "@" not in email:
-        return None
-    nombre_limpio = limpiar_acentos(nombre) if nombre else "equipo"
-    zona = ubicacion if isinstance(ubicacion, str) and ubicacion.strip() else "su zona"
-    plantilla = PLANTILLAS_EMAIL[_detectar_categoria(ministerio, PLANTILLAS_EMAIL)]
-    asunto = plantilla["asunto"].format(nombre=nombre_limpio)
-    cuerpo = plantilla["cuerpo"].format(nombre=nombre_limpio, zona=zona)
-    return f"mailto:{email.strip()}?subject={quote(asunto)}&body={quote(cuerpo)}"
+    links = pd.Series(None, index=df.index, dtype=object)
+    con_email = df["Email"].astype(str).str.contains("@", regex=False)
+    if not con_email.any():
+        return links
+    filas = df[con_email]
+    nombre = _mapear_unicos(filas["Evento"], lambda n: quote(limpiar_acentos(n) if n else "equipo"))
+    zona = _mapear_unicos(filas["Ubicacion"], lambda z: quote(z if isinstance(z, str) and z.strip() else "su zona"))
+    prefijo = "mailto:" + filas["Email"].astype(str).str.strip()
+    campos = {"nombre": nombre, "zona": zona}
+    for categoria, indice in filas.groupby(categorias.loc[filas.index]).groups.items():
+        plantilla = PLANTILLAS_EMAIL[categoria]
+        links.loc[indice] = (
+            prefijo.loc[indice]
+            + "?subject=" + _rellenar_quoted(plantilla["asunto"], campos, indice)
+            + "&body=" + _rellenar_quoted(plantilla["cuerpo"], campos, indice)
+        )
+    return links
 
 
 # --- CONTACTO POR WHATSAPP ---
@@ -364,42 +427,150 @@ PLANTILLAS_WHATSAPP = {
 }
 
 
-def format_whatsapp_link(tel, nombre="", ubicacion="", ministerio=""):
+def links_whatsapp(df, categorias):
     """
-    Genera el link de wa.me con un mensaje inicial precargado (editable por
-    el operador antes de enviar), usando la plantilla del término que
-    originó el lead. Sin nombre/ubicación disponibles, igual arma el link
-    pero con un mensaje genérico.
+    Links de wa.me con un mensaje inicial precargado (editable por el
+    operador antes de enviar) para cada fila de `df` (None si no hay
+    teléfono), usando la plantilla del término que originó el lead
+    (`categorias`, ver categorias_de). Sin nombre/ubicación disponibles, igual
+    arma el link pero con un mensaje genérico.
     """
-    tel_norm = normalizar_telefono_chile(tel)
-    if not tel_norm:
-        return None
-    num = "".join(filter(str.isdigit, str(tel_norm)))
-    if not num:
-        return None
-    nombre_limpio = limpiar_acentos(nombre) if isinstance(nombre, str) and nombre.strip() else "su negocio"
-    zona = ubicacion if isinstance(ubicacion, str) and ubicacion.strip() else "su zona"
-    plantilla = PLANTILLAS_WHATSAPP[_detectar_categoria(ministerio, PLANTILLAS_WHATSAPP)]
-    mensaje = plantilla.format(nombre=nombre_limpio, zona=zona)
-    return f"https://wa.me/{num}?text={quote(mensaje)}"
+    links = pd.Series(None, index=df.index, dtype=object)
+    numeros = _mapear_unicos(
+        df["Telefono"], lambda t: "".join(filter(str.isdigit, normalizar_telefono_chile(t)))
+    )
+    filas = df[numeros != ""]
+    if filas.empty:
+        return links
+    nombre = _mapear_unicos(
+        filas["Evento"],
+        lambda n: quote(limpiar_acentos(n) if isinstance(n, str) and n.strip() else "su negocio"),
+    )
+    zona = _mapear_unicos(filas["Ubicacion"], lambda z: quote(z if isinstance(z, str) and z.strip() else "su zona"))
+    campos = {"nombre": nombre, "zona": zona}
+    for categoria, indice in filas.groupby(categorias.loc[filas.index]).groups.items():
+        links.loc[indice] = (
+            "https://wa.me/" + numeros.loc[indice] + "?text="
+            + _rellenar_quoted(PLANTILLAS_WHATSAPP[categoria], campos, indice)
+        )
+    return links
 
 
-COLUMNAS_TEXTO = [c for c in COLUMNAS_REQUERIDAS if c != "Dia_Secuencia"]
+# --- CARGA DE DATOS ---
+# Un solo DataFrame por versión del CSV, compartido por todas las sesiones del
+# proceso (cache_resource no copia): se re-lee solo cuando cambia el archivo
+# (mtime/tamaño) o sus cambios pendientes, no cada pocos segundos. Quien lo
+# use NO debe mutarlo (.copy()).
+@st.cache_resource(max_entries=2 * len(MODOS), show_spinner=False)
+def _leer_base(archivo, mtime_ns, tamano, pendientes, subidos):
+    # Todo como texto y sin NaN: columnas de texto vacías se leían como float,
+    # lo que rompe st.data_editor con TextColumn ("incompatible type").
+    df = pd.read_csv(archivo, dtype=str, keep_default_na=False)
+    # Lo guardado desde el dashboard que ningún worker incorporó todavía al
+    # CSV (ver diario_leads): se muestra ya aplicado. Primero lo que trajo la
+    # sincronización del repo y después lo subido desde este proceso que
+    # todavía no llegó a la copia local.
+    df = diario_leads.aplicar_cambios_pendientes(df, [ruta for ruta, _ in pendientes])
+    for ruta, contenido in subidos:
+        df = diario_leads.aplicar_cambios(df, json.loads(contenido).get("cambios", []), origen=ruta)
+    for col in COLUMNAS_REQUERIDAS:
+        if col not in df.columns: df[col] = ""
+    df["Id"] = pd.to_numeric(df["Id"], errors="coerce").astype("Int64")
+    df["Dia_Secuencia"] = pd.to_numeric(df["Dia_Secuencia"], errors="coerce").fillna(0).astype(int)
+    texto = [c for c in df.columns if c not in ("Id", "Dia_Secuencia")]
+    df[texto] = df[texto].astype(str)
+
+    con_email = df["Email"].str.contains("@", regex=False).to_numpy(dtype=bool)
+    metricas = {
+        "total": len(df),
+        "agendados": int((df["Estado"] == "Agendado").sum()),
+        "en_seguimiento": int((df["Dia_Secuencia"] > 0).sum()),
+        "con_email": int(con_email.sum()),
+        "emails_enviados": int((con_email & (df["Email_Enviado"] == "Si")).sum()),
+    }
+    # Links de contacto armados una vez por versión del CSV (alineados por
+    # índice con df): las tablas solo los toman con .loc sobre sus filas.
+    # No van como columnas de df para que el Editor de Base no los guarde.
+    links = {
+        "whatsapp": links_whatsapp(df, categorias_de(df["Ministerio"], PLANTILLAS_WHATSAPP)),
+        "mailto": links_mailto(df, categorias_de(df["Ministerio"], PLANTILLAS_EMAIL)),
+    }
+    mascaras = {"con_email": con_email, "_prioridad_email": con_email & (df["Email_Enviado"] != "Si").to_numpy()}
+    return {"df": df, "metricas": metricas, "links": links, "consulta": ConsultaLeads(df), "mascaras": mascaras}
+
+
+def _base_vacia():
+    df = pd.DataFrame({col: pd.Series(dtype=str) for col in COLUMNAS_REQUERIDAS})
+    df["Id"] = df["Id"].astype("Int64")
+    df["Dia_Secuencia"] = df["Dia_Secuencia"].astype(int)
+    metricas = {"total": 0, "agendados": 0, "en_seguimiento": 0, "con_email": 0, "emails_enviados": 0}
+    links = {"whatsapp": pd.Series(dtype=object), "mailto": pd.Series(dtype=object)}
+    mascaras = {"con_email": np.zeros(0, dtype=bool), "_prioridad_email": np.zeros(0, dtype=bool)}
+    return {"df": df, "metricas": metricas, "links": links, "consulta": ConsultaLeads(df), "mascaras": mascaras}
+
+
+# Archivos de cambios ya subidos a GitHub desde este proceso que la copia
+# local del repo todavía no trae (no se escriben en disco: chocarían con la
+# sincronización). {archivo: {"firma": (mtime_ns, tamaño) del CSV al subir,
+# "subidos": [(ruta, contenido)]}}. Compartido por todas las sesiones: sin
+# esto, después de guardar se vería (y se volvería a diferenciar contra) la
+# base de antes, y cada guardado repetiría las altas.
+@st.cache_resource(show_spinner=False)
+def _subidos_sin_sincronizar():
+    return {}
+
+
+def _subidos_vigentes(archivo, firma, en_disco):
+    """Lo subido para `archivo` que la copia local todavía no refleja."""
+    entrada = _subidos_sin_sincronizar().get(archivo)
+    if not entrada:
+        return ()
+    if entrada["firma"] != firma:
+        # La copia local avanzó a un commit posterior a la subida: o trae el
+        # archivo de cambios, o un worker ya lo aplicó al CSV.
+        _subidos_sin_sincronizar().pop(archivo, None)
+        return ()
+    return tuple((ruta, contenido) for ruta, contenido in entrada["subidos"] if ruta not in en_disco)
+
+
+def cargar_base(archivo):
+    """{"df", "metricas", ...} del CSV actual; solo se parsea si el archivo (o sus cambios pendientes) cambió."""
+    try:
+        stat = os.stat(archivo)
+    except FileNotFoundError:
+        return _base_vacia()
+    rutas = diario_leads.rutas_cambios_pendientes(archivo)
+    pendientes = tuple((ruta, os.stat(ruta).st_size) for ruta in rutas)
+    subidos = _subidos_vigentes(archivo, (stat.st_mtime_ns, stat.st_size), set(rutas))
+    return _leer_base(archivo, stat.st_mtime_ns, stat.st_size, pendientes, subidos)
 
 
-# --- CARGA DE DATOS ---
-@st.cache_data(ttl=2)
-def cargar_datos(archivo):
-    if os.path.exists(archivo):
-        df = pd.read_csv(archivo)
-        for col in COLUMNAS_REQUERIDAS:
-            if col not in df.columns: df[col] = 0 if col == "Dia_Secuencia" else ""
-        # Columnas de texto con celdas vacías se leen como float (NaN) en vez de
-        # string, lo que rompe st.data_editor con TextColumn ("incompatible type").
-        for col in COLUMNAS_TEXTO:
-            df[col] = df[col].fillna("").astype(str)
-        return df
-    return pd.DataFrame(columns=COLUMNAS_REQUERIDAS)
+def guardar_cambios(archivo, original, editado):
+    """
+    Sube solo lo que cambió entre `original` (la base cargada) y `editado`,
+    como un archivo de cambios pendientes (ver diario_leads). Devuelve la
+    cantidad de cambios, o None si no se pudo guardar (el error ya se mostró).
+    """
+    try:
+        cambios = diario_leads.calcular_cambios(original, editado)
+    except ValueError as e:
+        st.error(f"❌ No se guardó: {e}")
+        return None
+    if not cambios:
+        return 0
+    ruta, contenido = diario_leads.armar_cambios_pendientes(archivo, cambios)
+    if not push_to_github({ruta.replace(os.sep, "/"): contenido}):
+        return None
+    try:
+        stat = os.stat(archivo)
+        firma = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        firma = None
+    entrada = _subidos_sin_sincronizar().setdefault(archivo, {"firma": firma, "subidos": []})
+    if entrada["firma"] != firma:
+        entrada.update(firma=firma, subidos=[])
+    entrada["subidos"].append((ruta, contenido))
+    return len(cambios)
 
 # --- SIDEBAR & NAVEGACIÓN ---
 with st.sidebar:
@@ -407,10 +578,11 @@ with st.sidebar:
     unidad = st.selectbox("🎯 Unidad de Negocio", list(MODOS.keys()))
     archivo_actual = MODOS[unidad]
     
-    df_actual = cargar_datos(archivo_actual)
-    
-    total_leads = len(df_actual)
-    exitos = len(df_actual[df_actual["Estado"] == "Agendado"])
+    base_actual = cargar_base(archivo_actual)
+    df_actual, metricas = base_actual["df"], base_actual["metricas"]
+
+    total_leads = metricas["total"]
+    exitos = metricas["agendados"]
     
     st.metric("Prospectos Totales", total_leads)
     st.metric("Casos de Éxito 🏆", exitos)
@@ -447,14 +619,13 @@ t3 = tabs[2] if AGENT_SERVICE_URL else None
 t4 = tabs[-1]
 
 with t1:
-    con_email = df_actual["Email"].astype(str).str.contains("@", na=False)
     col_a, col_b, col_c, col_d, col_e = st.columns(5)
 
     with col_a: st.metric("Cartera", total_leads)
     with col_b: st.metric("Agendados", exitos)
     with col_c: st.metric("Conversión", f"{(exitos/total_leads*100) if total_leads > 0 else 0:.1f}%")
-    with col_d: st.metric("En Seguimiento", len(df_actual[df_actual["Dia_Secuencia"] > 0]))
-    with col_e: st.metric("📧 Con Email", int(con_email.sum()))
+    with col_d: st.metric("En Seguimiento", metricas["en_seguimiento"])
+    with col_e: st.metric("📧 Con Email", metricas["con_email"])
 
     col_busqueda, col_filtro = st.columns([3, 1])
     with col_busqueda:
@@ -462,35 +633,43 @@ with t1:
     with col_filtro:
         solo_con_email = st.checkbox("Solo con email")
 
+    col_orden, col_filas, col_pagina = st.columns([2, 1, 1])
+    with col_orden:
+        # Por defecto, primero quienes tienen email y aún no fueron contactados por ese canal.
+        etiqueta_orden = st.selectbox("Ordenar por", list(ORDENES_DASHBOARD.keys()))
+    with col_filas:
+        por_pagina = st.selectbox("Filas por página", FILAS_POR_PAGINA, index=1)
+
+    # La búsqueda, el filtro y el orden se resuelven sobre índices precalculados
+    # (ver consulta_leads): solo las filas de la página visible se copian y se
+    # mandan al navegador.
+    consulta = base_actual["consulta"]
+    columnas_orden, ascendente = ORDENES_DASHBOARD[etiqueta_orden]
+    orden = consulta.orden(columnas_orden, ascendente, extras=base_actual["mascaras"])
+    filtro = base_actual["mascaras"]["con_email"] if solo_con_email else None
+    coincidencias = consulta.filtrar(busqueda, filtro, orden)
+    total_filtrado = len(coincidencias)
+    paginas = max(1, -(-total_filtrado // por_pagina))
+    with col_pagina:
+        # La key cambia con la consulta: al buscar otra cosa se vuelve a la página 1.
+        pagina = st.number_input(
+            "Página", min_value=1, max_value=paginas, value=1, step=1,
+            key=f"pagina_{unidad}_{busqueda}_{solo_con_email}_{etiqueta_orden}_{por_pagina}",
+        )
+    posiciones = coincidencias[(pagina - 1) * por_pagina:pagina * por_pagina]
+
     st.caption(
+        f"Mostrando {len(posiciones)} de {total_filtrado} prospectos (página {pagina} de {paginas}). "
         "⚠️ El botón WhatsApp \"Chat Directo\" es para casos puntuales/emergencias — el "
         "sistema automático ya gestiona el contacto normal de cada lead."
     )
 
-    df_f = df_actual.copy()
-    if busqueda:
-        df_f = df_f[df_f['Evento'].str.contains(busqueda, case=False, na=False) |
-                    df_f['Ubicacion'].str.contains(busqueda, case=False, na=False)]
-    if solo_con_email:
-        df_f = df_f[df_f["Email"].astype(str).str.contains("@", na=False)]
-
-    df_display = df_f.copy()
-    df_display["WhatsApp"] = df_display.apply(
-        lambda r: format_whatsapp_link(r["Telefono"], r["Evento"], r["Ubicacion"], r["Ministerio"]), axis=1
-    )
+    df_display = df_actual.iloc[posiciones].copy()
+    df_display["WhatsApp"] = base_actual["links"]["whatsapp"].iloc[posiciones].to_numpy()
 
     # Configuración dinámica de progreso según la línea
     max_secuencia = 2 if "Almacenes" in unidad else 4
 
-    # Prioriza en la vista a quienes tienen email y aún no fueron contactados por ese canal.
-    df_display["_prioridad_email"] = (
-        df_display["Email"].astype(str).str.contains("@", na=False)
-        & (df_display["Email_Enviado"] != "Si")
-    )
-    df_display = df_display.sort_values(
-        by=["_prioridad_email", "Estado"], ascending=[False, False]
-    ).drop(columns="_prioridad_email")
-
     st.dataframe(
         df_display,
         use_container_width=True,
@@ -524,17 +703,22 @@ with t1:
 
 with t2:
     st.warning(f"⚠️ Estás editando el archivo: {archivo_actual}")
-    df_edit = st.data_editor(df_actual, num_rows="dynamic", use_container_width=True, hide_index=True)
+    df_edit = st.data_editor(
+        df_actual, num_rows="dynamic", use_container_width=True, hide_index=True,
+        # La clave de las altas no se edita (ver diario_leads).
+        column_config={diario_leads.COLUMNA_CLAVE_ALTA: None},
+    )
     
     if st.button("💾 GUARDAR CAMBIOS Y SUBIR A GITHUB"):
-        df_edit.to_csv(archivo_actual, index=False)
         with st.spinner("Actualizando repositorio..."):
-            csv_content = df_edit.to_csv(index=False)
-            if push_to_github(archivo_actual, csv_content):
-                st.success(f"✅ ¡{archivo_actual} actualizado con éxito!")
-                time.sleep(1)
-                st.rerun()
-            # Si falló, push_to_github ya mostró el detalle del error (status HTTP, etc.)
+            n_cambios = guardar_cambios(archivo_actual, df_actual, df_edit)
+        if n_cambios == 0:
+            st.info("No hay cambios para guardar.")
+        elif n_cambios:
+            st.success(f"✅ {n_cambios} cambios de {archivo_actual} subidos; los workers los incorporan al CSV en su próximo ciclo.")
+            time.sleep(1)
+            st.rerun()
+        # Si falló, guardar_cambios / push_to_github ya mostraron el detalle del error
 
 if t3 is not None:
     with t3:
@@ -542,10 +726,26 @@ if t3 is not None:
             "Estos borradores fueron redactados por IA a partir de respuestas reales de WhatsApp. "
             "Revísalos y edítalos antes de aprobar — nada se envía sin tu aprobación."
         )
+        # Pila de cursores de las páginas visitadas (None = primera página),
+        # para poder volver atrás con paginación por cursor.
+        cursores = st.session_state.setdefault("bandeja_cursores", [None])
         if st.button("🔄 Actualizar bandeja"):
             st.rerun()
 
-        borradores = obtener_borradores_pendientes()
+        borradores, cursor_siguiente = obtener_borradores_pendientes(cursores[-1])
+
+        col_ant, col_pag, col_sig = st.columns([1, 2, 1])
+        with col_ant:
+            if len(cursores) > 1 and st.button("◀ Anterior", key="bandeja_anterior"):
+                cursores.pop()
+                st.rerun()
+        with col_pag:
+            st.caption(f"Página {len(cursores)} · {BANDEJA_POR_PAGINA} por página")
+        with col_sig:
+            if cursor_siguiente and st.button("Siguiente ▶", key="bandeja_siguiente"):
+                cursores.append(cursor_siguiente)
+                st.rerun()
+
         if borradores is None:
             pass
         elif not borradores:
@@ -597,8 +797,8 @@ with t4:
 
     df_email = df_actual[df_actual["Email"].astype(str).str.contains("@", na=False)].copy()
 
-    total_con_email = len(df_email)
-    enviados = int((df_email["Email_Enviado"] == "Si").sum()) if total_con_email else 0
+    total_con_email = metricas["con_email"]
+    enviados = metricas["emails_enviados"]
     pendientes = total_con_email - enviados
 
     col_m1, col_m2, col_m3 = st.columns(3)
@@ -616,9 +816,7 @@ with t4:
         if df_email.empty:
             st.success("📭 No quedan prospectos con email pendientes de contactar.")
         else:
-            df_email["Redactar"] = df_email.apply(
-                lambda r: generar_mailto(r["Email"], r["Evento"], r["Ubicacion"], r["Ministerio"]), axis=1
-            )
+            df_email["Redactar"] = base_actual["links"]["mailto"].loc[df_email.index]
             df_email = df_email.sort_values(by="Ubicacion")
 
             columnas_email = ["Evento", "Ubicacion", "Email", "Redactar", "Email_Enviado", "Notas"]
@@ -642,13 +840,15 @@ with t4:
                 df_guardar = df_actual.copy()
                 df_guardar.loc[edited.index, "Email_Enviado"] = edited["Email_Enviado"]
                 df_guardar.loc[edited.index, "Notas"] = edited["Notas"]
-                df_guardar.to_csv(archivo_actual, index=False)
                 with st.spinner("Sincronizando con GitHub..."):
-                    if push_to_github(archivo_actual, df_guardar.to_csv(index=False)):
-                        st.success("✅ Seguimiento guardado.")
-                        time.sleep(1)
-                        st.rerun()
-                    # Si falló, push_to_github ya mostró el detalle del error (status HTTP, etc.)
+                    n_cambios = guardar_cambios(archivo_actual, df_actual, df_guardar)
+                if n_cambios == 0:
+                    st.info("No hay cambios para guardar.")
+                elif n_cambios:
+                    st.success("✅ Seguimiento guardado.")
+                    time.sleep(1)
+                    st.rerun()
+                # Si falló, guardar_cambios / push_to_github ya mostraron el detalle del error
 
 st.markdown("---")
 st.caption("ServiGod Pro System - Inteligencia de Negocios Chilena.")
\ No newline at end of file
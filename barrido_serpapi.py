@@ -0,0 +1,291 @@
+"""
+Paginación de búsquedas de SerpAPI (google_maps) guiada por rendimiento.
+
+Antes cada búsqueda pedía una sola página (num 15/20), así que en comunas
+densas (Providencia, Las Condes) el combo comuna+término quedaba "cubierto"
+habiendo visto solo los primeros resultados. buscar_paginado sigue pidiendo
+la página siguiente (según el "start" que indica serpapi_pagination.next)
+mientras cada crédito gastado siga trayendo al menos
+SERPAPI_MIN_NUEVOS_POR_CREDITO leads nuevos, con un tope de
+SERPAPI_MAX_PAGINAS_POR_CICLO páginas por ciclo. Las páginas que vienen del
+cache de serpapi_cache no gastan crédito y no cortan la paginación.
+
+También lleva el barrido comuna × término de ambas líneas (el estado vive en
+cobertura_clinicas.json / cobertura_almacenes.json): cada "vuelta" recorre
+todas las combinaciones una vez, pero en vez de un orden al azar las
+pendientes se ordenan por rendimiento esperado (leads nuevos por página
+buscada, historial con descuento por combo) más un bono de exploración tipo
+UCB1, así el cupo de LIMITE_MENSUAL_SERPAPI va primero a los combos que
+todavía traen leads y los que devolvieron 0 quedan al final de la vuelta.
+Además, al armar una vuelta nueva, los combos con historial de rendimiento
+bajo solo se incluyen con probabilidad BARRIDO_PROB_REVISITA (exploración),
+en vez de gastar un crédito en cada uno en todas las vueltas.
+"""
+import json
+import logging
+import math
+import os
+import random
+from urllib.parse import parse_qs, urlparse
+
+import serpapi_cache
+
+SERPAPI_MAX_PAGINAS_POR_CICLO = int(os.getenv("SERPAPI_MAX_PAGINAS_POR_CICLO", "3"))
+SERPAPI_MIN_NUEVOS_POR_CREDITO = float(os.getenv("SERPAPI_MIN_NUEVOS_POR_CREDITO", "3"))
+# Peso del bono de exploración (0 = ordenar solo por rendimiento histórico).
+BARRIDO_EXPLORACION = float(os.getenv("BARRIDO_EXPLORACION", "1"))
+# Cuánto pesa el historial previo de un combo cada vez que se vuelve a buscar:
+# los leads de un combo se agotan a medida que se buscan, lo reciente pesa más.
+BARRIDO_DESCUENTO = float(os.getenv("BARRIDO_DESCUENTO", "0.8"))
+# Un combo ya buscado que rinde menos que esto (leads nuevos por página) entra
+# a la vuelta siguiente solo con probabilidad BARRIDO_PROB_REVISITA.
+BARRIDO_MIN_RENDIMIENTO = float(os.getenv("BARRIDO_MIN_RENDIMIENTO", "1"))
+BARRIDO_PROB_REVISITA = float(os.getenv("BARRIDO_PROB_REVISITA", "0.25"))
+
+
+def siguiente_start(respuesta):
+    """Offset de la página siguiente según serpapi_pagination.next, o None si no hay más."""
+    siguiente = (respuesta.get("serpapi_pagination") or {}).get("next")
+    if not siguiente:
+        return None
+    start = parse_qs(urlparse(siguiente).query).get("start")
+    try:
+        return int(start[0]) if start else None
+    except ValueError:
+        return None
+
+
+def buscar_paginado(params, procesar_pagina, reservar=None, start=0, max_paginas=None):
+    """
+    Pide páginas de `params` desde el offset `start` y llama a
+    procesar_pagina(local_results) -> cantidad de leads nuevos de esa página.
+
+    Devuelve un dict con:
+      - "resultado": "ok", "sin_resultados", "cuota_agotada" (SerpAPI devolvió
+        {"error": ...}), "presupuesto_agotado" o "sin_grabacion" (ver
+        serpapi_cache.buscar), según la última página pedida;
+      - "paginas": páginas efectivamente procesadas; "creditos": cuántas de
+        ellas se pidieron a la API (no vinieron del cache);
+      - "nuevos": leads nuevos en total;
+      - "siguiente_start": offset desde donde conviene seguir en un próximo
+        ciclo (todavía rendía y se cortó por tope de páginas o presupuesto),
+        o None si el combo quedó agotado (no hay más páginas o rinde poco).
+    Los errores de red se propagan como excepción.
+    """
+    max_paginas = SERPAPI_MAX_PAGINAS_POR_CICLO if max_paginas is None else max_paginas
+    avance = {"resultado": "sin_resultados", "paginas": 0, "creditos": 0, "nuevos": 0, "siguiente_start": start}
+    while avance["paginas"] < max_paginas:
+        params_pagina = dict(params, start=start) if start else dict(params)
+        respuesta, origen = serpapi_cache.buscar(params_pagina, reservar=reservar)
+        if respuesta is None:
+            avance["resultado"] = origen
+            return avance
+        if "error" in respuesta:
+            # SerpAPI devuelve HTTP 200 con {"error": "..."} en casos de cuota
+            # agotada / api_key inválida, distinto de "sin resultados".
+            print(f"🚫 SerpAPI error: {respuesta['error']}")
+            avance["resultado"] = "cuota_agotada"
+            return avance
+
+        resultados = respuesta.get("local_results", [])
+        nuevos = procesar_pagina(resultados)
+        avance["paginas"] += 1
+        avance["creditos"] += origen == "api"
+        avance["nuevos"] += nuevos
+        if avance["nuevos"]:
+            avance["resultado"] = "ok"
+        print(f"📄 Página {start // 20 + 1} (start={start}): {len(resultados)} resultados, {nuevos} leads nuevos.")
+
+        start = siguiente_start(respuesta)
+        avance["siguiente_start"] = start
+        if start is None:
+            break
+        if origen == "api" and nuevos < SERPAPI_MIN_NUEVOS_POR_CREDITO:
+            print(f"📉 Rendimiento bajo ({nuevos} nuevos por crédito < {SERPAPI_MIN_NUEVOS_POR_CREDITO:g}), "
+                  f"no se sigue paginando.")
+            avance["siguiente_start"] = None
+            break
+    return avance
+
+
+# --- ESTADO DEL BARRIDO (cobertura_*.json) ---
+def _cargar_cobertura(archivo):
+    if os.path.exists(archivo):
+        try:
+            with open(archivo, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            logging.exception("No se pudo leer %s, se reconstruye desde cero.", archivo)
+    return None
+
+
+def _guardar_cobertura(archivo, estado):
+    try:
+        with open(f"{archivo}.tmp", "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False, indent=2)
+        os.replace(f"{archivo}.tmp", archivo)
+    except Exception:
+        logging.exception("No se pudo escribir %s.", archivo)
+
+
+def _clave_combo(zona, termino):
+    return f"{zona}|{termino}"
+
+
+def _en_curso(estado):
+    """
+    Combos que quedaron a medias (todavía rendían y se cortaron por tope de
+    páginas o presupuesto): {"zona|termino": {"start": offset, "paginas": n}}.
+    Acepta el formato anterior, de un solo combo: {"combo": [...], "start", "paginas"}.
+    """
+    en_curso = estado.get("en_curso") or {}
+    if "combo" in en_curso:
+        en_curso = {_clave_combo(*en_curso["combo"]): {"start": en_curso.get("start", 0),
+                                                       "paginas": en_curso.get("paginas", 0)}}
+    estado["en_curso"] = en_curso
+    return en_curso
+
+
+def _combos_de_vuelta(estado, vigentes):
+    estadisticas = estado.get("estadisticas", {})
+    combos = []
+    for combo in vigentes:
+        e = estadisticas.get(_clave_combo(*combo))
+        if not e or not e["paginas"] or e["nuevos"] / e["paginas"] >= BARRIDO_MIN_RENDIMIENTO:
+            combos.append(combo)
+        elif random.random() < BARRIDO_PROB_REVISITA:
+            combos.append(combo)
+    random.shuffle(combos)
+    return combos
+
+
+def _ordenar_pendientes(estado):
+    """
+    Ordena las pendientes por puntaje (mayor primero): rendimiento medio del
+    combo suavizado hacia una media "a priori" + bono UCB1, que favorece a
+    los combos con pocas páginas buscadas. La media a priori de un combo es
+    el promedio de lo que rinden su comuna y su término en los demás combos:
+    así, antes de buscarlo por primera vez, "Spa Facial en Las Condes" ya
+    hereda que Las Condes es densa y que "Spa Facial" trae leads.
+    """
+    estadisticas = estado.get("estadisticas", {})
+    total_paginas = sum(e["paginas"] for e in estadisticas.values())
+    if not total_paginas:
+        return
+    media_global = sum(e["nuevos"] for e in estadisticas.values()) / total_paginas
+
+    por_parte = {}
+    for clave, e in estadisticas.items():
+        zona, termino = clave.split("|", 1)
+        for parte in (("zona", zona), ("termino", termino)):
+            acumulado = por_parte.setdefault(parte, [0.0, 0.0])
+            acumulado[0] += e["nuevos"]
+            acumulado[1] += e["paginas"]
+
+    def media_parte(parte):
+        nuevos, paginas = por_parte.get(parte, (0.0, 0.0))
+        return (nuevos + media_global) / (paginas + 1)
+
+    def puntaje(combo):
+        zona, termino = combo
+        e = estadisticas.get(_clave_combo(zona, termino), {"paginas": 0, "nuevos": 0})
+        a_priori = (media_parte(("zona", zona)) + media_parte(("termino", termino))) / 2
+        media = (e["nuevos"] + a_priori) / (e["paginas"] + 1)
+        bono = BARRIDO_EXPLORACION * media_global * math.sqrt(math.log(1 + total_paginas) / (1 + e["paginas"]))
+        return media + bono
+
+    # sort es estable: los empates conservan el orden al azar de la vuelta.
+    estado["pendientes"].sort(key=puntaje, reverse=True)
+
+
+def siguientes_combos(archivo, combos, cantidad=1):
+    """
+    Devuelve hasta `cantidad` combos [(zona, termino, start), ...] a buscar,
+    sin marcarlos aún como cubiertos (eso lo hace registrar_busquedas una vez
+    que las búsquedas efectivamente corrieron). `combos` es la lista completa
+    [[zona, termino], ...] de la línea; al agotar las pendientes comienza una
+    vuelta nueva automáticamente. Primero van los combos que un ciclo anterior
+    dejó a medias (todavía rendían), desde su `start`; después, los de mayor
+    rendimiento esperado. Nunca mezcla combos de dos vueltas en un lote.
+    """
+    estado = _cargar_cobertura(archivo) or {}
+    vigentes = [list(c) for c in combos]
+    # Combos que ya no están en la configuración (comuna o término quitado) se descartan.
+    estado["pendientes"] = [c for c in estado.get("pendientes", []) if c in vigentes]
+    while not estado["pendientes"] and vigentes:
+        estado["pendientes"] = _combos_de_vuelta(estado, vigentes)
+        estado["vuelta"] = estado.get("vuelta", 0) + 1
+        estado["en_curso"] = {}
+        omitidos = len(vigentes) - len(estado["pendientes"])
+        print(f"🔄 Iniciando vuelta de barrido exhaustivo N°{estado['vuelta']} "
+              f"({len(estado['pendientes'])} combinaciones comuna+término"
+              + (f"; {omitidos} omitidas por rendir poco)." if omitidos else ")."))
+
+    _ordenar_pendientes(estado)
+    en_curso = _en_curso(estado)
+    pendientes = set(_clave_combo(*c) for c in estado["pendientes"])
+    for clave in [c for c in en_curso if c not in pendientes]:
+        del en_curso[clave]
+    # sort estable: los combos a medias adelante, el resto queda en orden de puntaje.
+    estado["pendientes"].sort(key=lambda c: _clave_combo(*c) not in en_curso)
+    _guardar_cobertura(archivo, estado)
+
+    elegidos = []
+    for zona, termino in estado["pendientes"][:cantidad]:
+        clave = _clave_combo(zona, termino)
+        start = en_curso.get(clave, {}).get("start", 0)
+        stats = estado.get("estadisticas", {}).get(clave)
+        historial = f", historial {stats['nuevos']:.1f} nuevos/{stats['paginas']:.1f} págs." if stats else ""
+        print(f"📍 Combinación elegida (vuelta {estado['vuelta']}, quedan "
+              f"{len(estado['pendientes'])} por cubrir{historial}): {termino} en {zona}"
+              + (f" (continúa desde start={start})" if start else ""))
+        elegidos.append((zona, termino, start))
+    return elegidos
+
+
+def siguiente_combo(archivo, combos):
+    """(zona, termino, start) del próximo combo a buscar (ver siguientes_combos)."""
+    return siguientes_combos(archivo, combos, 1)[0]
+
+
+def registrar_busquedas(archivo, busquedas):
+    """
+    Actualiza el estado del barrido, en una sola escritura, con el resultado
+    de cada búsqueda [(zona, termino, avance), ...] (avance de buscar_paginado):
+      - suma las páginas y leads nuevos al historial del combo (con descuento);
+      - si SerpAPI respondió y el combo quedó agotado, lo saca de pendientes y
+        registra en "profundidad" cuántas páginas se recorrieron en la vuelta;
+      - si todavía rendía y se cortó por tope de páginas o presupuesto, lo deja
+        pendiente en "en_curso" con el offset para seguir el próximo ciclo;
+      - si hubo cuota agotada o error de red sin páginas procesadas, no toca
+        nada: se reintenta en el próximo ciclo en vez de darlo por cubierto
+        sin haberlo buscado realmente.
+    """
+    estado = _cargar_cobertura(archivo)
+    if not estado:
+        return
+    en_curso = _en_curso(estado)
+    estadisticas = estado.setdefault("estadisticas", {})
+    for zona, termino, avance in busquedas:
+        if [zona, termino] not in estado.get("pendientes", []) or not avance.get("paginas"):
+            continue
+        clave = _clave_combo(zona, termino)
+        stats = estadisticas.get(clave, {"paginas": 0, "nuevos": 0, "busquedas": 0})
+        estadisticas[clave] = {
+            "paginas": round(stats["paginas"] * BARRIDO_DESCUENTO + avance["paginas"], 3),
+            "nuevos": round(stats["nuevos"] * BARRIDO_DESCUENTO + avance["nuevos"], 3),
+            "busquedas": stats["busquedas"] + 1,
+        }
+
+        paginas = en_curso.pop(clave, {}).get("paginas", 0) + avance["paginas"]
+        if avance["resultado"] in ("ok", "sin_resultados") and avance["siguiente_start"] is None:
+            estado["pendientes"].remove([zona, termino])
+            estado.setdefault("profundidad", {})[clave] = paginas
+        else:
+            en_curso[clave] = {"start": avance["siguiente_start"], "paginas": paginas}
+    _guardar_cobertura(archivo, estado)
+
+
+def registrar_busqueda(archivo, zona, termino, avance):
+    """Registra una sola búsqueda (ver registrar_busquedas)."""
+    registrar_busquedas(archivo, [(zona, termino, avance)])
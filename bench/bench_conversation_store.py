@@ -0,0 +1,77 @@
+"""
+Benchmark de conversation_store: una conexión nueva por llamada (como era
+antes) contra la conexión por thread reutilizada en modo WAL (la actual).
+
+Cada modo usa su propio archivo de base en un directorio temporal (el modo
+WAL queda grabado en el archivo). Se mide cuántos pares guardar_mensaje +
+historial_conversacion(20) por segundo salen con 1 thread y con 4 threads
+concurrentes, que es el patrón del webhook y los workers de borradores.
+
+Uso: python bench/bench_conversation_store.py [pares]   (por defecto 2000)
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversation_store
+
+THREADS = 4
+TELEFONOS = 50
+
+
+@contextmanager
+def _conn_por_llamada():
+    """El _conn() de antes: abre y cierra el archivo en cada sentencia."""
+    conn = sqlite3.connect(conversation_store.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _pares(cantidad, desplazamiento=0):
+    for i in range(cantidad):
+        telefono = f"569{(i + desplazamiento) % TELEFONOS:08d}"
+        conversation_store.guardar_mensaje(telefono, "in", "hola " * 10)
+        conversation_store.historial_conversacion(telefono, 20)
+
+
+def medir(pares):
+    t = time.perf_counter()
+    _pares(pares)
+    un_thread = pares / (time.perf_counter() - t)
+
+    por_thread = pares // THREADS
+    threads = [threading.Thread(target=_pares, args=(por_thread, k)) for k in range(THREADS)]
+    t = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    varios = por_thread * THREADS / (time.perf_counter() - t)
+    return un_thread, varios
+
+
+def main():
+    pares = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    conn_actual = conversation_store._conn
+    with tempfile.TemporaryDirectory() as tmp:
+        for modo, conn in (("por llamada", _conn_por_llamada), ("thread-local WAL", conn_actual)):
+            conversation_store.DB_PATH = os.path.join(tmp, f"{modo.split()[0]}.db")
+            conversation_store._conn = conn
+            conversation_store.inicializar_db()
+            un_thread, varios = medir(pares)
+            print(f"{modo:16} | 1 thread {un_thread:8.0f} pares/s | {THREADS} threads {varios:8.0f} pares/s")
+        conversation_store._conn = conn_actual
+
+
+if __name__ == "__main__":
+    main()
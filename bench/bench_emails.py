@@ -0,0 +1,114 @@
+"""
+Micro-benchmark del escáner de emails en streaming (extractor_emails) contra
+lo de antes: decodificar la página completa y correr el regex sobre todo el
+texto (_extraer_emails_de_html de worker.py).
+
+Sin red. Con un directorio, corre sobre las páginas guardadas ahí (*.html,
+por ejemplo con `curl -o` desde los sitios de los leads). No se incluye un
+corpus en el repo porque esas páginas traen emails y teléfonos de terceros.
+Sin directorio, las páginas se arman en memoria (semilla fija). Imitan lo
+único que mueve el costo de ambos extractores: el tamaño de la página y la
+posición del primer email prioritario. Por eso incluyen imágenes inline en
+base64, texto de relleno y el email en el header, en el footer, en un mailto
+con %40, o ninguno. El escáner recibe chunks de 16 KB, como en
+_email_en_pagina, y se corta en EMAIL_MAX_BYTES o apenas encuentra un email
+prioritario.
+
+Uso: python bench/bench_emails.py [repeticiones] [directorio]   (por defecto 5, páginas sintéticas)
+"""
+import base64
+import glob
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor_emails import EMAIL_MAX_BYTES, _EscanerEmails
+
+CHUNK = 16 * 1024
+
+
+def _extraer_emails_de_html(html):
+    """El extractor de antes (worker.py), sobre el texto completo."""
+    emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', html)
+    filtrados = [e for e in emails if not e.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg'))]
+    if not filtrados:
+        return ""
+    prioritarios = [e for e in filtrados if any(p in e.lower() for p in ['contacto', 'info', 'ventas'])]
+    return (prioritarios[0] if prioritarios else filtrados[0]).lower()
+
+
+def _escanear(pagina):
+    escaner = _EscanerEmails()
+    leidos = 0
+    for i in range(0, len(pagina), CHUNK):
+        chunk = pagina[i:i + CHUNK]
+        leidos += len(chunk)
+        if escaner.alimentar(chunk) or leidos >= EMAIL_MAX_BYTES:
+            break
+    else:
+        escaner.alimentar(b"", final=True)
+    return escaner.resultado()
+
+
+def generar_paginas(semilla=1):
+    rng = random.Random(semilla)
+
+    def imagen(n):
+        return b'<img src="data:image/png;base64,' + base64.b64encode(rng.randbytes(n)) + b'">'
+
+    def relleno(n):
+        return b"<p>Lorem ipsum dolor sit amet, clinica estetica providencia. </p>\n" * (n // 64)
+
+    return {
+        "chica_footer": b"<html><body>" + relleno(40_000) + b"<footer>Escribanos: contacto@clinicasol.cl</footer></body></html>",
+        "landing_4mb_header": (
+            b'<html><header><a href="mailto:info@esteticalux.cl">info@esteticalux.cl</a></header>'
+            + b"".join(imagen(300_000) for _ in range(10)) + b"<footer>rrhh@esteticalux.cl</footer></html>"
+        ),
+        "landing_3mb_sin_email": b"<html>" + b"".join(imagen(250_000) for _ in range(9)) + relleno(20_000) + b"</html>",
+        "base64_400kb_footer": b"<html>" + imagen(300_000) + b"<p>logo@2x.png</p><p>gerencia@spa.cl</p></html>",
+        "mailto_codificado": (
+            b"<html>" + relleno(30_000) + b'<a href="mailto:ventas%40depilacion.cl?subject=Hola">Escribenos</a></html>'
+        ),
+        "sin_prioritario": b"<html>" + relleno(80_000) + b"dr.perez@gmail.com y luego recepcion@centro.cl</html>",
+    }
+
+
+def cargar_paginas(directorio):
+    paginas = {}
+    for ruta in sorted(glob.glob(os.path.join(directorio, "*.html"))):
+        with open(ruta, "rb") as f:
+            paginas[os.path.splitext(os.path.basename(ruta))[0][:22]] = f.read()
+    if not paginas:
+        sys.exit(f"No hay páginas *.html en {directorio}.")
+    return paginas
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    paginas = cargar_paginas(sys.argv[2]) if len(sys.argv) > 2 else generar_paginas()
+    totales = [0.0, 0.0]
+    print(f"{'página':22} {'KB':>6} | {'antes':>9} | {'streaming':>9} | email (antes / streaming)")
+    for nombre, pagina in paginas.items():
+        t = time.perf_counter()
+        for _ in range(repeticiones):
+            antes = _extraer_emails_de_html(pagina.decode("utf-8", "replace"))
+        t_antes = (time.perf_counter() - t) / repeticiones * 1000
+
+        t = time.perf_counter()
+        for _ in range(repeticiones):
+            ahora = _escanear(pagina)
+        t_ahora = (time.perf_counter() - t) / repeticiones * 1000
+
+        totales[0] += t_antes
+        totales[1] += t_ahora
+        print(f"{nombre:22} {len(pagina) // 1024:6} | {t_antes:6.1f} ms | {t_ahora:6.2f} ms | {antes or '-'} / {ahora or '-'}")
+    print(f"{'total':29} | {totales[0]:6.1f} ms | {totales[1]:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark de la búsqueda del lead por teléfono en agent_service.
+
+Compara, con los dos CSV de leads del mismo tamaño (sintéticos, semilla fija):
+  - antes: cada webhook leía los CSV completos con pd.read_csv y normalizaba
+    el teléfono fila por fila hasta encontrar el lead;
+  - reconstrucción: lo que paga el primer webhook (o /pending-drafts) después
+    de que un worker commitea los CSV (_obtener_indice_telefonos);
+  - búsqueda: el resto de las llamadas, un get en el dict.
+Verifica además que el índice devuelva la misma línea y contexto que antes
+para una muestra de teléfonos.
+
+Uso: python bench/bench_indice_telefonos.py [filas ...]   (por defecto 1000 10000 100000)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import agent_service
+from evo_client import normalizar_telefono_chile
+
+
+def _buscar_antes(telefono):
+    """La búsqueda de antes del índice: read_csv completo por llamada."""
+    for linea, archivo in agent_service.CSVS_POR_LINEA.items():
+        df = pd.read_csv(archivo)
+        coincide = df["Telefono"].astype(str).apply(normalizar_telefono_chile) == telefono
+        if coincide.any():
+            fila = df[coincide].iloc[0]
+            return linea, {c: fila[c] for c in agent_service._COLUMNAS_CONTEXTO_LEAD}
+    return None, {}
+
+
+def generar_csvs(directorio, filas, rng):
+    csvs = {}
+    for linea in agent_service.CSVS_POR_LINEA:
+        archivo = os.path.join(directorio, f"{linea}.csv")
+        pd.DataFrame({
+            "Id": range(1, filas + 1),
+            "Evento": [f"Lead {linea} {i}" for i in range(filas)],
+            "Ubicacion": rng.choices(["Providencia", "Ñuñoa", "Maipú", "Las Condes"], k=filas),
+            "Estado": rng.choices(["Nuevo", "Contactado", "Finalizado"], k=filas),
+            "Telefono": [rng.choice(["+56 9 ", "9", "09", ""]) + str(rng.randint(10 ** 7, 10 ** 8 - 1)) for _ in range(filas)],
+            "Dia_Secuencia": rng.choices(range(5), k=filas),
+        }).to_csv(archivo, index=False)
+        csvs[linea] = archivo
+    return csvs
+
+
+def main():
+    tamanos = [int(n) for n in sys.argv[1:]] or [1000, 10000, 100000]
+    rng = random.Random(1)
+    csvs_originales = agent_service.CSVS_POR_LINEA
+    with tempfile.TemporaryDirectory() as tmp:
+        for filas in tamanos:
+            agent_service.CSVS_POR_LINEA = generar_csvs(tmp, filas, rng)
+            muestra = [
+                normalizar_telefono_chile(t)
+                for archivo in agent_service.CSVS_POR_LINEA.values()
+                for t in pd.read_csv(archivo)["Telefono"].sample(3, random_state=filas)
+            ]
+
+            t = time.perf_counter()
+            antes = [_buscar_antes(tel) for tel in muestra]
+            t_antes = (time.perf_counter() - t) / len(muestra)
+
+            agent_service._indice_telefonos["firma"] = None
+            t = time.perf_counter()
+            agent_service._obtener_indice_telefonos()
+            t_reconstruir = time.perf_counter() - t
+
+            t = time.perf_counter()
+            for _ in range(100):
+                ahora = [agent_service._buscar_lead_por_telefono(tel) for tel in muestra]
+            t_buscar = (time.perf_counter() - t) / (100 * len(muestra))
+
+            iguales = [(linea, contexto) for linea, _archivo, contexto in ahora] == antes
+            print(
+                f"{filas:>7} filas/CSV | antes {t_antes * 1000:7.1f} ms/llamada | "
+                f"reconstrucción {t_reconstruir * 1000:7.1f} ms | búsqueda {t_buscar * 1e6:5.1f} us | iguales: {iguales}"
+            )
+    agent_service.CSVS_POR_LINEA = csvs_originales
+
+
+if __name__ == "__main__":
+    main()
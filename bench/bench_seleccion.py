@@ -0,0 +1,104 @@
+"""
+Benchmark de seleccion_candidatos contra el bucle con iterrows que tenían
+antes worker.py y worker_almacenes.py.
+
+Genera un CSV sintético (semilla fija) con estados, fechas (válidas, vacías e
+inválidas) y días de secuencia al azar, lo lee como lo leen los workers y
+corre ambas selecciones con la configuración de cada línea. Verifica que den
+la misma lista de candidatos (con la misma semilla para el shuffle) y mide
+el tiempo de cada una.
+
+Uso: python bench/bench_seleccion.py [filas]   (por defecto 100000)
+"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from seleccion_candidatos import seleccionar_candidatos
+
+AHORA = datetime(2026, 10, 14, 12, 0)
+ESTADOS_EXCLUIDOS = ["Finalizado", "Rechazado", "Cita Agendada", "Error"]
+LINEAS = {
+    "clinicas": {"max_dia_secuencia": 4, "resultados_excluidos": ()},
+    "almacenes": {"max_dia_secuencia": 2, "resultados_excluidos": ("Interesado", "No interesado", "Numero equivocado")},
+}
+
+
+def _seleccion_iterrows(df, ahora, estados_excluidos, max_dia_secuencia, limite, resultados_excluidos=()):
+    """El bucle de antes (el mismo en ambos workers, salvo Resultado y el máximo de días)."""
+    hoy_str = ahora.strftime("%d/%m/%Y")
+    candidatos = []
+    for idx, row in df.iterrows():
+        if hoy_str in str(row.get("Fecha_Contacto", "")):
+            continue
+        if row["Estado"] in estados_excluidos:
+            continue
+        if resultados_excluidos and row.get("Resultado") in resultados_excluidos:
+            continue
+        dia_act = int(row.get("Dia_Secuencia", 0))
+        if row["Estado"] == "Contactado":
+            try:
+                ultima_fecha = datetime.strptime(str(row["Fecha_Contacto"]), "%d/%m/%Y %H:%M")
+                if (ahora - ultima_fecha).total_seconds() < 90000:
+                    continue
+            except Exception:
+                pass
+        if row["Estado"] == "Contactado" and dia_act < max_dia_secuencia:
+            candidatos.append({"idx": idx, "dia": dia_act + 1})
+        elif row["Estado"] == "Nuevo":
+            candidatos.append({"idx": idx, "dia": 1})
+    random.shuffle(candidatos)
+    return candidatos[:limite]
+
+
+def generar_csv(archivo, filas, semilla=1):
+    rng = random.Random(semilla)
+    registros = []
+    for i in range(filas):
+        fecha = rng.choice(["", (AHORA - timedelta(hours=rng.randint(0, 200))).strftime("%d/%m/%Y %H:%M"), "basura"])
+        registros.append({
+            "Id": i,
+            "Estado": rng.choice(["Nuevo", "Contactado", "Contactado", "Finalizado", "Error", "Rechazado"]),
+            "Fecha_Contacto": fecha,
+            "Dia_Secuencia": rng.randint(0, 4),
+            "Resultado": rng.choice(["", "Interesado", "No interesado", None]),
+        })
+    pd.DataFrame(registros).to_csv(archivo, index=False)
+
+
+def main():
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # Las fechas "basura" son a propósito: no hace falta el warning en cada corrida.
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        archivo = os.path.join(tmp, "leads.csv")
+        generar_csv(archivo, filas)
+        df = pd.read_csv(archivo)
+
+    for linea, config in LINEAS.items():
+        random.seed(7)
+        t = time.perf_counter()
+        antes = _seleccion_iterrows(df, AHORA, ESTADOS_EXCLUIDOS, limite=10 ** 9, **config)
+        t_antes = time.perf_counter() - t
+
+        random.seed(7)
+        t = time.perf_counter()
+        ahora = seleccionar_candidatos(df, AHORA, ESTADOS_EXCLUIDOS, limite=10 ** 9, **config)
+        t_ahora = time.perf_counter() - t
+
+        print(
+            f"{linea:9} {filas} filas | candidatos {len(ahora)} | iguales: {antes == ahora} | "
+            f"iterrows {t_antes:.2f} s | vectorizado {t_ahora * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Capa de consulta del Dashboard Real-Time (app.py): búsqueda, filtro, orden y
+paginación sobre el DataFrame de una línea, sin copiarlo entero.
+
+Antes cada tecla en el buscador copiaba la base dos veces, corría
+str.contains sobre Evento y Ubicacion, la ordenaba con una columna temporal y
+mandaba todas las filas a st.dataframe. Ahora, una vez por versión del CSV
+(ver app._leer_base), se arma:
+  - una columna de búsqueda en minúsculas y sin acentos (Evento + Ubicacion);
+  - un índice de trigramas sobre esa columna, para consultas de 3+ caracteres
+    (se intersectan las listas de cada trigrama y solo se verifican esas filas);
+  - un índice de prefijos de palabras, para consultas de 1-2 caracteres
+    ("sa" encuentra "San Miguel", no cualquier texto que contenga "sa");
+  - los órdenes que se van pidiendo, como arrays de posiciones.
+Cada consulta devuelve posiciones (iloc) ya filtradas y ordenadas; app.py
+toma el slice de la página visible, hace el .iloc de esas filas y nada más se
+serializa al navegador.
+"""
+import bisect
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+def normalizar_busqueda(texto):
+    """Minúsculas y sin acentos (ñ -> n), para comparar lo que se escribe con la base."""
+    texto = str(texto).lower()
+    if texto.isascii():
+        return texto
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceBusqueda:
+    """
+    Índice de trigramas y de prefijos de palabras sobre una lista de textos.
+    Cada uno se arma recién con la primera consulta que lo necesita: abrir el
+    dashboard sin buscar nada no paga la construcción.
+    """
+
+    def __init__(self, textos):
+        self.textos = textos
+        self._trigramas = None
+        self._palabras = None
+        self._pos_palabras = None
+
+    def _indexar_trigramas(self):
+        trigramas = {}
+        for pos, texto in enumerate(self.textos):
+            for trigrama in _trigramas(texto):
+                trigramas.setdefault(trigrama, []).append(pos)
+        self._trigramas = {t: np.array(p, dtype=np.int64) for t, p in trigramas.items()}
+
+    def _indexar_palabras(self):
+        palabras = sorted((palabra, pos) for pos, texto in enumerate(self.textos) for palabra in set(texto.split()))
+        self._pos_palabras = np.array([pos for _, pos in palabras], dtype=np.int64)
+        self._palabras = [p for p, _ in palabras]
+
+    def buscar(self, consulta):
+        """Posiciones (ordenadas) de los textos que coinciden con `consulta` ya normalizada."""
+        if len(consulta) < 3:
+            if self._palabras is None:
+                self._indexar_palabras()
+            desde = bisect.bisect_left(self._palabras, consulta)
+            hasta = bisect.bisect_left(self._palabras, consulta + "\uffff")
+            return np.unique(self._pos_palabras[desde:hasta])
+
+        if self._trigramas is None:
+            self._indexar_trigramas()
+        listas = []
+        for trigrama in _trigramas(consulta):
+            lista = self._trigramas.get(trigrama)
+            if lista is None:
+                return np.empty(0, dtype=np.int64)
+            listas.append(lista)
+        listas.sort(key=len)
+        candidatas = listas[0]
+        for lista in listas[1:]:
+            if not len(candidatas):
+                break
+            candidatas = np.intersect1d(candidatas, lista, assume_unique=True)
+        # Los trigramas pueden estar todos pero no seguidos: se verifica el texto.
+        return np.array([p for p in candidatas if consulta in self.textos[p]], dtype=np.int64)
+
+
+class ConsultaLeads:
+    """
+    Consultas sobre `df` (que no se modifica ni se copia). Todo se expresa en
+    posiciones (iloc) del df original.
+    """
+
+    def __init__(self, df, columnas_busqueda=("Evento", "Ubicacion")):
+        self.df = df
+        self.n = len(df)
+        # "\n" separa las columnas: ningún trigrama de una consulta lo cruza.
+        textos = pd.Series("", index=df.index, dtype=object)
+        for i, col in enumerate(columnas_busqueda):
+            textos = textos + ("\n" if i else "") + df[col].astype(str)
+        unicos = pd.unique(textos)
+        normalizados = dict(zip(unicos, map(normalizar_busqueda, unicos)))
+        self.busqueda = [normalizados[t] for t in textos.tolist()]
+        self.indice = IndiceBusqueda(self.busqueda)
+        self._ordenes = {}
+
+    def orden(self, columnas, ascendente, extras=None):
+        """
+        Posiciones del df ordenadas por `columnas` (orden estable, como
+        sort_values); se calcula una vez por combinación. `extras` permite
+        ordenar por columnas derivadas que no están en el df ({nombre: array}).
+        """
+        clave = (tuple(columnas), tuple(ascendente))
+        if clave not in self._ordenes:
+            extras = extras or {}
+            claves = pd.DataFrame({c: extras[c] if c in extras else self.df[c].to_numpy() for c in columnas})
+            self._ordenes[clave] = claves.sort_values(
+                list(columnas), ascending=list(ascendente), kind="stable"
+            ).index.to_numpy()
+        return self._ordenes[clave]
+
+    def filtrar(self, texto="", filtro=None, orden=None):
+        """
+        Posiciones de las filas que coinciden con `texto` (y con `filtro`, una
+        máscara booleana opcional de largo n), en el `orden` dado (array de
+        posiciones, ver orden(); sin orden, el del df). La página visible es
+        un slice de esto.
+        """
+        mascara = None if filtro is None else np.asarray(filtro, dtype=bool)
+        consulta = normalizar_busqueda(texto).strip()
+        if consulta:
+            coincide = np.zeros(self.n, dtype=bool)
+            coincide[self.indice.buscar(consulta)] = True
+            mascara = coincide if mascara is None else mascara & coincide
+
+        posiciones = np.arange(self.n) if orden is None else orden
+        if mascara is not None:
+            posiciones = posiciones[mascara[posiciones]]
+        return posiciones
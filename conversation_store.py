@@ -10,10 +10,12 @@ GitHub Actions.
 """
 import os
 import sqlite3
+import threading
 from contextlib import contextmanager
 from datetime import datetime
 
 DB_PATH = os.getenv("AGENT_DB_PATH", "agent.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS messages (
@@ -25,37 +27,93 @@ CREATE TABLE IF NOT EXISTS messages (
     timestamp TEXT NOT NULL
 );
 
-CREATE INDEX IF NOT EXISTS idx_messages_telefono ON messages (telefono_normalizado);
+-- (telefono, id) cubre el filtro por teléfono + ORDER BY id del historial.
+DROP INDEX IF EXISTS idx_messages_telefono;
+CREATE INDEX IF NOT EXISTS idx_messages_telefono_id ON messages (telefono_normalizado, id);
 
 CREATE TABLE IF NOT EXISTS drafts (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     telefono_normalizado TEXT NOT NULL,
     mensaje_entrante_id INTEGER,
     texto_borrador TEXT NOT NULL,
-    estado TEXT NOT NULL DEFAULT 'pending' CHECK (estado IN ('pending', 'approved', 'rejected', 'sent')),
+    estado TEXT NOT NULL DEFAULT 'pending' CHECK (estado IN ('pending', 'approved', 'rejected', 'sent', 'superseded')),
     created_at TEXT NOT NULL,
     decided_at TEXT,
     FOREIGN KEY (mensaje_entrante_id) REFERENCES messages (id)
 );
 
-CREATE INDEX IF NOT EXISTS idx_drafts_estado ON drafts (estado);
+-- (estado, created_at, id) cubre el filtro por estado + el orden/paginación
+-- de la bandeja; (telefono, mensaje_entrante_id) sirve para agrupar ráfagas.
+DROP INDEX IF EXISTS idx_drafts_estado;
+CREATE INDEX IF NOT EXISTS idx_drafts_estado_created ON drafts (estado, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_drafts_telefono_mensaje ON drafts (telefono_normalizado, mensaje_entrante_id);
 """
 
 
+# Una conexión por thread, reutilizada entre llamadas (el webhook y los
+# workers de borradores corren en threads distintos vía asyncio.to_thread, y
+# sqlite3 no permite compartir una conexión entre threads). Reutilizarla evita
+# abrir el archivo en cada sentencia y aprovecha el caché de sentencias
+# preparadas de sqlite3 (cached_statements). En modo WAL los lectores (el
+# dashboard vía /pending-drafts) no se bloquean con las escrituras del webhook.
+_local = threading.local()
+_inicializadas = set()
+_inicializar_lock = threading.Lock()
+
+
+def _abrir_conexion():
+    conn = sqlite3.connect(
+        DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, cached_statements=256
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+
 @contextmanager
 def _conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _local.conn = _abrir_conexion()
+        _local.path = DB_PATH
     try:
         yield conn
         conn.commit()
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 def inicializar_db():
-    with _conn() as conn:
-        conn.executescript(SCHEMA)
+    # El schema se aplica una vez por proceso y por archivo de base.
+    with _inicializar_lock:
+        if DB_PATH in _inicializadas:
+            return
+        with _conn() as conn:
+            _migrar_estado_superseded(conn)
+            conn.executescript(SCHEMA)
+        _inicializadas.add(DB_PATH)
+
+
+def _migrar_estado_superseded(conn):
+    """
+    Las bases creadas antes de agrupar ráfagas de mensajes tienen un CHECK de
+    drafts.estado sin 'superseded'. SQLite no permite alterar un CHECK, así que
+    se recrea la tabla copiando los datos (una sola vez).
+    """
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'drafts'").fetchone()
+    if not row or "superseded" in row["sql"]:
+        return
+    conn.executescript(
+        "ALTER TABLE drafts RENAME TO drafts_old;"
+        + SCHEMA
+        + "INSERT INTO drafts SELECT * FROM drafts_old;"
+        "DROP TABLE drafts_old;"
+    )
 
 
 def _ahora():
@@ -72,39 +130,132 @@ def guardar_mensaje(telefono_normalizado, direccion, texto, evolution_message_id
         return cur.lastrowid
 
 
-def historial_conversacion(telefono_normalizado, limite=20):
+def historial_conversacion(telefono_normalizado, limite=20, antes_de_id=None):
+    """
+    Últimos `limite` mensajes del teléfono, más antiguos primero. Para paginar
+    hacia atrás (keyset), pasar en `antes_de_id` el id del mensaje más
+    antiguo de la página anterior.
+    """
     with _conn() as conn:
         rows = conn.execute(
-            "SELECT direccion, texto, timestamp FROM messages "
-            "WHERE telefono_normalizado = ? ORDER BY id DESC LIMIT ?",
-            (telefono_normalizado, limite),
+            "SELECT id, direccion, texto, timestamp FROM messages "
+            "WHERE telefono_normalizado = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (telefono_normalizado, antes_de_id if antes_de_id is not None else 2**63 - 1, limite),
         ).fetchall()
     return list(reversed([dict(r) for r in rows]))
 
 
 def crear_borrador(telefono_normalizado, mensaje_entrante_id, texto_borrador):
+    """
+    Guarda el borrador generado para los mensajes del teléfono hasta
+    `mensaje_entrante_id` y marca como 'superseded' los pendientes de
+    mensajes anteriores (quedaron obsoletos porque el prospecto siguió
+    escribiendo). Con varios workers, un borrador de una ráfaga anterior puede
+    terminar después que el de una más nueva: si ya hay un borrador
+    pendiente, aprobado o enviado para un mensaje posterior, este se guarda
+    directamente como 'superseded'. Chequeo, insert y reemplazo van en una
+    sola transacción (BEGIN IMMEDIATE: dos workers no se cruzan).
+    Devuelve (draft_id, vigente, reemplazados).
+    """
     with _conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        hay_posterior = conn.execute(
+            "SELECT 1 FROM drafts WHERE telefono_normalizado = ? AND mensaje_entrante_id > ? "
+            "AND estado IN ('pending', 'approved', 'sent') LIMIT 1",
+            (telefono_normalizado, mensaje_entrante_id),
+        ).fetchone() is not None
+        ahora = _ahora()
         cur = conn.execute(
-            "INSERT INTO drafts (telefono_normalizado, mensaje_entrante_id, texto_borrador, estado, created_at) "
-            "VALUES (?, ?, ?, 'pending', ?)",
-            (telefono_normalizado, mensaje_entrante_id, texto_borrador, _ahora()),
+            "INSERT INTO drafts (telefono_normalizado, mensaje_entrante_id, texto_borrador, estado, created_at, decided_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (telefono_normalizado, mensaje_entrante_id, texto_borrador,
+             "superseded" if hay_posterior else "pending", ahora, ahora if hay_posterior else None),
         )
-        return cur.lastrowid
+        if hay_posterior:
+            return cur.lastrowid, False, 0
+        reemplazados = conn.execute(
+            "UPDATE drafts SET estado = 'superseded', decided_at = ? "
+            "WHERE telefono_normalizado = ? AND estado = 'pending' AND mensaje_entrante_id < ?",
+            (ahora, telefono_normalizado, mensaje_entrante_id),
+        ).rowcount
+        return cur.lastrowid, True, reemplazados
+
+
+def mensajes_sin_borrador(desde_timestamp):
+    """
+    Mensajes entrantes (desde `desde_timestamp`, ISO) que no tienen ningún
+    borrador posterior para el mismo teléfono, es decir, que nunca llegaron a
+    procesarse. Más antiguos primero.
+    """
+    with _conn() as conn:
+        rows = conn.execute(
+            "SELECT m.id, m.telefono_normalizado, m.texto FROM messages m "
+            "WHERE m.direccion = 'in' AND m.timestamp >= ? "
+            "AND NOT EXISTS ("
+            "    SELECT 1 FROM drafts d "
+            "    WHERE d.telefono_normalizado = m.telefono_normalizado AND d.mensaje_entrante_id >= m.id"
+            ") "
+            "ORDER BY m.id ASC",
+            (desde_timestamp,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+_SELECT_BORRADORES = (
+    # mensaje_entrante junta todos los mensajes entrantes que cubre el borrador:
+    # desde el último borrador no reemplazado del mismo teléfono hasta el suyo.
+    "SELECT d.id, d.telefono_normalizado, d.texto_borrador, d.created_at, "
+    "       (SELECT group_concat(m2.texto, char(10)) FROM messages m2 "
+    "        WHERE m2.telefono_normalizado = d.telefono_normalizado AND m2.direccion = 'in' "
+    "          AND m2.id <= d.mensaje_entrante_id "
+    "          AND m2.id > COALESCE((SELECT MAX(d2.mensaje_entrante_id) FROM drafts d2 "
+    "                                WHERE d2.telefono_normalizado = d.telefono_normalizado "
+    "                                  AND d2.estado != 'superseded' "
+    "                                  AND d2.mensaje_entrante_id < d.mensaje_entrante_id), 0)"
+    "       ) AS mensaje_entrante, "
+    "       m.timestamp AS mensaje_entrante_timestamp "
+    "FROM drafts d "
+    "LEFT JOIN messages m ON m.id = d.mensaje_entrante_id "
+)
 
 
 def listar_borradores_pendientes():
     with _conn() as conn:
         rows = conn.execute(
-            "SELECT d.id, d.telefono_normalizado, d.texto_borrador, d.created_at, "
-            "       m.texto AS mensaje_entrante, m.timestamp AS mensaje_entrante_timestamp "
-            "FROM drafts d "
-            "LEFT JOIN messages m ON m.id = d.mensaje_entrante_id "
-            "WHERE d.estado = 'pending' "
-            "ORDER BY d.created_at ASC"
+            _SELECT_BORRADORES + "WHERE d.estado = 'pending' ORDER BY d.created_at ASC, d.id ASC"
         ).fetchall()
     return [dict(r) for r in rows]
 
 
+def _cursor_borrador(borrador):
+    return f"{borrador['created_at']}|{borrador['id']}"
+
+
+def pagina_borradores_pendientes(limite, cursor=None):
+    """
+    Página de borradores pendientes (más antiguos primero) con paginación por
+    keyset sobre (created_at, id): cada página es un rango del índice
+    idx_drafts_estado_created, sin OFFSET, así que cuesta lo mismo la página 1
+    que la 100. `cursor` es el valor devuelto por la página anterior.
+    Devuelve (borradores, siguiente_cursor), con siguiente_cursor None al final.
+    """
+    if cursor:
+        created_at, _, draft_id = cursor.rpartition("|")
+        condicion, params = "AND (d.created_at, d.id) > (?, ?) ", (created_at, int(draft_id))
+    else:
+        condicion, params = "", ()
+    with _conn() as conn:
+        rows = conn.execute(
+            _SELECT_BORRADORES
+            + "WHERE d.estado = 'pending' " + condicion
+            + "ORDER BY d.created_at ASC, d.id ASC LIMIT ?",
+            (*params, limite + 1),
+        ).fetchall()
+    borradores = [dict(r) for r in rows[:limite]]
+    siguiente = _cursor_borrador(borradores[-1]) if len(rows) > limite else None
+    return borradores, siguiente
+
+
 def obtener_borrador(draft_id):
     with _conn() as conn:
         row = conn.execute("SELECT * FROM drafts WHERE id = ?", (draft_id,)).fetchone()
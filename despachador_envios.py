@@ -0,0 +1,39 @@
+"""
+Despachador de los envíos programados por worker.py y worker_almacenes.py
+(ver programador_envios). Corre en un cron corto
+(.github/workflows/despachador_envios.yml): envía lo que ya venció en ambas
+líneas — como mucho uno por línea por corrida, respetando la pausa humanizada
+— y termina. Si no hay nada vencido sale de inmediato, sin cargar los CSV.
+
+Uso: python despachador_envios.py
+"""
+import logging
+
+import programador_envios
+
+
+def main():
+    if not programador_envios.hay_vencidos():
+        print("📭 Sin envíos vencidos.")
+        return
+
+    # Se importan recién acá: traen pandas y la configuración de cada línea.
+    import worker
+    import worker_almacenes
+
+    estado_conexion = worker.evo.estado_conexion()
+    if estado_conexion != "open":
+        # Los envíos quedan en la cola (y vencen solos); la alerta la da el ciclo
+        # del worker. Se sale sin error: con WhatsApp caído, un exit 1 haría
+        # fallar el workflow cada 5 minutos y llenaría de notificaciones.
+        print(f"🔴 Sesión de WhatsApp no está 'open' (estado: {estado_conexion}). No se despacha.")
+        logging.warning("Despachador: sesión de WhatsApp caída o desconocida (estado=%s), se omite la corrida.", estado_conexion)
+        return
+
+    worker.despachar_envios()
+    worker_almacenes.despachar_envios()
+    print("🏁 Despacho completado.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Diario (journal) append-only de cambios de estado de los leads.
+
+Los workers antes reescribían el CSV completo (df.to_csv) después de cada
+envío, con un costo que crece con el tamaño de la base. Ahora cada envío solo
+agrega una línea JSON con las celdas que cambiaron (Estado, Dia_Secuencia,
+Fecha_Contacto, Version_Mensaje) a "<archivo>.diario.jsonl", y el CSV se
+reescribe una sola vez al final del ciclo (compactar).
+
+Si el proceso se cae a mitad de ciclo, el diario queda en disco (y el
+workflow lo commitea); en el próximo arranque cargar_leads lo reproduce sobre
+el CSV antes de seleccionar candidatos, así no se re-envía a nadie.
+
+Cambios del dashboard: el Editor de Base (app.py) ya no sube el CSV completo.
+Calcula la diferencia contra la base cargada (calcular_cambios: altas, bajas
+y celdas cambiadas, por Id) y sube un solo archivo nuevo en
+DIRECTORIO_CAMBIOS/<csv>.<timestamp>.json. Un archivo nuevo nunca choca con
+los commits de los workers (que rebasan con -X theirs y antes pisaban el CSV
+editado). El próximo worker que carga esa línea aplica todos los pendientes,
+en orden, de una vez (cargar_leads), compacta y los borra; mientras tanto el
+dashboard los muestra aplicados sobre el CSV.
+
+El Id de una fila nueva (alta) recién se conoce al aplicarla (máximo + 1 del
+CSV sobre el que se aplica), así que puede no ser el mismo en el dashboard
+que en el worker. Cada alta lleva una clave propia (uuid) que queda en la
+columna COLUMNA_CLAVE_ALTA del lead, y los cambios/bajas posteriores de ese
+lead la llevan también: se resuelven por la clave, no por el Id.
+"""
+import glob
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+import pandas as pd
+
+CSVS_POR_LINEA = {
+    "clinicas": "prospeccion_gestionvital_pro.csv",
+    "almacenes": "prospeccion_almacenes_pro.csv",
+}
+DIRECTORIO_CAMBIOS = os.getenv("CAMBIOS_PENDIENTES_DIR", "cambios_pendientes")
+# Clave estable de los leads creados desde el dashboard (ver aplicar_cambios).
+COLUMNA_CLAVE_ALTA = "Clave_Alta"
+
+
+def ruta_diario(archivo):
+    return f"{archivo}.diario.jsonl"
+
+
+def _a_json(valor):
+    # Escalares de numpy (int64, etc.) que vienen de df.loc[...] no son serializables.
+    if hasattr(valor, "item"):
+        return valor.item()
+    return str(valor)
+
+
+def _asignar(df, idx, cambios):
+    for col, valor in cambios.items():
+        if col not in df.columns:
+            df[col] = ""
+        if isinstance(valor, str) and df[col].dtype != object:
+            # Columnas completamente vacías se leen como float (NaN).
+            df[col] = df[col].astype(object)
+        elif not isinstance(valor, str) and isinstance(df[col].dtype, pd.StringDtype):
+            # Base leída con dtype=str (dashboard): Dia_Secuencia también es texto.
+            valor = str(valor)
+        df.at[idx, col] = valor
+
+
+def registrar_cambios(archivo, lead_id, cambios):
+    """
+    Agrega una línea al diario con los cambios de un lead (identificado por su
+    Id, que es estable entre ciclos, a diferencia del índice del DataFrame).
+    Hace fsync para que el cambio sobreviva aunque el proceso muera justo después.
+    """
+    linea = json.dumps(
+        {"Id": lead_id, "cambios": cambios, "timestamp": datetime.utcnow().isoformat()},
+        ensure_ascii=False,
+        default=_a_json,
+    )
+    with open(ruta_diario(archivo), "a", encoding="utf-8") as f:
+        f.write(linea + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def actualizar_lead(df, idx, archivo, cambios):
+    """Aplica `cambios` a la fila `idx` de `df` y los deja registrados en el diario."""
+    _asignar(df, idx, cambios)
+    registrar_cambios(archivo, df.at[idx, "Id"], cambios)
+
+
+def _leer_diario(archivo):
+    entradas = []
+    ruta = ruta_diario(archivo)
+    if not os.path.exists(ruta):
+        return entradas
+    with open(ruta, "r", encoding="utf-8") as f:
+        for n, linea in enumerate(f, start=1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                entradas.append(json.loads(linea))
+            except json.JSONDecodeError:
+                # Típicamente la última línea a medio escribir si el proceso murió.
+                logging.warning("Línea %s inválida en %s, se ignora.", n, ruta)
+    return entradas
+
+
+def aplicar_diario(df, archivo):
+    """
+    Reproduce sobre `df` (en orden) los cambios pendientes del diario.
+    Devuelve la cantidad de entradas aplicadas.
+    """
+    entradas = _leer_diario(archivo)
+    if not entradas or df.empty or "Id" not in df.columns:
+        return 0
+
+    ids = pd.to_numeric(df["Id"], errors="coerce")
+    indice_por_id = {int(i): idx for idx, i in ids.dropna().items()}
+    aplicadas = 0
+    for entrada in entradas:
+        idx = indice_por_id.get(entrada.get("Id"))
+        if idx is None:
+            logging.warning("Id %s del diario no existe en %s, se ignora.", entrada.get("Id"), archivo)
+            continue
+        _asignar(df, idx, entrada.get("cambios", {}))
+        aplicadas += 1
+    return aplicadas
+
+
+def compactar(df, archivo):
+    """
+    Escribe el CSV completo una sola vez (vía archivo temporal + os.replace,
+    para no dejar un CSV truncado si el proceso muere a mitad de escritura) y
+    descarta el diario, cuyos cambios ya quedaron incorporados en `df`.
+    """
+    tmp = f"{archivo}.tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, archivo)
+    ruta = ruta_diario(archivo)
+    if os.path.exists(ruta):
+        os.remove(ruta)
+
+
+def _como_texto(df, columnas):
+    # Para comparar celdas sin que pesen los dtypes (NaN/NA == "", 2 == "2").
+    return df.reindex(columns=columnas).astype(object).where(lambda d: d.notna(), "").astype(str)
+
+
+def _a_nativo(valor):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return ""
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+def _claves_alta(df):
+    """{índice: clave} de las filas de `df` creadas desde el dashboard."""
+    if COLUMNA_CLAVE_ALTA not in df.columns:
+        return {}
+    claves = df[COLUMNA_CLAVE_ALTA]
+    claves = claves[claves.notna()].astype(str)
+    return claves[claves != ""].to_dict()
+
+
+def calcular_cambios(original, editado):
+    """
+    Diferencia entre la base cargada y la editada, por Id: lista de
+    {"op": "cambio", "Id", "cambios": {col: valor}} (solo las celdas que
+    cambiaron), {"op": "baja", "Id"} y {"op": "alta", "clave", "fila":
+    {col: valor}} (filas nuevas, sin Id: se le asigna al aplicarse; "clave"
+    es un uuid nuevo). Los cambios y bajas de leads creados como alta llevan
+    además su "clave". Las filas nuevas completamente vacías se ignoran.
+    ValueError si hay Ids repetidos.
+    """
+    columnas = [
+        c for c in dict.fromkeys(list(original.columns) + list(editado.columns))
+        if c not in ("Id", COLUMNA_CLAVE_ALTA)
+    ]
+    ids_original = pd.to_numeric(original["Id"], errors="coerce")
+    ids_editado = pd.to_numeric(editado["Id"], errors="coerce")
+    for ids in (ids_original, ids_editado):
+        repetidos = ids[ids.notna() & ids.duplicated()]
+        if len(repetidos):
+            raise ValueError(f"Hay Ids repetidos en la base: {sorted(set(repetidos.astype(int)))[:10]}")
+
+    con_id = editado[ids_editado.notna()]
+    antes = _como_texto(original[ids_original.notna()], columnas).set_axis(ids_original.dropna().astype(int))
+    despues = _como_texto(con_id, columnas).set_axis(ids_editado.dropna().astype(int))
+    clave_por_id = {int(ids_original[idx]): clave for idx, clave in _claves_alta(original).items() if pd.notna(ids_original[idx])}
+
+    def _con_clave(cambio):
+        if cambio["Id"] in clave_por_id:
+            cambio["clave"] = clave_por_id[cambio["Id"]]
+        return cambio
+
+    cambios = []
+    comunes = despues.index[despues.index.isin(antes.index)]
+    distintos = (despues.loc[comunes] != antes.loc[comunes]).to_numpy()
+    for fila in np.flatnonzero(distintos.any(axis=1)):
+        lead_id = int(comunes[fila])
+        cols = [columnas[j] for j in np.flatnonzero(distintos[fila])]
+        valores = con_id.iloc[despues.index.get_loc(lead_id)]
+        cambios.append(_con_clave({"op": "cambio", "Id": lead_id, "cambios": {c: _a_nativo(valores.get(c)) for c in cols}}))
+
+    for lead_id in antes.index[~antes.index.isin(despues.index)]:
+        cambios.append(_con_clave({"op": "baja", "Id": int(lead_id)}))
+
+    nuevas = editado[ids_editado.isna()]
+    # Las columnas numéricas (Dia_Secuencia) traen 0 por defecto en una fila nueva.
+    columnas_texto = [c for c in nuevas.select_dtypes(exclude="number").columns if c in columnas]
+    vacias = (_como_texto(nuevas, columnas_texto).apply(lambda c: c.str.strip()) == "").all(axis=1)
+    for _, fila in nuevas[~vacias].iterrows():
+        cambios.append({"op": "alta", "clave": uuid.uuid4().hex, "fila": {c: _a_nativo(fila.get(c)) for c in columnas}})
+    return cambios
+
+
+def aplicar_cambios(df, cambios, origen=""):
+    """
+    Aplica (en orden) una lista de cambios de calcular_cambios y devuelve el
+    DataFrame resultante. Las altas reciben Id = máximo + 1 y guardan su
+    clave en COLUMNA_CLAVE_ALTA; reaplicar un alta cuya clave ya está en la
+    base no duplica la fila (las altas sin clave, de archivos anteriores, se
+    omiten si ya hay un lead con el mismo Evento y Telefono). Los cambios y
+    bajas con "clave" se resuelven por la clave (el Id que vio el dashboard
+    puede no ser el definitivo); los demás, por Id. Los que apuntan a un lead
+    que ya no existe se ignoran, igual que en aplicar_diario.
+    """
+    if not cambios:
+        return df
+    df = df.copy()
+    ids = pd.to_numeric(df["Id"], errors="coerce")
+    indice_por_id = {int(i): idx for idx, i in ids.dropna().items()}
+    indice_por_clave = {clave: idx for idx, clave in _claves_alta(df).items()}
+    siguiente_id = int(ids.max()) + 1 if ids.notna().any() else 1
+    existentes = set(zip(df["Evento"].astype(str), df["Telefono"].astype(str)))
+    bajas = []
+    altas = {}  # clave -> fila (las de este llamado, que todavía no están en df)
+    for cambio in cambios:
+        op = cambio.get("op", "cambio")
+        clave = cambio.get("clave")
+        if op == "alta":
+            fila = dict(cambio.get("fila", {}))
+            evento_telefono = (str(fila.get("Evento", "")), str(fila.get("Telefono", "")))
+            if clave in indice_por_clave or clave in altas or (not clave and evento_telefono in existentes):
+                logging.warning("Alta ya presente en %s, se omite: %s", origen, clave or evento_telefono)
+                continue
+            existentes.add(evento_telefono)
+            clave = clave or uuid.uuid4().hex
+            fila["Id"] = siguiente_id
+            fila[COLUMNA_CLAVE_ALTA] = clave
+            siguiente_id += 1
+            altas[clave] = fila
+            continue
+
+        if clave in altas:
+            # Cambio o baja de un alta de este mismo llamado.
+            if op == "baja":
+                del altas[clave]
+            else:
+                altas[clave].update(cambio.get("cambios", {}))
+            continue
+        idx = indice_por_clave.get(clave) if clave else indice_por_id.get(cambio.get("Id"))
+        if idx is None:
+            logging.warning("Lead %s de %s no existe, se ignora.", clave or cambio.get("Id"), origen)
+        elif op == "baja":
+            bajas.append(idx)
+            indice_por_id = {i: j for i, j in indice_por_id.items() if j != idx}
+            indice_por_clave = {c: j for c, j in indice_por_clave.items() if j != idx}
+        else:
+            _asignar(df, idx, cambio.get("cambios", {}))
+    if bajas:
+        df = df.drop(index=bajas)
+    if altas:
+        if COLUMNA_CLAVE_ALTA not in df.columns:
+            df[COLUMNA_CLAVE_ALTA] = ""
+        filas = list(altas.values())
+        columnas = df.columns.union(pd.Index([c for fila in filas for c in fila]), sort=False)
+        nuevas = pd.DataFrame(filas).reindex(columns=columnas, fill_value="")
+        df = pd.concat([df, nuevas], ignore_index=True)
+    return df
+
+
+def rutas_cambios_pendientes(archivo):
+    """Archivos de cambios del dashboard pendientes para `archivo`, en el orden en que se crearon."""
+    return sorted(glob.glob(os.path.join(DIRECTORIO_CAMBIOS, f"{os.path.basename(archivo)}.*.json")))
+
+
+def armar_cambios_pendientes(archivo, cambios):
+    """
+    (ruta, contenido) del archivo nuevo de DIRECTORIO_CAMBIOS con `cambios`,
+    para subirlo tal cual. No se escribe en disco: la copia local la trae la
+    sincronización del repo, hasta que un worker lo aplica y lo borra (una
+    copia local sin commitear chocaría con esa sincronización). Mientras
+    tanto el dashboard lo aplica desde memoria (app._subidos_sin_sincronizar).
+    """
+    ahora = datetime.utcnow()
+    ruta = os.path.join(DIRECTORIO_CAMBIOS, f"{os.path.basename(archivo)}.{ahora.strftime('%Y%m%dT%H%M%S%f')}.json")
+    contenido = json.dumps(
+        {"archivo": os.path.basename(archivo), "creado": ahora.isoformat(), "cambios": cambios},
+        ensure_ascii=False, indent=1, default=_a_json,
+    )
+    return ruta, contenido
+
+
+def aplicar_cambios_pendientes(df, rutas):
+    """Aplica sobre `df` los archivos de cambios `rutas`, en orden. Devuelve el DataFrame resultante."""
+    for ruta in rutas:
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                cambios = json.load(f).get("cambios", [])
+        except Exception:
+            logging.exception("No se pudo leer %s, se ignora.", ruta)
+            continue
+        df = aplicar_cambios(df, cambios, origen=ruta)
+    return df
+
+
+def cargar_leads(archivo):
+    """
+    Lee el CSV de leads y, si quedó un diario de un ciclo que no alcanzó a
+    compactar (caída del proceso), lo reproduce. Después aplica los cambios
+    pendientes del dashboard; si hubo algo que aplicar, compacta de inmediato
+    y borra lo ya incorporado.
+    """
+    df = pd.read_csv(archivo)
+    aplicadas = aplicar_diario(df, archivo)
+    if aplicadas:
+        print(f"🩹 Recuperados {aplicadas} cambios pendientes del diario de {archivo}.")
+    rutas = rutas_cambios_pendientes(archivo)
+    if rutas:
+        df = aplicar_cambios_pendientes(df, rutas)
+        print(f"🗂️ Aplicados {len(rutas)} archivos de cambios del dashboard sobre {archivo}.")
+    if aplicadas or rutas:
+        compactar(df, archivo)
+        for ruta in rutas:
+            os.remove(ruta)
+    elif os.path.exists(ruta_diario(archivo)):
+        os.remove(ruta_diario(archivo))
+    return df
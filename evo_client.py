@@ -2,12 +2,46 @@
 Cliente compartido para Evolution API (WhatsApp).
 Usado por worker.py, worker_almacenes.py y agent_service.py para no duplicar
 la lógica de envío, normalización de teléfono y chequeo de estado de sesión.
+
+EvolutionClient (sync, para los workers) y EvolutionClientAsync (httpx, para
+agent_service) tienen la misma API:
+  - una sesión HTTP con pool de conexiones por cliente (antes cada presencia
+    y cada envío abría una conexión TLS nueva con requests.post);
+  - timeouts de conexión/lectura configurables (EVO_TIMEOUT_*);
+  - reintentos con backoff exponencial y jitter ante errores de red, 429 y
+    5xx. El envío de texto solo se reintenta cuando es seguro que no salió
+    (no se pudo conectar, o HTTP 429/503): un timeout de lectura o un 500
+    pueden haberlo entregado igual, y reintentar duplicaría el mensaje;
+  - un circuit breaker: tras EVO_CIRCUITO_FALLOS fallas seguidas de la
+    instancia (red/5xx), las llamadas fallan de inmediato durante
+    EVO_CIRCUITO_PAUSA_SEG en vez de esperar cada timeout; después se deja
+    pasar una llamada de prueba.
+
+Las funciones sueltas (verificar_estado_conexion, enviar_mensaje_texto,
+enviar_alerta_whatsapp) se mantienen por compatibilidad y usan un
+EvolutionClient compartido por (url, instancia, token).
 """
+import asyncio
 import logging
+import os
 import random
+import threading
 import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+EVO_TIMEOUT_CONEXION_SEG = float(os.getenv("EVO_TIMEOUT_CONEXION_SEG", "5"))
+EVO_TIMEOUT_LECTURA_SEG = float(os.getenv("EVO_TIMEOUT_LECTURA_SEG", "20"))
+EVO_MAX_REINTENTOS = int(os.getenv("EVO_MAX_REINTENTOS", "2"))
+EVO_CIRCUITO_FALLOS = int(os.getenv("EVO_CIRCUITO_FALLOS", "5"))
+EVO_CIRCUITO_PAUSA_SEG = float(os.getenv("EVO_CIRCUITO_PAUSA_SEG", "60"))
+EVO_POOL_CONEXIONES = int(os.getenv("EVO_POOL_CONEXIONES", "4"))
+
+# Pausa "escribiendo..." antes de cada envío (segundos, aleatoria en el rango).
+ESCRITURA_MIN_SEG = 15
+ESCRITURA_MAX_SEG = 35
 
 
 def normalizar_telefono_chile(raw):
@@ -39,106 +73,381 @@ def normalizar_telefono_chile(raw):
     return digits
 
 
-def verificar_estado_conexion(base_url, instance, token, timeout=15):
+class CircuitBreaker:
     """
-    Consulta el estado de la sesión de WhatsApp en Evolution API.
-    Devuelve "open", "close" o "unknown" (nunca lanza excepción hacia el caller).
-
-    NOTA: el endpoint/shape exacto puede variar según la versión de Evolution API
-    instalada. Se hace parsing tolerante y se loguea el payload crudo para poder
-    ajustar rápido si el shape real difiere de lo esperado.
+    Circuit breaker seguro entre threads y corutinas (las transiciones son
+    cortas y van bajo un threading.Lock). Cerrado: todo pasa. Tras `umbral`
+    fallas seguidas se abre por `pausa_seg`; vencida la pausa deja pasar UNA
+    llamada de prueba (semiabierto): si sale bien se cierra, si falla se
+    vuelve a abrir.
     """
-    if not base_url or not instance or not token:
-        return "unknown"
 
-    url = f"{base_url.strip().rstrip('/')}/instance/connectionState/{instance}"
-    headers = {"apikey": token}
-    try:
-        res = requests.get(url, headers=headers, timeout=timeout)
-        if res.status_code != 200:
-            logging.warning(
-                "Estado de conexión: HTTP %s al consultar %s. Respuesta: %s",
-                res.status_code, url, res.text[:500],
-            )
-            return "unknown"
+    def __init__(self, umbral=EVO_CIRCUITO_FALLOS, pausa_seg=EVO_CIRCUITO_PAUSA_SEG):
+        self.umbral = max(1, umbral)
+        self.pausa_seg = pausa_seg
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
 
-        data = res.json()
-        # Formas típicas observadas en distintas versiones de Evolution API:
-        #   {"instance": {"state": "open"}}
-        #   {"state": "open"}
-        estado = None
-        if isinstance(data, dict):
-            if isinstance(data.get("instance"), dict):
-                estado = data["instance"].get("state")
-            if not estado:
-                estado = data.get("state")
-
-        if estado in ("open", "close", "connecting"):
-            return "open" if estado == "open" else "close"
-
-        logging.warning("Estado de conexión con shape inesperado: %s", data)
-        return "unknown"
-    except Exception:
-        logging.exception("Error al consultar estado de conexión de Evolution API.")
-        return "unknown"
+    @property
+    def abierto(self):
+        with self._lock:
+            return self._fallos >= self.umbral and time.monotonic() < self._abierto_hasta
 
+    def permitir(self):
+        with self._lock:
+            if self._fallos < self.umbral:
+                return True
+            if time.monotonic() < self._abierto_hasta or self._prueba_en_curso:
+                return False
+            self._prueba_en_curso = True
+            return True
 
-def enviar_mensaje_texto(base_url, token, instance, numero, mensaje, simular_escritura=True):
-    """
-    Envía un mensaje de texto por WhatsApp vía Evolution API, simulando
-    presencia "escribiendo..." con una demora aleatoria antes del envío.
-    Devuelve True/False según si Evolution aceptó el mensaje.
-    """
-    if not mensaje or len(mensaje.strip()) < 10:
-        return False
-    if not base_url or not token or not instance:
-        logging.error("Evolution API no configurado (base_url/token/instance faltante).")
-        return False
+    def registrar_exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            self._prueba_en_curso = False
+            if self._fallos >= self.umbral:
+                self._abierto_hasta = time.monotonic() + self.pausa_seg
 
-    base = base_url.strip().rstrip("/")
-    headers = {"Content-Type": "application/json", "apikey": token}
+
+def _es_reintentable(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def _sin_procesar(status_code):
+    # Respuestas que garantizan que Evolution no procesó el envío.
+    return status_code in (429, 503)
+
+
+def _espera_reintento(intento, retry_after=None):
+    """Backoff exponencial con jitter; respeta Retry-After si Evolution lo manda."""
     try:
-        requests.post(
-            f"{base}/chat/sendPresence/{instance}",
-            json={"number": numero, "presence": "composing"},
-            headers=headers,
-            timeout=10,
-        )
+        if retry_after is not None:
+            return min(60.0, float(retry_after))
+    except ValueError:
+        pass
+    return min(30.0, 1.0 * (2 ** intento)) + random.uniform(0, 1)
 
-        if simular_escritura:
-            time.sleep(random.randint(15, 35))
 
-        payload = {
+def _sin_conectar(error):
+    """True si el request ni siquiera llegó a salir (no se pudo abrir la conexión)."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    motivo = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(motivo, NewConnectionError)
+
+
+def _estado_desde_respuesta(data):
+    # Formas típicas observadas en distintas versiones de Evolution API:
+    #   {"instance": {"state": "open"}}
+    #   {"state": "open"}
+    estado = None
+    if isinstance(data, dict):
+        if isinstance(data.get("instance"), dict):
+            estado = data["instance"].get("state")
+        if not estado:
+            estado = data.get("state")
+
+    if estado in ("open", "close", "connecting"):
+        return "open" if estado == "open" else "close"
+
+    logging.warning("Estado de conexión con shape inesperado: %s", data)
+    return "unknown"
+
+
+class _ClienteEvolutionBase:
+    """Configuración y lógica común a los clientes sync y async (sin I/O)."""
+
+    def __init__(self, base_url, token, instance, timeout_conexion=None, timeout_lectura=None,
+                 max_reintentos=None, circuito=None):
+        self.base_url = (base_url or "").strip().rstrip("/")
+        self.token = token
+        self.instance = instance
+        self.timeout_conexion = EVO_TIMEOUT_CONEXION_SEG if timeout_conexion is None else timeout_conexion
+        self.timeout_lectura = EVO_TIMEOUT_LECTURA_SEG if timeout_lectura is None else timeout_lectura
+        self.max_reintentos = EVO_MAX_REINTENTOS if max_reintentos is None else max_reintentos
+        self.circuito = circuito or CircuitBreaker()
+
+    @property
+    def configurado(self):
+        return bool(self.base_url and self.token and self.instance)
+
+    def _headers(self):
+        return {"Content-Type": "application/json", "apikey": self.token}
+
+    def _url(self, ruta):
+        return f"{self.base_url}/{ruta}/{self.instance}"
+
+    @staticmethod
+    def _payload_texto(numero, mensaje):
+        return {
             "number": numero,
             "options": {"delay": 2000, "presence": "composing"},
             "textMessage": {"text": mensaje},
         }
-        res = requests.post(
-            f"{base}/message/sendText/{instance}", json=payload, headers=headers, timeout=20
-        )
+
+    def _puede_enviar(self, mensaje):
+        if not mensaje or len(mensaje.strip()) < 10:
+            return False
+        if not self.configurado:
+            logging.error("Evolution API no configurado (base_url/token/instance faltante).")
+            return False
+        return True
+
+    def _circuito_cerrado(self, ruta):
+        if self.circuito.permitir():
+            return True
+        logging.warning("Evolution API: circuito abierto tras fallas seguidas, se omite %s.", ruta)
+        return False
+
+    def _decidir(self, res, intento, reintentar_envio):
+        """
+        Tras una respuesta HTTP: registra el resultado en el circuito y
+        devuelve la espera antes de reintentar, o None si no se reintenta.
+        """
+        if not _es_reintentable(res.status_code):
+            self.circuito.registrar_exito()
+            return None
+        self.circuito.registrar_fallo()
+        puede = reintentar_envio or _sin_procesar(res.status_code)
+        if intento >= self.max_reintentos or not puede or not self.circuito.permitir():
+            return None
+        return _espera_reintento(intento, res.headers.get("Retry-After"))
+
+    def _decidir_error_red(self, intento, idempotente, sin_conectar):
+        self.circuito.registrar_fallo()
+        if intento >= self.max_reintentos or not (idempotente or sin_conectar) or not self.circuito.permitir():
+            return None
+        return _espera_reintento(intento)
+
+
+class EvolutionClient(_ClienteEvolutionBase):
+    """
+    Cliente sync sobre un requests.Session con pool de conexiones. Seguro
+    para usar desde varios threads. Nunca lanza excepción hacia el caller.
+    """
+
+    def __init__(self, base_url, token, instance, **opciones):
+        super().__init__(base_url, token, instance, **opciones)
+        self._session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=EVO_POOL_CONEXIONES)
+        self._session.mount("https://", adaptador)
+        self._session.mount("http://", adaptador)
+
+    def _solicitar(self, metodo, ruta, json=None, timeout_lectura=None, idempotente=True):
+        """Devuelve la respuesta (cualquier status) o None si no hubo respuesta utilizable."""
+        if not self._circuito_cerrado(ruta):
+            return None
+        timeout = (self.timeout_conexion, timeout_lectura or self.timeout_lectura)
+        for intento in range(self.max_reintentos + 1):
+            try:
+                res = self._session.request(metodo, self._url(ruta), json=json, headers=self._headers(),
+                                            timeout=timeout)
+            except requests.RequestException as e:
+                logging.warning("Error de red con Evolution API en %s (intento %s): %s", ruta, intento + 1, e)
+                espera = self._decidir_error_red(intento, idempotente, _sin_conectar(e))
+                if espera is None:
+                    return None
+                time.sleep(espera)
+                continue
+            espera = self._decidir(res, intento, idempotente)
+            if espera is None:
+                return res
+            logging.warning("Evolution API HTTP %s en %s, reintentando en %.1fs.", res.status_code, ruta, espera)
+            time.sleep(espera)
+        return None
+
+    def estado_conexion(self, timeout=15):
+        """
+        Consulta el estado de la sesión de WhatsApp. Devuelve "open", "close" o
+        "unknown".
+
+        NOTA: el endpoint/shape exacto puede variar según la versión de
+        Evolution API instalada. Se hace parsing tolerante y se loguea el
+        payload crudo para poder ajustar rápido si el shape real difiere.
+        """
+        if not self.configurado:
+            return "unknown"
+        res = self._solicitar("GET", "instance/connectionState", timeout_lectura=timeout)
+        if res is None:
+            return "unknown"
+        if res.status_code != 200:
+            logging.warning("Estado de conexión: HTTP %s. Respuesta: %s", res.status_code, res.text[:500])
+            return "unknown"
+        try:
+            return _estado_desde_respuesta(res.json())
+        except ValueError:
+            logging.warning("Estado de conexión: respuesta no es JSON: %s", res.text[:500])
+            return "unknown"
+
+    def enviar_presencia(self, numero, presencia="composing"):
+        res = self._solicitar("POST", "chat/sendPresence", json={"number": numero, "presence": presencia},
+                              timeout_lectura=10)
+        return res is not None and res.status_code in (200, 201)
+
+    def enviar_texto(self, numero, mensaje, simular_escritura=True):
+        """
+        Envía un mensaje de texto, simulando presencia "escribiendo..." con
+        una demora aleatoria antes del envío. Devuelve True/False según si
+        Evolution aceptó el mensaje.
+        """
+        if not self._puede_enviar(mensaje):
+            return False
+        self.enviar_presencia(numero)
+        if simular_escritura:
+            time.sleep(random.randint(ESCRITURA_MIN_SEG, ESCRITURA_MAX_SEG))
+        res = self._solicitar("POST", "message/sendText", json=self._payload_texto(numero, mensaje),
+                              idempotente=False)
+        if res is None:
+            return False
         if res.status_code not in (200, 201):
-            logging.error(
-                "Error al enviar mensaje. HTTP %s, respuesta: %s", res.status_code, res.text[:500]
+            logging.error("Error al enviar mensaje. HTTP %s, respuesta: %s", res.status_code, res.text[:500])
+        return res.status_code in (200, 201)
+
+    def enviar_alerta(self, numero_operador, texto):
+        """
+        Intento best-effort de auto-alertarse por WhatsApp cuando algo se
+        degrada (fallos repetidos con sesión aún 'open', errores de SerpAPI,
+        etc). No usar para avisar caída total de sesión: en ese caso este
+        envío también fallará (con razón).
+        """
+        if not numero_operador:
+            return False
+        return self.enviar_texto(numero_operador, texto, simular_escritura=False)
+
+    def cerrar(self):
+        self._session.close()
+
+
+class EvolutionClientAsync(_ClienteEvolutionBase):
+    """
+    Misma API que EvolutionClient, con corutinas sobre un httpx.AsyncClient
+    compartido (para agent_service; la pausa de escritura no ocupa un thread).
+    """
+
+    def __init__(self, base_url, token, instance, **opciones):
+        super().__init__(base_url, token, instance, **opciones)
+        self._cliente = None
+
+    def _cliente_http(self):
+        # httpx solo se instala junto al agente (requirements-agent.txt): los
+        # workers usan EvolutionClient y no lo necesitan.
+        import httpx
+
+        if self._cliente is None or self._cliente.is_closed:
+            self._cliente = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout_lectura, connect=self.timeout_conexion),
+                limits=httpx.Limits(max_connections=EVO_POOL_CONEXIONES),
             )
+        return self._cliente
+
+    async def _solicitar(self, metodo, ruta, json=None, timeout_lectura=None, idempotente=True):
+        import httpx
+
+        if not self._circuito_cerrado(ruta):
+            return None
+        cliente = self._cliente_http()
+        timeout = httpx.Timeout(timeout_lectura or self.timeout_lectura, connect=self.timeout_conexion)
+        for intento in range(self.max_reintentos + 1):
+            try:
+                res = await cliente.request(metodo, self._url(ruta), json=json, headers=self._headers(),
+                                            timeout=timeout)
+            except httpx.HTTPError as e:
+                sin_conectar = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                logging.warning("Error de red con Evolution API en %s (intento %s): %s", ruta, intento + 1, e)
+                espera = self._decidir_error_red(intento, idempotente, sin_conectar)
+                if espera is None:
+                    return None
+                await asyncio.sleep(espera)
+                continue
+            espera = self._decidir(res, intento, idempotente)
+            if espera is None:
+                return res
+            logging.warning("Evolution API HTTP %s en %s, reintentando en %.1fs.", res.status_code, ruta, espera)
+            await asyncio.sleep(espera)
+        return None
+
+    async def estado_conexion(self, timeout=15):
+        if not self.configurado:
+            return "unknown"
+        res = await self._solicitar("GET", "instance/connectionState", timeout_lectura=timeout)
+        if res is None:
+            return "unknown"
+        if res.status_code != 200:
+            logging.warning("Estado de conexión: HTTP %s. Respuesta: %s", res.status_code, res.text[:500])
+            return "unknown"
+        try:
+            return _estado_desde_respuesta(res.json())
+        except ValueError:
+            logging.warning("Estado de conexión: respuesta no es JSON: %s", res.text[:500])
+            return "unknown"
+
+    async def enviar_presencia(self, numero, presencia="composing"):
+        res = await self._solicitar("POST", "chat/sendPresence", json={"number": numero, "presence": presencia},
+                                    timeout_lectura=10)
+        return res is not None and res.status_code in (200, 201)
+
+    async def enviar_texto(self, numero, mensaje, simular_escritura=True):
+        if not self._puede_enviar(mensaje):
+            return False
+        await self.enviar_presencia(numero)
+        if simular_escritura:
+            await asyncio.sleep(random.randint(ESCRITURA_MIN_SEG, ESCRITURA_MAX_SEG))
+        res = await self._solicitar("POST", "message/sendText", json=self._payload_texto(numero, mensaje),
+                                    idempotente=False)
+        if res is None:
+            return False
+        if res.status_code not in (200, 201):
+            logging.error("Error al enviar mensaje. HTTP %s, respuesta: %s", res.status_code, res.text[:500])
         return res.status_code in (200, 201)
-    except Exception:
-        logging.exception("Excepción al enviar mensaje de texto por WhatsApp.")
-        return False
 
+    async def enviar_alerta(self, numero_operador, texto):
+        if not numero_operador:
+            return False
+        return await self.enviar_texto(numero_operador, texto, simular_escritura=False)
 
-def enviar_alerta_whatsapp(base_url, token, instance, numero_operador, texto):
+    async def cerrar(self):
+        if self._cliente is not None and not self._cliente.is_closed:
+            await self._cliente.aclose()
+
+
+# --- API funcional (compatibilidad) ---
+_clientes = {}
+_clientes_lock = threading.Lock()
+
+
+def _cliente_para(base_url, instance, token):
+    clave = ((base_url or "").strip().rstrip("/"), instance, token)
+    with _clientes_lock:
+        if clave not in _clientes:
+            _clientes[clave] = EvolutionClient(base_url, token, instance)
+        return _clientes[clave]
+
+
+def verificar_estado_conexion(base_url, instance, token, timeout=15):
     """
-    Intento best-effort de auto-alertarse por WhatsApp cuando algo se degrada
-    (fallos repetidos con sesión aún 'open', errores de SerpAPI, etc).
-    No usar para avisar caída total de sesión: en ese caso este envío también
-    fallará (con razón), por eso es "best-effort" y nunca lanza excepción.
+    Consulta el estado de la sesión de WhatsApp en Evolution API.
+    Devuelve "open", "close" o "unknown" (nunca lanza excepción hacia el caller).
     """
-    if not numero_operador:
-        return False
+    return _cliente_para(base_url, instance, token).estado_conexion(timeout)
+
+
+def enviar_mensaje_texto(base_url, token, instance, numero, mensaje, simular_escritura=True):
+    """Ver EvolutionClient.enviar_texto."""
+    return _cliente_para(base_url, instance, token).enviar_texto(numero, mensaje, simular_escritura)
+
+
+def enviar_alerta_whatsapp(base_url, token, instance, numero_operador, texto):
+    """Ver EvolutionClient.enviar_alerta (best-effort, nunca lanza excepción)."""
     try:
-        return enviar_mensaje_texto(
-            base_url, token, instance, numero_operador, texto, simular_escritura=False
-        )
+        return _cliente_para(base_url, instance, token).enviar_alerta(numero_operador, texto)
     except Exception:
         logging.exception("Fallo al intentar enviar alerta por WhatsApp.")
         return False
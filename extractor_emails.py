@@ -0,0 +1,333 @@
+"""
+Extracción de emails de contacto desde los sitios web de los leads.
+
+Antes worker.py llamaba a buscar_email_en_web lead por lead dentro del loop
+de resultados de SerpAPI: hasta 7 requests.get secuenciales por sitio (home +
+PAGINAS_CONTACTO) con timeouts de 8-12 s, así que una sola página de SerpAPI
+podía bloquear el ciclo varios minutos. buscar_emails_en_lote rastrea todos
+los sitios del lote en paralelo (pool de threads con sesiones HTTP
+reutilizadas), con un tope de requests simultáneos por host y un deadline
+global; dentro de cada sitio se detiene apenas encuentra un email. Cada
+página se lee en streaming, hasta EMAIL_MAX_BYTES y solo si es HTML, y se
+deja de descargar apenas aparece un email prioritario.
+
+Los resultados quedan en un cache en disco (ARCHIVO_CACHE_EMAILS) por dominio
+normalizado, incluyendo los sitios donde no se encontró email (con un TTL más
+corto), para no volver a rastrear en cada ciclo el mismo negocio cuando
+reaparece bajo otro término de búsqueda. Un "sin email" solo se cachea si
+todas las páginas respondieron: un timeout, un error de conexión o un 5xx
+(sitio caído un rato) no cuenta como resultado y se reintenta al ciclo
+siguiente.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PAGINAS_CONTACTO = ["/contacto", "/contact", "/contactenos", "/nosotros", "/about", "/sobre-nosotros"]
+EMAIL_MAX_WORKERS = int(os.getenv("EMAIL_MAX_WORKERS", "8"))
+EMAIL_MAX_POR_HOST = int(os.getenv("EMAIL_MAX_POR_HOST", "2"))
+EMAIL_DEADLINE_SEG = float(os.getenv("EMAIL_DEADLINE_SEG", "90"))
+TIMEOUT_HOME_SEG = 12
+TIMEOUT_CONTACTO_SEG = 8
+EMAIL_MAX_BYTES = int(os.getenv("EMAIL_MAX_BYTES", str(512 * 1024)))
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+ARCHIVO_CACHE_EMAILS = os.getenv("EMAIL_CACHE_PATH", "cache_emails.json")
+EMAIL_CACHE_TTL_DIAS = float(os.getenv("EMAIL_CACHE_TTL_DIAS", "90"))
+EMAIL_CACHE_TTL_NEGATIVO_DIAS = float(os.getenv("EMAIL_CACHE_TTL_NEGATIVO_DIAS", "14"))
+EMAIL_CACHE_MAX = int(os.getenv("EMAIL_CACHE_MAX", "5000"))
+
+_local = threading.local()
+_semaforos_host = {}
+_semaforos_lock = threading.Lock()
+_estadisticas_cache = {"aciertos": 0, "consultas": 0}
+
+_PATRON_EMAIL_TEXTO = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+_PATRON_EMAIL = re.compile(_PATRON_EMAIL_TEXTO.pattern.encode())
+_PATRON_MAILTO = re.compile(rb'mailto:([^"\'<>\s?&]+)')
+_CARACTERES_PARTE_LOCAL = frozenset(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._%+-")
+_MAX_PARTE_LOCAL = 128
+_MAX_DOMINIO = 256
+_SOLAPE = _MAX_PARTE_LOCAL + _MAX_DOMINIO
+_EXTENSIONES_IMAGEN = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg')
+_PALABRAS_PRIORITARIAS = ('contacto', 'info', 'ventas')
+
+
+def _posiciones(buffer, patron):
+    posiciones = []
+    pos = buffer.find(patron)
+    while pos != -1:
+        posiciones.append(pos)
+        pos = buffer.find(patron, pos + 1)
+    return posiciones
+
+
+def _inicio_de_palabra(buffer, pos):
+    tope = max(0, pos - _MAX_PARTE_LOCAL)
+    while pos > tope and buffer[pos - 1] in _CARACTERES_PARTE_LOCAL:
+        pos -= 1
+    return pos
+
+
+class _EscanerEmails:
+    """
+    Busca emails en el HTML a medida que llega por chunks (bytes), sin
+    decodificar la página completa. Mantiene el mismo criterio de antes: el
+    primer email "prioritario" (contacto/info/ventas) en orden de aparición o,
+    si no hay ninguno, el primero encontrado; descarta falsos positivos tipo
+    "logo@2x.png". Además lee los href "mailto:" (que pueden venir con la @
+    codificada como %40).
+    """
+
+    def __init__(self):
+        self.emails = {}
+        self.prioritario = ""
+        self._resto = b""
+
+    def _agregar(self, email):
+        email = email.lower()
+        if email in self.emails or email.endswith(_EXTENSIONES_IMAGEN):
+            return
+        self.emails[email] = None
+        if not self.prioritario and any(p in email for p in _PALABRAS_PRIORITARIAS):
+            self.prioritario = email
+
+    def alimentar(self, chunk, final=False):
+        """Procesa un chunk; devuelve True si ya hay un email prioritario (se puede cortar)."""
+        buffer = self._resto + chunk
+        # Lo que está cerca del final puede seguir en el próximo chunk: se
+        # deja para la siguiente pasada, retrocediendo hasta el inicio de la
+        # "palabra" para no partir la parte local de un email.
+        corte = len(buffer) if final else _inicio_de_palabra(buffer, max(0, len(buffer) - _SOLAPE))
+        # El regex solo se evalúa alrededor de cada "@" o "mailto:" (búsqueda
+        # de bytes, muy rápida): recorrerlo sobre todo el HTML es lento en
+        # páginas con imágenes en base64, que son largas corridas de [a-zA-Z0-9+].
+        consumido = 0
+        for pos in sorted(_posiciones(buffer, b"@") + _posiciones(buffer, b"mailto:")):
+            if pos < consumido:
+                continue
+            if buffer.startswith(b"mailto:", pos):
+                match = _PATRON_MAILTO.match(buffer, pos)
+            else:
+                match = _PATRON_EMAIL.search(buffer, max(consumido, pos - _MAX_PARTE_LOCAL), pos + _MAX_DOMINIO)
+                if match is not None and match.start() > pos:
+                    match = None
+            if match is None:
+                continue
+            if match.end() > corte:
+                corte = min(corte, match.start())
+                break
+            consumido = match.end()
+            if match.re is _PATRON_MAILTO:
+                email = unquote(match.group(1).decode("ascii", "ignore"))
+                if _PATRON_EMAIL_TEXTO.fullmatch(email):
+                    self._agregar(email)
+            else:
+                self._agregar(match.group().decode("ascii"))
+            if self.prioritario:
+                return True
+        self._resto = buffer[corte:]
+        return False
+
+    def resultado(self):
+        return self.prioritario or next(iter(self.emails), "")
+
+
+def _session():
+    # requests.Session no es thread-safe: una por thread del pool, reutilizada
+    # entre sitios para aprovechar keep-alive y el pool de conexiones.
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=EMAIL_MAX_POR_HOST)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+def _semaforo_host(host):
+    with _semaforos_lock:
+        if host not in _semaforos_host:
+            _semaforos_host[host] = threading.BoundedSemaphore(EMAIL_MAX_POR_HOST)
+        return _semaforos_host[host]
+
+
+def _es_html(response):
+    tipo = response.headers.get("Content-Type", "").lower()
+    # Sin Content-Type se intenta igual; PDFs, imágenes, etc. se descartan sin leerlos.
+    return not tipo or "html" in tipo or tipo.startswith("text/")
+
+
+def _email_en_pagina(url, timeout, limite, solo_200=False):
+    """
+    Descarga `url` en streaming (acotada por el tope por host, el deadline del
+    lote y EMAIL_MAX_BYTES) y devuelve (email o "", respondio): `respondio` es
+    False si la página no se pudo leer (timeout, error de conexión, 5xx o
+    deadline), y entonces un "" no dice nada del sitio. Corta la descarga
+    apenas aparece un email prioritario.
+    """
+    restante = limite - time.monotonic()
+    if restante <= 0:
+        return "", False
+    semaforo = _semaforo_host(urlparse(url).netloc.lower())
+    if not semaforo.acquire(timeout=restante):
+        return "", False
+    try:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return "", False
+        with _session().get(url, timeout=min(timeout, restante), stream=True) as response:
+            if response.status_code >= 500:
+                return "", False
+            if (solo_200 and response.status_code != 200) or not _es_html(response):
+                return "", True
+            escaner = _EscanerEmails()
+            leidos = 0
+            for chunk in response.iter_content(chunk_size=16 * 1024):
+                leidos += len(chunk)
+                if escaner.alimentar(chunk) or leidos >= EMAIL_MAX_BYTES:
+                    break
+                if time.monotonic() >= limite:
+                    return escaner.resultado(), False
+            else:
+                escaner.alimentar(b"", final=True)
+            return escaner.resultado(), True
+    except Exception:
+        return "", False
+    finally:
+        semaforo.release()
+
+
+def _rastrear_sitio(url, limite):
+    """
+    Busca un email en la home del sitio; si no encuentra nada, intenta las
+    páginas de contacto típicas, en orden, y se detiene en el primer email.
+    Devuelve (email, concluyente): un "sin email" no es concluyente si alguna
+    página no respondió o el rastreo se cortó por el deadline del lote.
+    """
+    email, concluyente = _email_en_pagina(url, TIMEOUT_HOME_SEG, limite)
+    if email:
+        return email, True
+
+    base = url.rstrip('/')
+    for pagina in PAGINAS_CONTACTO:
+        email, respondio = _email_en_pagina(base + pagina, TIMEOUT_CONTACTO_SEG, limite, solo_200=True)
+        if email:
+            return email, True
+        concluyente = concluyente and respondio
+    return "", concluyente
+
+
+# --- CACHE DE EMAILS POR DOMINIO ---
+def normalizar_dominio(url):
+    """'https://www.Clinica.cl:443/contacto' -> 'clinica.cl' (clave del cache)."""
+    host = urlparse(url).netloc.lower().rsplit("@", 1)[-1].split(":", 1)[0]
+    return host[4:] if host.startswith("www.") else host
+
+
+def _cargar_cache():
+    if os.path.exists(ARCHIVO_CACHE_EMAILS):
+        try:
+            with open(ARCHIVO_CACHE_EMAILS, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            logging.exception("No se pudo leer %s, se parte con el cache vacío.", ARCHIVO_CACHE_EMAILS)
+    return {}
+
+
+def _guardar_cache(cache):
+    # El orden del dict es el orden LRU (el menos usado primero): al superar
+    # EMAIL_CACHE_MAX se descartan las entradas del principio.
+    for dominio in list(cache)[:max(0, len(cache) - EMAIL_CACHE_MAX)]:
+        del cache[dominio]
+    tmp = f"{ARCHIVO_CACHE_EMAILS}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=0)
+        os.replace(tmp, ARCHIVO_CACHE_EMAILS)
+    except Exception:
+        logging.exception("No se pudo escribir %s.", ARCHIVO_CACHE_EMAILS)
+
+
+def _vigente(entrada, ahora):
+    ttl_dias = EMAIL_CACHE_TTL_DIAS if entrada.get("email") else EMAIL_CACHE_TTL_NEGATIVO_DIAS
+    return ahora - entrada.get("ts", 0) < ttl_dias * 86400
+
+
+def estadisticas_cache():
+    """Aciertos/consultas al cache de emails en este proceso y la tasa de acierto."""
+    consultas = _estadisticas_cache["consultas"]
+    return {**_estadisticas_cache, "tasa": _estadisticas_cache["aciertos"] / consultas if consultas else 0.0}
+
+
+def buscar_emails_en_lote(urls, deadline_seg=None):
+    """
+    Rastrea en paralelo los sitios de `urls` y devuelve {url: email} (email
+    vacío si no se encontró, la URL no es válida o se agotó el deadline).
+    Los dominios con una entrada vigente en el cache no se vuelven a rastrear.
+    """
+    validas = list(dict.fromkeys(u for u in urls if u and u.startswith("http")))
+    resultados = {u: "" for u in urls if u}
+    if not validas:
+        return resultados
+
+    cache = _cargar_cache()
+    ahora = time.time()
+    por_rastrear = {}
+    for url in validas:
+        dominio = normalizar_dominio(url)
+        _estadisticas_cache["consultas"] += 1
+        entrada = cache.get(dominio)
+        if entrada is not None and _vigente(entrada, ahora):
+            _estadisticas_cache["aciertos"] += 1
+            resultados[url] = entrada.get("email", "")
+            cache[dominio] = cache.pop(dominio)  # Pasa al final (usado recién).
+        else:
+            # Dos URLs del mismo dominio en el lote se rastrean una sola vez.
+            por_rastrear.setdefault(dominio, url)
+    if not por_rastrear:
+        _guardar_cache(cache)
+        return resultados
+
+    limite = time.monotonic() + (deadline_seg if deadline_seg is not None else EMAIL_DEADLINE_SEG)
+    pool = ThreadPoolExecutor(max_workers=min(EMAIL_MAX_WORKERS, len(por_rastrear)))
+    try:
+        futuros = {pool.submit(_rastrear_sitio, url, limite): dominio for dominio, url in por_rastrear.items()}
+        hechos, pendientes = wait(futuros, timeout=max(0.0, limite - time.monotonic()) + 1)
+        for futuro in hechos:
+            dominio = futuros[futuro]
+            try:
+                email, concluyente = futuro.result()
+            except Exception:
+                logging.exception("Error rastreando email en %s.", por_rastrear[dominio])
+                continue
+            if concluyente:
+                cache.pop(dominio, None)
+                cache[dominio] = {"email": email, "ts": ahora}
+        if pendientes:
+            logging.warning("Deadline de búsqueda de emails: %s sitios sin terminar.", len(pendientes))
+    finally:
+        # Los threads que sigan vivos terminan solos al vencer el deadline.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    for url in validas:
+        entrada = cache.get(normalizar_dominio(url))
+        if entrada is not None and not resultados[url]:
+            resultados[url] = entrada.get("email", "")
+    _guardar_cache(cache)
+    return resultados
+
+
+def buscar_email_en_web(url):
+    """Email de contacto de un solo sitio (ver buscar_emails_en_lote)."""
+    return buscar_emails_en_lote([url]).get(url, "")
@@ -5,10 +5,14 @@ redactar borradores de respuesta a mensajes entrantes de WhatsApp.
 No envía nada por su cuenta: solo genera texto. El envío real siempre pasa
 por aprobación humana (ver agent_service.py).
 """
+import asyncio
 import logging
 import os
+import random
+import threading
 import time
 
+import httpx
 import requests
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -17,9 +21,81 @@ GEMINI_URL = (
     f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
 )
 
-# Backoff simple para respetar la capa gratuita (~15 solicitudes/min).
-_ULTIMA_LLAMADA = 0.0
-_INTERVALO_MINIMO_SEG = 4.5
+# Presupuesto de la capa gratuita (~15 solicitudes/min). GEMINI_RAFAGA es
+# cuántas solicitudes pueden salir seguidas antes de que el limitador empiece
+# a espaciarlas; la ráfaga cuenta dentro de GEMINI_RPM (ver _limite_por_minuto).
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_RAFAGA = int(os.getenv("GEMINI_RAFAGA", "3"))
+GEMINI_MAX_REINTENTOS = int(os.getenv("GEMINI_MAX_REINTENTOS", "3"))
+GEMINI_TIMEOUT_SEG = float(os.getenv("GEMINI_TIMEOUT_SEG", "30"))
+# Tokens de salida que se reservan por llamada (el borrador es de 3-4 oraciones).
+_TOKENS_SALIDA_ESTIMADOS = 300
+
+
+class TokenBucket:
+    """
+    Token bucket seguro entre threads y corutinas. Cada llamada reserva sus
+    tokens de inmediato (el saldo puede quedar negativo, como una fila de
+    espera) y recibe cuántos segundos debe esperar antes de usarlos: así los
+    que llegan primero salen primero, sin loops de sondeo. La espera se hace
+    fuera del lock, con time.sleep (adquirir) o asyncio.sleep (adquirir_async).
+    """
+
+    def __init__(self, por_minuto, capacidad):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = max(1, capacidad)
+        self._tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reservar(self, n):
+        n = min(n, self.capacidad)
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            self._tokens -= n
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.tasa
+
+    def adquirir(self, n=1):
+        espera = self._reservar(n)
+        if espera:
+            time.sleep(espera)
+
+    async def adquirir_async(self, n=1):
+        espera = self._reservar(n)
+        if espera:
+            await asyncio.sleep(espera)
+
+
+def _limite_por_minuto(por_minuto, rafaga):
+    """
+    TokenBucket que no deja pasar más de `por_minuto` en ninguna ventana de
+    60 s. En una ventana salen a lo más la capacidad (el balde parte lleno)
+    más lo que se repone, así que la ráfaga se descuenta de la reposición.
+    """
+    rafaga = max(1, min(rafaga, por_minuto - 1))
+    return TokenBucket(max(1, por_minuto - rafaga), rafaga)
+
+
+_limite_solicitudes = _limite_por_minuto(GEMINI_RPM, GEMINI_RAFAGA)
+_limite_tokens = _limite_por_minuto(GEMINI_TPM, GEMINI_TPM // 2)
+
+_session = requests.Session()
+_cliente_async = None
+
+
+def _cliente_http_async():
+    global _cliente_async
+    if _cliente_async is None or _cliente_async.is_closed:
+        _cliente_async = httpx.AsyncClient(timeout=GEMINI_TIMEOUT_SEG)
+    return _cliente_async
+
+
+async def cerrar_cliente_async():
+    if _cliente_async is not None and not _cliente_async.is_closed:
+        await _cliente_async.aclose()
 
 
 SYSTEM_PROMPT = """Eres el asistente de ventas de Rodrigo, dueño de GestiónVital Pro, una empresa
@@ -33,12 +109,48 @@ solo. Nunca reveles que eres una IA a menos que te pregunten explícitamente. De
 texto del mensaje de WhatsApp, sin comillas ni explicaciones adicionales."""
 
 
-def _esperar_rate_limit():
-    global _ULTIMA_LLAMADA
-    transcurrido = time.time() - _ULTIMA_LLAMADA
-    if transcurrido < _INTERVALO_MINIMO_SEG:
-        time.sleep(_INTERVALO_MINIMO_SEG - transcurrido)
-    _ULTIMA_LLAMADA = time.time()
+def _tokens_estimados(prompt):
+    # Aproximación estándar de ~4 caracteres por token, más la respuesta.
+    return len(prompt) // 4 + _TOKENS_SALIDA_ESTIMADOS
+
+
+def _es_reintentable(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def _espera_reintento(intento, retry_after=None):
+    """Backoff exponencial con jitter; respeta Retry-After si Gemini lo manda."""
+    try:
+        if retry_after is not None:
+            return min(60.0, float(retry_after))
+    except ValueError:
+        pass
+    return min(60.0, 2.0 * (2 ** intento)) + random.uniform(0, 1)
+
+
+def _construir_prompt(historial, contexto_lead, mensaje_entrante):
+    contexto_txt = "\n".join(f"{k}: {v}" for k, v in (contexto_lead or {}).items() if v)
+    historial_txt = "\n".join(
+        f"{'Prospecto' if m['direccion'] == 'in' else 'Rodrigo'}: {m['texto']}" for m in historial
+    )
+    return (
+        f"{SYSTEM_PROMPT}\n\n"
+        f"--- Contexto del lead ---\n{contexto_txt or '(sin datos del lead en la base)'}\n\n"
+        f"--- Historial reciente ---\n{historial_txt or '(sin historial previo)'}\n\n"
+        f"--- Último mensaje del prospecto ---\n{mensaje_entrante}\n\n"
+        f"Redacta el borrador de respuesta:"
+    )
+
+
+def _extraer_texto(data, mensaje_entrante):
+    candidatos = data.get("candidates", [])
+    if not candidatos:
+        logging.error("Gemini no devolvió candidatos: %s", data)
+        return _borrador_fallback(mensaje_entrante)
+
+    partes = candidatos[0].get("content", {}).get("parts", [])
+    texto = "".join(p.get("text", "") for p in partes).strip()
+    return texto or _borrador_fallback(mensaje_entrante)
 
 
 def generar_borrador(historial, contexto_lead, mensaje_entrante):
@@ -55,45 +167,79 @@ def generar_borrador(historial, contexto_lead, mensaje_entrante):
         logging.error("GEMINI_API_KEY no configurado; devolviendo borrador de fallback.")
         return _borrador_fallback(mensaje_entrante)
 
-    contexto_txt = "\n".join(f"{k}: {v}" for k, v in (contexto_lead or {}).items() if v)
-    historial_txt = "\n".join(
-        f"{'Prospecto' if m['direccion'] == 'in' else 'Rodrigo'}: {m['texto']}" for m in historial
-    )
+    prompt = _construir_prompt(historial, contexto_lead, mensaje_entrante)
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
 
-    prompt = (
-        f"{SYSTEM_PROMPT}\n\n"
-        f"--- Contexto del lead ---\n{contexto_txt or '(sin datos del lead en la base)'}\n\n"
-        f"--- Historial reciente ---\n{historial_txt or '(sin historial previo)'}\n\n"
-        f"--- Último mensaje del prospecto ---\n{mensaje_entrante}\n\n"
-        f"Redacta el borrador de respuesta:"
-    )
+    for intento in range(GEMINI_MAX_REINTENTOS + 1):
+        try:
+            _limite_solicitudes.adquirir()
+            _limite_tokens.adquirir(_tokens_estimados(prompt))
+            res = _session.post(
+                GEMINI_URL,
+                params={"key": GEMINI_API_KEY},
+                json=payload,
+                timeout=GEMINI_TIMEOUT_SEG,
+            )
+        except requests.RequestException:
+            logging.exception("Excepción de red al llamar a Gemini API (intento %s).", intento + 1)
+            if intento < GEMINI_MAX_REINTENTOS:
+                time.sleep(_espera_reintento(intento))
+            continue
+
+        if res.status_code == 200:
+            try:
+                return _extraer_texto(res.json(), mensaje_entrante)
+            except Exception:
+                logging.exception("Respuesta inválida de Gemini API.")
+                return _borrador_fallback(mensaje_entrante)
+
+        logging.error("Gemini API error: HTTP %s - %s", res.status_code, res.text[:500])
+        if not _es_reintentable(res.status_code) or intento == GEMINI_MAX_REINTENTOS:
+            break
+        time.sleep(_espera_reintento(intento, res.headers.get("Retry-After")))
+
+    return _borrador_fallback(mensaje_entrante)
+
+
+async def generar_borrador_async(historial, contexto_lead, mensaje_entrante):
+    """
+    Igual que generar_borrador, pero sobre un httpx.AsyncClient compartido
+    (conexiones reutilizadas): bajo carga, cada corutina espera su turno del
+    limitador con asyncio.sleep en vez de ocupar un thread.
+    """
+    if not GEMINI_API_KEY:
+        logging.error("GEMINI_API_KEY no configurado; devolviendo borrador de fallback.")
+        return _borrador_fallback(mensaje_entrante)
 
+    prompt = _construir_prompt(historial, contexto_lead, mensaje_entrante)
     payload = {"contents": [{"parts": [{"text": prompt}]}]}
 
-    try:
-        _esperar_rate_limit()
-        res = requests.post(
-            GEMINI_URL,
-            params={"key": GEMINI_API_KEY},
-            json=payload,
-            timeout=30,
-        )
-        if res.status_code != 200:
-            logging.error("Gemini API error: HTTP %s - %s", res.status_code, res.text[:500])
-            return _borrador_fallback(mensaje_entrante)
-
-        data = res.json()
-        candidatos = data.get("candidates", [])
-        if not candidatos:
-            logging.error("Gemini no devolvió candidatos: %s", data)
-            return _borrador_fallback(mensaje_entrante)
-
-        partes = candidatos[0].get("content", {}).get("parts", [])
-        texto = "".join(p.get("text", "") for p in partes).strip()
-        return texto or _borrador_fallback(mensaje_entrante)
-    except Exception:
-        logging.exception("Excepción al llamar a Gemini API.")
-        return _borrador_fallback(mensaje_entrante)
+    for intento in range(GEMINI_MAX_REINTENTOS + 1):
+        try:
+            await _limite_solicitudes.adquirir_async()
+            await _limite_tokens.adquirir_async(_tokens_estimados(prompt))
+            res = await _cliente_http_async().post(
+                GEMINI_URL, params={"key": GEMINI_API_KEY}, json=payload
+            )
+        except httpx.HTTPError:
+            logging.exception("Excepción de red al llamar a Gemini API (intento %s).", intento + 1)
+            if intento < GEMINI_MAX_REINTENTOS:
+                await asyncio.sleep(_espera_reintento(intento))
+            continue
+
+        if res.status_code == 200:
+            try:
+                return _extraer_texto(res.json(), mensaje_entrante)
+            except Exception:
+                logging.exception("Respuesta inválida de Gemini API.")
+                return _borrador_fallback(mensaje_entrante)
+
+        logging.error("Gemini API error: HTTP %s - %s", res.status_code, res.text[:500])
+        if not _es_reintentable(res.status_code) or intento == GEMINI_MAX_REINTENTOS:
+            break
+        await asyncio.sleep(_espera_reintento(intento, res.headers.get("Retry-After")))
+
+    return _borrador_fallback(mensaje_entrante)
 
 
 def _borrador_fallback(mensaje_entrante):
@@ -0,0 +1,170 @@
+"""
+Gobernador de tasa de envíos de WhatsApp, común a todas las rutas que envían
+por la misma instancia de Evolution API: los envíos programados de
+worker.py / worker_almacenes.py (ver programador_envios) y las respuestas que
+el operador aprueba en agent_service.approve_draft.
+
+Antes cada ruta tenía su propio tope (5 por ciclo en clínicas, 3 por ciclo +
+MAX_MENSAJES_DIARIOS en almacenes) y el agente enviaba sin límite, aunque el
+riesgo de baneo es por instancia. Acá hay dos token buckets persistentes, uno
+por hora (ENVIOS_MAX_POR_HORA) y otro por día (ENVIOS_MAX_POR_DIA), que se
+recargan de forma continua; cada envío toma un token de ambos.
+
+Prioridad: las respuestas del operador (PRIORIDAD_OPERADOR) pueden usar toda
+la capacidad; la prospección en frío (PRIORIDAD_PROSPECCION) no puede dejar
+ninguno de los dos buckets por debajo de RESERVA_OPERADOR_HORA/_DIA. Así la
+prospección usa todo lo que sobra y una respuesta a un prospecto interesado
+nunca queda bloqueada por el outreach del día.
+
+Los workers corren en GitHub Actions y el agente en el VPS, sin archivos en
+común: si AGENT_SERVICE_URL está configurado, adquirir_envio le pide el token
+al agente (POST /governor/acquire), que guarda el único estado de la
+instancia. Sin agente (o si no responde) se usa el estado local en
+ARCHIVO_GOBERNADOR, que los workflows commitean.
+
+Las alertas al propio operador (evo.enviar_alerta) no pasan por acá: no son
+mensajes a terceros ni cuentan para el riesgo de baneo.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+ARCHIVO_GOBERNADOR = os.getenv("GOBERNADOR_ENVIOS_PATH", "gobernador_envios.json")
+ENVIOS_MAX_POR_HORA = int(os.getenv("ENVIOS_MAX_POR_HORA", "12"))
+ENVIOS_MAX_POR_DIA = int(os.getenv("ENVIOS_MAX_POR_DIA", "60"))
+RESERVA_OPERADOR_HORA = int(os.getenv("RESERVA_OPERADOR_HORA", "3"))
+RESERVA_OPERADOR_DIA = int(os.getenv("RESERVA_OPERADOR_DIA", "10"))
+AGENT_SERVICE_URL = os.getenv("AGENT_SERVICE_URL", "")
+AGENT_SERVICE_TOKEN = os.getenv("AGENT_SERVICE_TOKEN", "")
+
+PRIORIDAD_OPERADOR = "operador"
+PRIORIDAD_PROSPECCION = "prospeccion"
+PRIORIDADES = (PRIORIDAD_OPERADOR, PRIORIDAD_PROSPECCION)
+
+
+class GobernadorEnvios:
+    """
+    Buckets por hora y por día persistidos en `archivo`. Seguro entre
+    threads de un mismo proceso; en cada host escribe el archivo un solo
+    proceso (el agente en el VPS, o el worker/despachador de turno en
+    GitHub Actions, que corren de a uno por el grupo de concurrencia).
+    """
+
+    def __init__(self, archivo=ARCHIVO_GOBERNADOR, por_hora=ENVIOS_MAX_POR_HORA, por_dia=ENVIOS_MAX_POR_DIA,
+                 reserva_hora=RESERVA_OPERADOR_HORA, reserva_dia=RESERVA_OPERADOR_DIA):
+        self.archivo = archivo
+        # ventana -> (capacidad, período en segundos, reserva para el operador)
+        self.ventanas = {
+            "hora": (por_hora, 3600, min(reserva_hora, por_hora)),
+            "dia": (por_dia, 86400, min(reserva_dia, por_dia)),
+        }
+        self._lock = threading.Lock()
+
+    def _leer(self, ahora):
+        estado = {}
+        if os.path.exists(self.archivo):
+            try:
+                with open(self.archivo, "r", encoding="utf-8") as f:
+                    estado = json.load(f)
+            except Exception:
+                logging.exception("No se pudo leer %s, se parte con los buckets llenos.", self.archivo)
+        buckets = {}
+        for ventana, (capacidad, periodo, _) in self.ventanas.items():
+            previo = estado.get(ventana) or {"tokens": capacidad, "actualizado": ahora}
+            recarga = max(0.0, ahora - previo["actualizado"]) * capacidad / periodo
+            buckets[ventana] = {"tokens": min(capacidad, previo["tokens"] + recarga), "actualizado": ahora}
+        return buckets
+
+    def _guardar(self, buckets):
+        try:
+            with open(f"{self.archivo}.tmp", "w", encoding="utf-8") as f:
+                json.dump(buckets, f, indent=2)
+            os.replace(f"{self.archivo}.tmp", self.archivo)
+        except Exception:
+            logging.exception("No se pudo escribir %s.", self.archivo)
+
+    def adquirir(self, prioridad=PRIORIDAD_PROSPECCION, ahora=None):
+        """
+        Intenta tomar un envío. Devuelve (permitido, espera_seg): si no hay
+        cupo, espera_seg es cuánto falta para que lo haya (no bloquea: el
+        llamador decide si reintenta más tarde).
+        """
+        if prioridad not in PRIORIDADES:
+            raise ValueError(f"Prioridad desconocida: {prioridad}")
+        ahora = time.time() if ahora is None else ahora
+        with self._lock:
+            buckets = self._leer(ahora)
+            espera = 0.0
+            for ventana, (capacidad, periodo, reserva) in self.ventanas.items():
+                piso = 0 if prioridad == PRIORIDAD_OPERADOR else reserva
+                faltante = piso + 1 - buckets[ventana]["tokens"]
+                if faltante > 0:
+                    espera = max(espera, faltante * periodo / capacidad if capacidad else float("inf"))
+            if espera:
+                return False, espera
+            for bucket in buckets.values():
+                bucket["tokens"] -= 1
+            self._guardar(buckets)
+            return True, 0.0
+
+    def devolver(self, ahora=None):
+        """
+        Devuelve el envío tomado con adquirir cuando al final no salió (el
+        envío falló): un intento fallido no gasta cupo anti-baneo.
+        """
+        ahora = time.time() if ahora is None else ahora
+        with self._lock:
+            buckets = self._leer(ahora)
+            for ventana, (capacidad, _, _) in self.ventanas.items():
+                buckets[ventana]["tokens"] = min(capacidad, buckets[ventana]["tokens"] + 1)
+            self._guardar(buckets)
+
+    def disponibles(self, ahora=None):
+        """Envíos disponibles ahora en cada ventana, por prioridad (para /health y logs)."""
+        ahora = time.time() if ahora is None else ahora
+        with self._lock:
+            buckets = self._leer(ahora)
+        return {
+            ventana: {
+                PRIORIDAD_OPERADOR: int(buckets[ventana]["tokens"]),
+                PRIORIDAD_PROSPECCION: max(0, int(buckets[ventana]["tokens"] - reserva)),
+            }
+            for ventana, (_, _, reserva) in self.ventanas.items()
+        }
+
+
+_gobernador_local = None
+
+
+def gobernador_local():
+    global _gobernador_local
+    if _gobernador_local is None:
+        _gobernador_local = GobernadorEnvios()
+    return _gobernador_local
+
+
+def adquirir_envio(prioridad=PRIORIDAD_PROSPECCION):
+    """
+    Toma un envío del gobernador de la instancia: el del agente si
+    AGENT_SERVICE_URL está configurado, o el local si no (o si el agente no
+    responde). Devuelve (permitido, espera_seg).
+    """
+    if AGENT_SERVICE_URL:
+        headers = {"x-agent-token": AGENT_SERVICE_TOKEN} if AGENT_SERVICE_TOKEN else {}
+        try:
+            res = requests.post(
+                f"{AGENT_SERVICE_URL.rstrip('/')}/governor/acquire",
+                json={"prioridad": prioridad}, headers=headers, timeout=10,
+            )
+            if res.status_code == 200:
+                data = res.json()
+                return bool(data["permitido"]), float(data.get("espera_seg", 0))
+            logging.warning("Gobernador del agente respondió HTTP %s: %s", res.status_code, res.text[:300])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.warning("No se pudo consultar el gobernador del agente: %s", e)
+        logging.warning("Se usa el gobernador de envíos local (%s).", ARCHIVO_GOBERNADOR)
+    return gobernador_local().adquirir(prioridad)
@@ -0,0 +1,263 @@
+"""
+Índice de deduplicación de leads compartido entre las dos líneas (clínicas y
+almacenes).
+
+Antes cada worker armaba, en cada búsqueda, un set con los últimos 9 dígitos
+de los teléfonos de su propio CSV: el mismo negocio con otro teléfono, o que
+ya estaba en el CSV de la otra línea, se contactaba dos veces. Este índice
+reconoce un lead como duplicado si coincide cualquiera de:
+  - el teléfono (últimos 9 dígitos);
+  - el dominio del sitio web (para Instagram/Facebook/etc., el perfil);
+  - el nombre normalizado en la misma comuna, por similitud de trigramas
+    (Jaccard >= DEDUP_UMBRAL_NOMBRE) sobre un índice invertido, así que
+    "Clínica Estética Sol Ltda." y "Estetica Sol" en Providencia son el mismo.
+
+Se persiste en ARCHIVO_INDICE y se actualiza de forma incremental: al cargar
+solo se agregan/quitan los Ids que cambiaron en cada CSV (el de la otra línea
+solo se relee si cambió su mtime/tamaño), y revisar un lead nuevo es una
+búsqueda en diccionarios, no una reconstrucción por búsqueda.
+"""
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+import pandas as pd
+
+from diario_leads import CSVS_POR_LINEA
+from extractor_emails import normalizar_dominio
+
+ARCHIVO_INDICE = os.getenv("DEDUP_INDICE_PATH", "indice_leads.json")
+DEDUP_UMBRAL_NOMBRE = float(os.getenv("DEDUP_UMBRAL_NOMBRE", "0.75"))
+
+# Sitios donde el dominio no identifica al negocio: se usa host + perfil.
+_PLATAFORMAS = {
+    "facebook.com", "m.facebook.com", "instagram.com", "linktr.ee", "wa.me",
+    "api.whatsapp.com", "tiktok.com", "sites.google.com", "linkedin.com",
+}
+# Links que no sirven para identificar al negocio (ej. la propia ficha de Maps).
+_DOMINIOS_IGNORADOS = {"google.com", "maps.google.com", "goo.gl", "maps.app.goo.gl", "g.page"}
+# Palabras genéricas del rubro que no distinguen un negocio de otro.
+_PALABRAS_GENERICAS = {
+    "clinica", "centro", "estetica", "estetico", "spa", "medica", "medico", "salud", "depilacion",
+    "laser", "facial", "belleza", "ltda", "limitada", "sa", "eirl", "y", "de", "del", "la",
+    "el", "los", "las", "en", "minimarket", "almacen", "botilleria", "market", "chile",
+}
+
+
+def _sin_acentos(texto):
+    texto = str(texto)
+    if not texto.isascii():
+        # "Ñuñoa" -> "Nunoa": NFKD separa la tilde, que no es ASCII y se descarta.
+        texto = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+    return texto.lower()
+
+
+def normalizar_nombre(nombre):
+    """'Clínica Estética Sol Ltda.' -> 'sol' (sin acentos, puntuación ni palabras genéricas)."""
+    palabras = re.sub(r"[^a-z0-9]+", " ", _sin_acentos(nombre)).split()
+    return " ".join(p for p in palabras if p not in _PALABRAS_GENERICAS)
+
+
+@lru_cache(maxsize=1024)
+def normalizar_zona(zona):
+    return re.sub(r"[^a-z0-9]+", " ", _sin_acentos(zona)).strip()
+
+
+def clave_telefono(telefono):
+    digitos = "".join(filter(str.isdigit, str(telefono).replace(".0", "")))
+    return digitos[-9:] if len(digitos) >= 8 else ""
+
+
+def clave_sitio(url):
+    if not url or not str(url).startswith("http"):
+        return ""
+    dominio = normalizar_dominio(url)
+    if not dominio or dominio in _DOMINIOS_IGNORADOS:
+        return ""
+    if dominio in _PLATAFORMAS:
+        perfil = re.sub(r"^https?://[^/]+/?", "", str(url)).split("/")[0].split("?")[0].lower()
+        return f"{dominio}/{perfil}" if perfil else ""
+    return dominio
+
+
+def _trigramas(nombre):
+    texto = f"  {nombre} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceDuplicados:
+    """
+    Índice en memoria de los leads de ambas líneas. Cada lead se identifica
+    como "linea:Id" y guarda {"tel", "sitio", "nombre", "zona"}; los índices
+    por teléfono, sitio y trigramas de nombre (por comuna) se derivan al cargar.
+    """
+
+    def __init__(self, datos=None):
+        datos = datos or {}
+        self.firmas = datos.get("firmas", {})
+        self.leads = {}
+        # teléfono / sitio -> {"linea:Id": None} de todos los leads que lo
+        # tienen, en orden de indexación (un dict como conjunto ordenado): al
+        # quitar uno, la clave sigue apuntando a los demás.
+        self._por_tel = {}
+        self._por_sitio = {}
+        self._trigramas = {}
+        for clave, lead in datos.get("leads", {}).items():
+            self._indexar(clave, lead)
+
+    # --- mantenimiento del índice ---
+    def _indexar(self, clave, lead):
+        self.leads[clave] = lead
+        if lead.get("tel"):
+            self._por_tel.setdefault(lead["tel"], {})[clave] = None
+        if lead.get("sitio"):
+            self._por_sitio.setdefault(lead["sitio"], {})[clave] = None
+        if lead.get("nombre"):
+            por_trigrama = self._trigramas.setdefault(lead.get("zona", ""), {})
+            for trigrama in _trigramas(lead["nombre"]):
+                por_trigrama.setdefault(trigrama, set()).add(clave)
+
+    def _desindexar(self, clave):
+        lead = self.leads.pop(clave, None)
+        if lead is None:
+            return
+        for indice, valor in ((self._por_tel, lead.get("tel")), (self._por_sitio, lead.get("sitio"))):
+            duenos = indice.get(valor)
+            if duenos is not None:
+                duenos.pop(clave, None)
+                if not duenos:
+                    del indice[valor]
+        por_trigrama = self._trigramas.get(lead.get("zona", ""), {})
+        for trigrama in _trigramas(lead.get("nombre", "")):
+            por_trigrama.get(trigrama, set()).discard(clave)
+
+    def agregar(self, linea, lead_id, nombre, telefono, sitio="", zona=""):
+        """Agrega un lead aceptado (para que el resto del lote se compare también contra él)."""
+        clave = f"{linea}:{int(lead_id)}"
+        self._desindexar(clave)
+        self._indexar(clave, {
+            "tel": clave_telefono(telefono),
+            "sitio": clave_sitio(sitio),
+            "nombre": normalizar_nombre(nombre),
+            "zona": normalizar_zona(zona),
+        })
+
+    def sincronizar(self, linea, df):
+        """
+        Ajusta el índice de `linea` al contenido de `df` (Id, Evento, Ubicacion,
+        Telefono): agrega los Ids nuevos, quita los que ya no están y reindexa
+        los que cambiaron de teléfono o nombre. Los sitios web no están en el
+        CSV: se conservan los que registró agregar(). Devuelve cuántos cambios hubo.
+        """
+        if df.empty or "Id" not in df.columns:
+            actuales = {}
+        else:
+            ids = pd.to_numeric(df["Id"], errors="coerce")
+            validos = df[ids.notna()]
+            columnas = {c: validos[c].fillna("").astype(str) if c in validos.columns else pd.Series("", index=validos.index)
+                        for c in ("Evento", "Ubicacion", "Telefono")}
+            actuales = {
+                f"{linea}:{int(i)}": (clave_telefono(t), normalizar_nombre(n), normalizar_zona(z))
+                for i, n, z, t in zip(ids[ids.notna()], columnas["Evento"], columnas["Ubicacion"], columnas["Telefono"])
+            }
+
+        cambios = 0
+        prefijo = f"{linea}:"
+        for clave in [c for c in self.leads if c.startswith(prefijo) and c not in actuales]:
+            self._desindexar(clave)
+            cambios += 1
+        for clave, (tel, nombre, zona) in actuales.items():
+            lead = self.leads.get(clave)
+            if lead and (lead.get("tel"), lead.get("nombre"), lead.get("zona")) == (tel, nombre, zona):
+                continue
+            # Un Id que cambió de teléfono (ej. Id reusado tras una caída) pierde el sitio anterior.
+            sitio = lead.get("sitio", "") if lead and lead.get("tel") == tel else ""
+            self._desindexar(clave)
+            self._indexar(clave, {"tel": tel, "sitio": sitio, "nombre": nombre, "zona": zona})
+            cambios += 1
+        return cambios
+
+    def sincronizar_csv(self, linea, archivo):
+        """Como sincronizar, leyendo el CSV solo si cambió su mtime/tamaño desde la última vez."""
+        if not os.path.exists(archivo):
+            return 0
+        stat = os.stat(archivo)
+        firma = [stat.st_mtime, stat.st_size]
+        if self.firmas.get(linea) == firma:
+            return 0
+        df = pd.read_csv(archivo, dtype=str, keep_default_na=False,
+                         usecols=lambda c: c in ("Id", "Evento", "Ubicacion", "Telefono"))
+        cambios = self.sincronizar(linea, df)
+        self.firmas[linea] = firma
+        return cambios
+
+    # --- consultas ---
+    def _nombre_similar(self, nombre, zona):
+        trigramas = _trigramas(nombre)
+        por_trigrama = self._trigramas.get(zona)
+        if not por_trigrama:
+            return None
+        comunes = Counter()
+        for trigrama in trigramas:
+            comunes.update(por_trigrama.get(trigrama, ()))
+        for clave, en_comun in comunes.most_common():
+            otros = len(_trigramas(self.leads[clave]["nombre"]))
+            if en_comun / (len(trigramas) + otros - en_comun) >= DEDUP_UMBRAL_NOMBRE:
+                return clave
+            if en_comun / len(trigramas) < DEDUP_UMBRAL_NOMBRE:
+                break  # Los siguientes tienen aún menos trigramas en común.
+        return None
+
+    def duplicado_de(self, nombre, telefono, sitio="", zona=""):
+        """
+        Devuelve (motivo, "linea:Id") del lead ya conocido con el que coincide
+        (motivo: "telefono", "sitio" o "nombre"), o None si es nuevo.
+        """
+        tel = clave_telefono(telefono)
+        if tel and tel in self._por_tel:
+            return "telefono", next(iter(self._por_tel[tel]))
+        clave = clave_sitio(sitio)
+        if clave and clave in self._por_sitio:
+            return "sitio", next(iter(self._por_sitio[clave]))
+        nombre = normalizar_nombre(nombre)
+        if len(nombre) >= 3:
+            similar = self._nombre_similar(nombre, normalizar_zona(zona))
+            if similar:
+                return "nombre", similar
+        return None
+
+    # --- persistencia ---
+    def guardar(self, archivo=ARCHIVO_INDICE):
+        try:
+            with open(f"{archivo}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"firmas": self.firmas, "leads": self.leads}, f, ensure_ascii=False)
+            os.replace(f"{archivo}.tmp", archivo)
+        except Exception:
+            logging.exception("No se pudo escribir %s.", archivo)
+
+
+def cargar_indice(propios=None, archivo=ARCHIVO_INDICE):
+    """
+    Carga el índice persistido y lo pone al día con los CSV de ambas líneas.
+    `propios` es {linea: df} con los DataFrames que el worker ya tiene en
+    memoria (se usan en vez de releer ese CSV).
+    """
+    datos = None
+    if os.path.exists(archivo):
+        try:
+            with open(archivo, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except Exception:
+            logging.exception("No se pudo leer %s, se reconstruye desde los CSV.", archivo)
+    indice = IndiceDuplicados(datos)
+    propios = propios or {}
+    for linea, archivo_csv in CSVS_POR_LINEA.items():
+        if linea in propios:
+            indice.sincronizar(linea, propios[linea])
+        else:
+            indice.sincronizar_csv(linea, archivo_csv)
+    return indice
@@ -0,0 +1,162 @@
+"""
+Cola persistente de envíos programados (ambas líneas).
+
+Antes cada ciclo de worker.py / worker_almacenes.py enviaba su ráfaga con
+time.sleep entre mensajes (4-8 min en clínicas, 5-10 min en almacenes): casi
+todo el tiempo del runner de GitHub Actions era espera. Ahora el ciclo solo
+elige los candidatos y los programa acá, con la misma pausa humanizada entre
+un envío y el siguiente de la línea, y termina. despachador_envios.py (un cron
+corto) envía lo que ya venció en ambas líneas y sale.
+
+Estado en ARCHIVO_COLA_ENVIOS:
+  {"envios": [{"linea", "id", "dia", "programado"}],   # programado: epoch UTC
+   "lineas": {linea: {"ultimo_envio", "fallos_seguidos"}}}
+
+Garantías:
+  - nunca dos envíos de una misma línea con menos de la pausa mínima entre
+    ellos, aunque el despachador corra atrasado y haya varios vencidos
+    (sale uno por corrida y el resto espera su turno);
+  - cada entrada se saca de la cola ANTES de enviarse: si el proceso muere a
+    mitad del envío, ese lead no se re-envía desde la cola (sigue siendo
+    candidato en el próximo ciclo, que lo vuelve a evaluar contra el CSV);
+  - las entradas con más de COLA_VENCIMIENTO_HORAS de atraso se descartan
+    (el próximo ciclo las vuelve a programar si el lead sigue pendiente);
+  - si el gobernador de envíos de la instancia no da cupo (ver
+    gobernador_envios), la entrada vuelve a la cola tal cual.
+"""
+import json
+import logging
+import os
+import random
+import time
+
+ARCHIVO_COLA_ENVIOS = os.getenv("COLA_ENVIOS_PATH", "cola_envios.json")
+COLA_VENCIMIENTO_HORAS = float(os.getenv("COLA_VENCIMIENTO_HORAS", "3"))
+
+# Lo devuelve ejecutar() cuando no hay cupo de envíos: la entrada vuelve a la cola.
+SIN_CUPO = "sin_cupo"
+
+
+def _cargar(archivo):
+    if os.path.exists(archivo):
+        try:
+            with open(archivo, "r", encoding="utf-8") as f:
+                estado = json.load(f)
+            estado.setdefault("envios", [])
+            estado.setdefault("lineas", {})
+            return estado
+        except Exception:
+            logging.exception("No se pudo leer %s, se parte con la cola vacía.", archivo)
+    return {"envios": [], "lineas": {}}
+
+
+def _guardar(estado, archivo):
+    try:
+        with open(f"{archivo}.tmp", "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False, indent=2)
+        os.replace(f"{archivo}.tmp", archivo)
+    except Exception:
+        logging.exception("No se pudo escribir %s.", archivo)
+
+
+def en_cola(linea, archivo=ARCHIVO_COLA_ENVIOS):
+    """Entradas pendientes de `linea`, en orden de programación."""
+    return sorted((e for e in _cargar(archivo)["envios"] if e["linea"] == linea), key=lambda e: e["programado"])
+
+
+def hay_vencidos(ahora=None, archivo=ARCHIVO_COLA_ENVIOS):
+    """True si alguna línea tiene un envío ya vencido (sin cargar nada más que la cola)."""
+    ahora = time.time() if ahora is None else ahora
+    return any(e["programado"] <= ahora for e in _cargar(archivo)["envios"])
+
+
+def programar(linea, envios, pausa_seg, ahora=None, archivo=ARCHIVO_COLA_ENVIOS):
+    """
+    Agrega a la cola `envios` ([(id, dia)], en el orden en que deben salir).
+    El primero sale ya, o apenas pase una pausa desde el último envío (hecho o
+    programado) de la línea; cada uno de los siguientes, una pausa aleatoria
+    en el rango `pausa_seg` = (min, max) segundos después del anterior. Los
+    Ids que ya están en la cola se omiten. Devuelve las entradas agregadas.
+    """
+    ahora = time.time() if ahora is None else ahora
+    estado = _cargar(archivo)
+    propios = [e for e in estado["envios"] if e["linea"] == linea]
+    ya_en_cola = {str(e["id"]) for e in propios}
+    base = max([e["programado"] for e in propios] + [estado["lineas"].get(linea, {}).get("ultimo_envio", 0)])
+    siguiente = max(ahora, base + random.uniform(*pausa_seg)) if base else ahora
+
+    nuevas = []
+    for lead_id, dia in envios:
+        if str(lead_id) in ya_en_cola:
+            continue
+        nuevas.append({"linea": linea, "id": int(lead_id), "dia": int(dia), "programado": int(siguiente)})
+        ya_en_cola.add(str(lead_id))
+        siguiente += random.uniform(*pausa_seg)
+    if nuevas:
+        estado["envios"].extend(nuevas)
+        _guardar(estado, archivo)
+    return nuevas
+
+
+def cancelar(linea, archivo=ARCHIVO_COLA_ENVIOS):
+    """
+    Descarta los envíos pendientes de `linea` (ej. tras fallos seguidos) y
+    reinicia su contador de fallos seguidos: la alerta que motivó la
+    cancelación no se repite en cada corrida siguiente. Devuelve cuántos.
+    """
+    estado = _cargar(archivo)
+    antes = len(estado["envios"])
+    estado["envios"] = [e for e in estado["envios"] if e["linea"] != linea]
+    info = estado["lineas"].get(linea)
+    if len(estado["envios"]) != antes or (info and info.get("fallos_seguidos")):
+        if info:
+            info["fallos_seguidos"] = 0
+        _guardar(estado, archivo)
+    return antes - len(estado["envios"])
+
+
+def despachar(linea, ejecutar, pausa_min_seg, archivo=ARCHIVO_COLA_ENVIOS):
+    """
+    Ejecuta los envíos vencidos de `linea`, respetando `pausa_min_seg` desde el
+    último envío real de la línea (en la práctica, uno por corrida).
+    `ejecutar(entrada)` debe devolver True (enviado), False (falló), None (el
+    lead ya no corresponde: se descarta sin contar como envío) o SIN_CUPO (la
+    entrada vuelve a la cola y se corta el despacho de la línea).
+    Devuelve {"resultados": [(entrada, resultado)], "fallos_seguidos": n,
+    "sin_cupo": bool}.
+    """
+    estado = _cargar(archivo)
+    info = estado["lineas"].setdefault(linea, {"ultimo_envio": 0, "fallos_seguidos": 0})
+    resultados = []
+    sin_cupo = False
+    while True:
+        ahora = time.time()
+        if ahora - info.get("ultimo_envio", 0) < pausa_min_seg:
+            break
+        vencidas = sorted(
+            (e for e in estado["envios"] if e["linea"] == linea and e["programado"] <= ahora),
+            key=lambda e: e["programado"],
+        )
+        if not vencidas:
+            break
+        entrada = vencidas[0]
+        estado["envios"].remove(entrada)
+        if ahora - entrada["programado"] > COLA_VENCIMIENTO_HORAS * 3600:
+            logging.warning("Envío programado vencido hace más de %sh, se descarta: %s", COLA_VENCIMIENTO_HORAS, entrada)
+            _guardar(estado, archivo)
+            continue
+        _guardar(estado, archivo)
+
+        resultado = ejecutar(entrada)
+        if resultado == SIN_CUPO:
+            estado["envios"].append(entrada)
+            _guardar(estado, archivo)
+            sin_cupo = True
+            break
+        resultados.append((entrada, resultado))
+        if resultado is None:
+            continue
+        info["ultimo_envio"] = time.time()
+        info["fallos_seguidos"] = 0 if resultado else info.get("fallos_seguidos", 0) + 1
+        _guardar(estado, archivo)
+    return {"resultados": resultados, "fallos_seguidos": info.get("fallos_seguidos", 0), "sin_cupo": sin_cupo}
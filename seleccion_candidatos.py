@@ -0,0 +1,90 @@
+"""
+Selección vectorizada de candidatos a envío para los workers de prospección
+(worker.py y worker_almacenes.py).
+
+Antes cada worker recorría el CSV completo con df.iterrows() y un
+datetime.strptime por fila (dos veces por ciclo si además se buscaban leads
+nuevos). Acá se hace lo mismo con máscaras de pandas y un único
+pd.to_datetime sobre Fecha_Contacto, manteniendo exactamente el mismo
+resultado: una lista de {"idx": <índice del df>, "dia": <día de secuencia a
+enviar>}, mezclada y recortada al máximo de envíos por ciclo.
+"""
+import logging
+import random
+
+import pandas as pd
+
+FORMATO_FECHA_CONTACTO = "%d/%m/%Y %H:%M"
+# Mínimo entre un mensaje de la secuencia y el siguiente (25 horas).
+ESPERA_MINIMA_SEG = 90000
+
+
+def parsear_fecha_contacto(serie):
+    """
+    Parsea una columna Fecha_Contacto completa de una vez. Las celdas vacías o
+    con formato inválido quedan como NaT (equivalente al except del strptime
+    por fila que había antes).
+    """
+    return pd.to_datetime(
+        serie.fillna("").astype(str).str.strip(), format=FORMATO_FECHA_CONTACTO, errors="coerce"
+    )
+
+
+def seleccionar_candidatos(
+    df,
+    ahora,
+    estados_excluidos,
+    max_dia_secuencia,
+    limite,
+    resultados_excluidos=(),
+):
+    """
+    Devuelve la lista de candidatos [{"idx", "dia"}] a contactar en este ciclo:
+      - se omiten los leads ya contactados hoy y los que están en un estado
+        terminal (estados_excluidos) o con un Resultado ya clasificado
+        (resultados_excluidos, solo almacenes);
+      - un "Contactado" avanza al día siguiente si pasaron al menos 25 horas
+        desde Fecha_Contacto (si la fecha no se puede parsear, no se bloquea)
+        y aún no llegó a max_dia_secuencia;
+      - un "Nuevo" parte en el día 1.
+    La lista se mezcla y se recorta a `limite` envíos.
+    """
+    if df.empty:
+        return []
+
+    # Las fechas del CSV son naive (hora Chile); se compara contra un "ahora"
+    # naive para que un datetime con tzinfo no haga fallar la resta.
+    ahora = ahora.replace(tzinfo=None)
+    hoy_str = ahora.strftime("%d/%m/%Y")
+
+    estado = df["Estado"]
+    fecha_txt = df["Fecha_Contacto"].fillna("").astype(str)
+    dia_act = pd.to_numeric(df["Dia_Secuencia"], errors="coerce").fillna(0).astype(int)
+
+    habilitado = ~fecha_txt.str.contains(hoy_str, regex=False) & ~estado.isin(list(estados_excluidos))
+    if resultados_excluidos and "Resultado" in df.columns:
+        habilitado &= ~df["Resultado"].isin(list(resultados_excluidos))
+
+    contactado = estado == "Contactado"
+    ultima_fecha = parsear_fecha_contacto(df["Fecha_Contacto"])
+    reciente = (ahora - ultima_fecha).dt.total_seconds() < ESPERA_MINIMA_SEG
+
+    fechas_invalidas = habilitado & contactado & ultima_fecha.isna()
+    if fechas_invalidas.any():
+        ids = df.loc[fechas_invalidas, "Id"].tolist() if "Id" in df.columns else []
+        logging.warning(
+            "No se pudo parsear Fecha_Contacto en %s leads 'Contactado' (Ids: %s).",
+            int(fechas_invalidas.sum()), ids[:10],
+        )
+
+    sigue_secuencia = habilitado & contactado & ~reciente & (dia_act < max_dia_secuencia)
+    nuevo = habilitado & (estado == "Nuevo")
+
+    seleccion = sigue_secuencia | nuevo
+    dias = dia_act.where(~nuevo, 0) + 1
+    candidatos = [
+        {"idx": idx, "dia": int(dia)} for idx, dia in dias[seleccion].items()
+    ]
+
+    random.shuffle(candidatos)
+    return candidatos[:limite]
@@ -0,0 +1,129 @@
+"""
+Cache de respuestas de SerpAPI y modo replay (offline).
+
+Los workers (worker.py y worker_almacenes.py) usaban la respuesta cruda de
+SerpAPI una sola vez: si el proceso se caía después de la búsqueda, el
+reintento volvía a pagar la misma consulta, y cada corrida de desarrollo
+gastaba cupo de presupuesto_serpapi.json. Acá cada respuesta se guarda en
+DIR_CACHE_SERPAPI, en un archivo cuyo nombre es el hash de los parámetros de
+la búsqueda (engine, q, num, start, ...; nunca la api_key), y se reutiliza
+mientras tenga menos de SERPAPI_CACHE_TTL_HORAS.
+
+Con SERPAPI_REPLAY=1 los workers corren solo contra respuestas grabadas
+(sin importar el TTL) y nunca llaman a la API: una búsqueda sin grabación
+devuelve "sin_grabacion".
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+import requests
+
+SERPAPI_URL = "https://serpapi.com/search"
+DIR_CACHE_SERPAPI = os.getenv("SERPAPI_CACHE_DIR", "cache_serpapi")
+SERPAPI_CACHE_TTL_HORAS = float(os.getenv("SERPAPI_CACHE_TTL_HORAS", "72"))
+SERPAPI_REPLAY = os.getenv("SERPAPI_REPLAY", "").lower() in ("1", "true", "si", "sí")
+SERPAPI_TIMEOUT_SEG = 30
+
+_PARAMETROS_SECRETOS = ("api_key",)
+
+
+def _parametros_busqueda(params):
+    return {k: str(v) for k, v in sorted(params.items()) if k not in _PARAMETROS_SECRETOS}
+
+
+def clave_busqueda(params):
+    """Hash estable de la búsqueda: mismo engine/q/num/start => misma clave."""
+    canonico = json.dumps(_parametros_busqueda(params), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+def _ruta(clave):
+    return os.path.join(DIR_CACHE_SERPAPI, f"{clave}.json")
+
+
+def leer_cache(params):
+    """Respuesta grabada para `params`, o None si no hay o ya venció el TTL (salvo en replay)."""
+    ruta = _ruta(clave_busqueda(params))
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            entrada = json.load(f)
+    except Exception:
+        logging.exception("No se pudo leer %s, se ignora.", ruta)
+        return None
+    if not SERPAPI_REPLAY and time.time() - entrada.get("guardado", 0) > SERPAPI_CACHE_TTL_HORAS * 3600:
+        return None
+    return entrada.get("respuesta")
+
+
+def guardar_en_cache(params, respuesta):
+    """Graba la respuesta (vía archivo temporal + os.replace). Los errores de la API no se graban."""
+    if "error" in respuesta:
+        return
+    ruta = _ruta(clave_busqueda(params))
+    entrada = {"params": _parametros_busqueda(params), "guardado": time.time(), "respuesta": respuesta}
+    try:
+        os.makedirs(DIR_CACHE_SERPAPI, exist_ok=True)
+        with open(f"{ruta}.tmp", "w", encoding="utf-8") as f:
+            json.dump(entrada, f, ensure_ascii=False)
+        os.replace(f"{ruta}.tmp", ruta)
+    except Exception:
+        logging.exception("No se pudo escribir %s.", ruta)
+
+
+def podar_cache():
+    """Borra las respuestas vencidas (no en replay, donde se usan todas). Devuelve cuántas."""
+    if SERPAPI_REPLAY or not os.path.isdir(DIR_CACHE_SERPAPI):
+        return 0
+    limite = time.time() - SERPAPI_CACHE_TTL_HORAS * 3600
+    borradas = 0
+    for nombre in os.listdir(DIR_CACHE_SERPAPI):
+        if not nombre.endswith(".json"):
+            continue  # .tmp de una escritura en curso (búsquedas en paralelo)
+        ruta = os.path.join(DIR_CACHE_SERPAPI, nombre)
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                vencida = json.load(f).get("guardado", 0) < limite
+        except Exception:
+            vencida = True
+        if vencida:
+            try:
+                os.remove(ruta)
+                borradas += 1
+            except FileNotFoundError:
+                pass  # Ya la borró otra búsqueda en paralelo.
+    return borradas
+
+
+def buscar(params, reservar=None):
+    """
+    Devuelve (respuesta, origen) para la búsqueda `params`:
+      - (respuesta, "cache"): había una respuesta grabada vigente; no se llama a
+        la API ni se consume presupuesto;
+      - (None, "sin_grabacion"): modo replay y la búsqueda no está grabada;
+      - (None, "presupuesto_agotado"): `reservar()` (opcional, ej.
+        _reservar_busqueda_serp) devolvió False;
+      - (respuesta, "api"): se consultó SerpAPI y la respuesta quedó grabada
+        (de paso se borran las respuestas vencidas).
+    Los errores de red se propagan como excepción, igual que requests.get.
+    """
+    respuesta = leer_cache(params)
+    if respuesta is not None:
+        print("💾 SerpAPI: respuesta desde cache (no consume cupo).")
+        return respuesta, "cache"
+    if SERPAPI_REPLAY:
+        print("📼 SerpAPI en modo replay: búsqueda sin grabación, se omite.")
+        return None, "sin_grabacion"
+    if reservar is not None and not reservar():
+        return None, "presupuesto_agotado"
+
+    podar_cache()
+    response = requests.get(SERPAPI_URL, params=params, timeout=SERPAPI_TIMEOUT_SEG)
+    print(f"🔎 SerpAPI status: {response.status_code}")
+    respuesta = response.json()
+    guardar_en_cache(params, respuesta)
+    return respuesta, "api"
@@ -0,0 +1,339 @@
+"""
+Sincronización del dashboard (app.py) con el repo de GitHub vía la Git Data
+API: varios archivos en UN solo commit.
+
+Antes push_to_github hacía, por archivo, un GET del SHA y un PUT del
+contenido completo a /contents, cada uno con una conexión nueva y sin
+reintento si el SHA había cambiado entremedio (409, típico cuando un worker
+acababa de pushear). Ahora SincronizadorGitHub.subir:
+  1. lee la punta de la rama (GET condicional con ETag: si no cambió, GitHub
+     responde 304 y no cuenta para el rate limit) y el árbol de ese commit
+     (los commits son inmutables: se cachean por SHA);
+  2. sube un blob por archivo (los blobs se direccionan por contenido: el SHA
+     se calcula local y dos archivos iguales se suben una vez). Lo subido se
+     recuerda solo durante esa llamada: un blob que no quedó en ningún commit
+     GitHub lo puede borrar, y reusarlo en otra llamada rompería el árbol;
+  3. arma un árbol sobre el del commit base y un commit con todos los
+     archivos (None = borrar el archivo);
+  4. mueve la rama sin forzar. Si otro commit llegó entremedio (422 "not a
+     fast forward" / 409), vuelve a 1 y rearma árbol y commit sobre la punta
+     nueva — un rebase: lo que subimos pisa solo nuestros archivos — hasta
+     GITHUB_SYNC_MAX_REINTENTOS veces.
+Todo va por una requests.Session con pool de conexiones, como evo_client.
+
+StubGitHub implementa en memoria los endpoints que se usan (con ETag y
+conflictos simulables) para probar el dashboard sin tocar el repo real:
+    python sincronizador_github.py stub [puerto]
+    # y en .streamlit/secrets.toml: GITHUB_API_URL = "http://127.0.0.1:8765"
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_RAMA = os.getenv("GITHUB_RAMA", "main")
+GITHUB_SYNC_MAX_REINTENTOS = int(os.getenv("GITHUB_SYNC_MAX_REINTENTOS", "3"))
+GITHUB_TIMEOUT_SEG = float(os.getenv("GITHUB_TIMEOUT_SEG", "20"))
+
+
+def _espera_reintento(intento, retry_after=None):
+    """Backoff exponencial con jitter; respeta Retry-After si GitHub lo manda."""
+    try:
+        if retry_after is not None:
+            return min(60.0, float(retry_after))
+    except ValueError:
+        pass
+    return min(30.0, 1.0 * (2 ** intento)) + random.uniform(0, 1)
+
+
+def sha_blob(contenido):
+    """SHA con el que git guarda `contenido` (bytes) como blob."""
+    return hashlib.sha1(b"blob %d\0" % len(contenido) + contenido).hexdigest()
+
+
+def _a_bytes(contenido):
+    return contenido.encode("utf-8") if isinstance(contenido, str) else contenido
+
+
+class ConflictoRama(Exception):
+    """La rama avanzó entre que se leyó y se intentó mover (hay que rearmar el commit)."""
+
+
+class SincronizadorGitHub:
+    """Cliente de la Git Data API para un repo/rama. Seguro entre threads (un commit a la vez)."""
+
+    def __init__(self, repo, token, rama=GITHUB_RAMA, api_url=GITHUB_API_URL,
+                 max_reintentos=GITHUB_SYNC_MAX_REINTENTOS, timeout=GITHUB_TIMEOUT_SEG):
+        self.repo = repo
+        self.rama = rama
+        self.api_url = (api_url or GITHUB_API_URL).rstrip("/")
+        self.max_reintentos = max_reintentos
+        self.timeout = timeout
+        self.sesion = requests.Session()
+        self.sesion.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.sesion.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.sesion.headers.update({
+            "Authorization": f"token {token}",
+            "Accept": "application/vnd.github.v3+json",
+        })
+        self._etag_rama = None  # (etag, sha de la punta)
+        self._arboles = {}  # sha de commit -> sha de su árbol
+        self._lock = threading.Lock()
+
+    def _url(self, ruta):
+        return f"{self.api_url}/repos/{self.repo}/git/{ruta}"
+
+    def _solicitar(self, metodo, ruta, json=None, headers=None, esperados=(200, 201)):
+        """Request con reintentos ante errores de red, 429 y 5xx (todas las llamadas son idempotentes)."""
+        for intento in range(self.max_reintentos + 1):
+            try:
+                res = self.sesion.request(metodo, self._url(ruta), json=json, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                if intento >= self.max_reintentos:
+                    raise
+                logging.warning("GitHub %s %s falló (%s), reintento %s.", metodo, ruta, e, intento + 1)
+                time.sleep(_espera_reintento(intento))
+                continue
+            if res.status_code in esperados:
+                return res
+            if (res.status_code == 429 or res.status_code >= 500) and intento < self.max_reintentos:
+                time.sleep(_espera_reintento(intento, res.headers.get("Retry-After")))
+                continue
+            if res.status_code == 409 or (res.status_code == 422 and "fast forward" in res.text.lower()):
+                raise ConflictoRama(res.text[:300])
+            res.raise_for_status()
+            return res
+
+    def punta_rama(self):
+        """SHA del último commit de la rama (GET condicional: 304 si no cambió desde la última lectura)."""
+        headers = {"If-None-Match": self._etag_rama[0]} if self._etag_rama else None
+        res = self._solicitar("GET", f"ref/heads/{self.rama}", headers=headers, esperados=(200, 304))
+        if res.status_code == 304:
+            return self._etag_rama[1]
+        sha = res.json()["object"]["sha"]
+        etag = res.headers.get("ETag")
+        self._etag_rama = (etag, sha) if etag else None
+        return sha
+
+    def _arbol_de(self, sha_commit):
+        if sha_commit not in self._arboles:
+            self._arboles[sha_commit] = self._solicitar("GET", f"commits/{sha_commit}").json()["tree"]["sha"]
+        return self._arboles[sha_commit]
+
+    def _subir_blob(self, contenido, subidos):
+        sha = sha_blob(contenido)
+        if sha not in subidos:
+            res = self._solicitar("POST", "blobs", json={
+                "content": base64.b64encode(contenido).decode("ascii"),
+                "encoding": "base64",
+            })
+            sha = res.json()["sha"]
+            subidos.add(sha)
+        return sha
+
+    def _commit_sobre(self, base, entradas, mensaje):
+        arbol = self._solicitar("POST", "trees", json={"base_tree": self._arbol_de(base), "tree": entradas}).json()["sha"]
+        commit = self._solicitar("POST", "commits", json={"message": mensaje, "tree": arbol, "parents": [base]}).json()["sha"]
+        self._arboles[commit] = arbol
+        self._solicitar("PATCH", f"refs/heads/{self.rama}", json={"sha": commit, "force": False})
+        self._etag_rama = None
+        return commit
+
+    def subir(self, archivos, mensaje):
+        """
+        Commitea `archivos` ({ruta en el repo: contenido str/bytes, o None
+        para borrarlo}) en un solo commit sobre la rama. Devuelve
+        (ok, detalle): el SHA del commit, o el motivo del error.
+        """
+        with self._lock:
+            try:
+                entradas = []
+                subidos = set()
+                for ruta, contenido in archivos.items():
+                    sha = None if contenido is None else self._subir_blob(_a_bytes(contenido), subidos)
+                    entradas.append({"path": ruta, "mode": "100644", "type": "blob", "sha": sha})
+                for intento in range(self.max_reintentos + 1):
+                    base = self.punta_rama()
+                    try:
+                        return True, self._commit_sobre(base, entradas, mensaje)
+                    except ConflictoRama as e:
+                        # Otro commit (típicamente de un worker) llegó entremedio:
+                        # se rearma sobre la punta nueva.
+                        logging.warning("La rama %s avanzó (%s), reintento %s.", self.rama, e, intento + 1)
+                        self._etag_rama = None
+                return False, f"La rama {self.rama} siguió cambiando tras {self.max_reintentos + 1} intentos."
+            except requests.HTTPError as e:
+                return False, f"GitHub respondió HTTP {e.response.status_code}: {e.response.text[:400]}"
+            except requests.RequestException as e:
+                return False, f"No se pudo conectar con GitHub: {e}"
+
+    def cerrar(self):
+        self.sesion.close()
+
+
+# --- STUB LOCAL ---
+class StubGitHub:
+    """
+    Servidor en memoria con los endpoints de la Git Data API que usa
+    SincronizadorGitHub (ref, commits, blobs, trees), con ETag en la ref.
+    `commit_externo` simula un push de otro proceso (ej. un worker) y
+    `conflictos_forzados` hace que los próximos N PATCH de la ref fallen con
+    `estado_conflicto` (422 "not a fast forward", o 409).
+    """
+
+    def __init__(self, repo="local/stub", rama="main", archivos=None, puerto=0):
+        self.repo = repo
+        self.rama = rama
+        self.objetos = {}
+        self.refs = {}
+        self.solicitudes = []
+        self.conflictos_forzados = 0
+        self.estado_conflicto = 422
+        self._lock = threading.Lock()
+        self.refs[rama] = self._guardar({"tipo": "commit", "tree": self._arbol({}), "parents": [], "message": "inicial"})
+        if archivos:
+            self.commit_externo(archivos)
+        stub = self
+
+        class _Manejador(BaseHTTPRequestHandler):
+            # HTTP/1.1 keep-alive, como la API real (si no, cada request abre conexión).
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, estado, cuerpo=None, headers=None):
+                datos = json.dumps(cuerpo).encode() if cuerpo is not None else b""
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def _atender(self, metodo):
+                largo = int(self.headers.get("Content-Length") or 0)
+                cuerpo = json.loads(self.rfile.read(largo)) if largo else None
+                with stub._lock:
+                    stub.solicitudes.append((metodo, self.path))
+                    self._responder(*stub._resolver(metodo, self.path, cuerpo, self.headers))
+
+            def do_GET(self):
+                self._atender("GET")
+
+            def do_POST(self):
+                self._atender("POST")
+
+            def do_PATCH(self):
+                self._atender("PATCH")
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _Manejador)
+        self.url = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+
+    def _guardar(self, objeto):
+        sha = hashlib.sha1(json.dumps(objeto, sort_keys=True).encode()).hexdigest()
+        self.objetos[sha] = objeto
+        return sha
+
+    def _arbol(self, archivos):
+        return self._guardar({"tipo": "tree", "archivos": dict(sorted(archivos.items()))})
+
+    def _guardar_blob(self, contenido):
+        sha = sha_blob(contenido)
+        self.objetos[sha] = {"tipo": "blob", "contenido": contenido}
+        return sha
+
+    def archivos(self):
+        """{ruta: bytes} en la punta de la rama."""
+        arbol = self.objetos[self.objetos[self.refs[self.rama]]["tree"]]["archivos"]
+        return {ruta: self.objetos[sha]["contenido"] for ruta, sha in arbol.items()}
+
+    def commit_externo(self, archivos, mensaje="externo"):
+        with self._lock:
+            actuales = dict(self.objetos[self.objetos[self.refs[self.rama]]["tree"]]["archivos"])
+            for ruta, contenido in archivos.items():
+                if contenido is None:
+                    actuales.pop(ruta, None)
+                else:
+                    actuales[ruta] = self._guardar_blob(_a_bytes(contenido))
+            self.refs[self.rama] = self._guardar(
+                {"tipo": "commit", "tree": self._arbol(actuales), "parents": [self.refs[self.rama]], "message": mensaje}
+            )
+
+    def _resolver(self, metodo, ruta, cuerpo, headers):
+        prefijo = f"/repos/{self.repo}/git/"
+        if not ruta.startswith(prefijo):
+            return 404, {"message": "Not Found"}
+        ruta = ruta[len(prefijo):]
+        if metodo == "GET" and ruta == f"ref/heads/{self.rama}":
+            sha = self.refs[self.rama]
+            etag = f'"{sha}"'
+            if headers.get("If-None-Match") == etag:
+                return 304, None, {"ETag": etag}
+            return 200, {"object": {"sha": sha, "type": "commit"}}, {"ETag": etag}
+        if metodo == "GET" and ruta.startswith("commits/"):
+            objeto = self.objetos.get(ruta.split("/", 1)[1])
+            if not objeto or objeto["tipo"] != "commit":
+                return 404, {"message": "Not Found"}
+            return 200, {"sha": ruta.split("/", 1)[1], "tree": {"sha": objeto["tree"]}}
+        if metodo == "POST" and ruta == "blobs":
+            return 201, {"sha": self._guardar_blob(base64.b64decode(cuerpo["content"]))}
+        if metodo == "POST" and ruta == "trees":
+            base = self.objetos.get(cuerpo.get("base_tree"), {}).get("archivos", {})
+            archivos = dict(base)
+            for entrada in cuerpo["tree"]:
+                if entrada["sha"] is None:
+                    archivos.pop(entrada["path"], None)
+                elif entrada["sha"] not in self.objetos:
+                    return 422, {"message": f"Invalid sha {entrada['sha']}"}
+                else:
+                    archivos[entrada["path"]] = entrada["sha"]
+            return 201, {"sha": self._arbol(archivos)}
+        if metodo == "POST" and ruta == "commits":
+            sha = self._guardar({"tipo": "commit", "tree": cuerpo["tree"], "parents": cuerpo["parents"],
+                                 "message": cuerpo["message"]})
+            return 201, {"sha": sha}
+        if metodo == "PATCH" and ruta == f"refs/heads/{self.rama}":
+            nuevo = self.objetos.get(cuerpo["sha"])
+            if self.conflictos_forzados > 0:
+                self.conflictos_forzados -= 1
+                if self.estado_conflicto == 409:
+                    return 409, {"message": "Reference update failed"}
+                return 422, {"message": "Update is not a fast forward"}
+            if not nuevo or self.refs[self.rama] not in nuevo["parents"]:
+                return 422, {"message": "Update is not a fast forward"}
+            self.refs[self.rama] = cuerpo["sha"]
+            return 200, {"object": {"sha": cuerpo["sha"]}}
+        return 404, {"message": "Not Found"}
+
+    def iniciar(self):
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        return self
+
+    def detener(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "stub":
+        print("Uso: python sincronizador_github.py stub [puerto]")
+        sys.exit(1)
+    stub = StubGitHub(puerto=int(sys.argv[2]) if len(sys.argv) > 2 else 8765)
+    print(f"🧪 Stub de GitHub en {stub.url} (repo {stub.repo}, rama {stub.rama}). Ctrl+C para salir.")
+    try:
+        stub.servidor.serve_forever()
+    except KeyboardInterrupt:
+        stub.detener()
@@ -0,0 +1,123 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import agent_service
+
+
+@pytest.fixture
+def csvs(tmp_path, monkeypatch):
+    archivos = {"clinicas": str(tmp_path / "clinicas.csv"), "almacenes": str(tmp_path / "almacenes.csv")}
+    monkeypatch.setattr(agent_service, "CSVS_POR_LINEA", archivos)
+    monkeypatch.setitem(agent_service._indice_telefonos, "firma", None)
+    return archivos
+
+
+def _escribir(archivo, filas):
+    pd.DataFrame(filas).to_csv(archivo, index=False)
+
+
+def test_indice_telefonos_precedencia_y_contexto(csvs):
+    _escribir(csvs["clinicas"], [
+        {"Id": 1, "Evento": "Clínica Sol", "Ubicacion": "Ñuñoa", "Estado": "Nuevo", "Telefono": "+56 9 1111 1111", "Dia_Secuencia": 0},
+        {"Id": 2, "Evento": "Repetida", "Ubicacion": "Maipú", "Estado": "Nuevo", "Telefono": "911111111", "Dia_Secuencia": 3},
+        {"Id": 3, "Evento": "Sin teléfono", "Ubicacion": "", "Estado": "Nuevo", "Telefono": "", "Dia_Secuencia": ""},
+    ])
+    _escribir(csvs["almacenes"], [
+        {"Id": 1, "Evento": "Almacén Tito", "Ubicacion": "Maipú", "Estado": "Contactado", "Telefono": "56911111111", "Dia_Secuencia": 1},
+        {"Id": 2, "Evento": "Almacén Rosa", "Ubicacion": "La Florida", "Estado": "Contactado", "Telefono": "0922222222", "Dia_Secuencia": 2},
+    ])
+
+    leads = agent_service._resolver_leads(["56911111111", "56922222222", "56933333333"])
+
+    # Teléfono repetido: gana la primera línea y, dentro de ella, la primera fila.
+    assert leads["56911111111"] == (
+        "clinicas", csvs["clinicas"],
+        {"Evento": "Clínica Sol", "Ubicacion": "Ñuñoa", "Estado": "Nuevo", "Dia_Secuencia": 0},
+    )
+    assert leads["56922222222"][0] == "almacenes"
+    assert leads["56922222222"][2]["Dia_Secuencia"] == 2
+    assert leads["56933333333"] == (None, None, {})
+
+
+def test_indice_telefonos_se_reconstruye_si_cambia_el_csv(csvs):
+    _escribir(csvs["clinicas"], [{"Id": 1, "Evento": "A", "Ubicacion": "", "Estado": "Nuevo", "Telefono": "911111111", "Dia_Secuencia": 0}])
+    assert agent_service._buscar_lead_por_telefono("56922222222")[0] is None
+
+    _escribir(csvs["clinicas"], [
+        {"Id": 1, "Evento": "A", "Ubicacion": "", "Estado": "Nuevo", "Telefono": "911111111", "Dia_Secuencia": 0},
+        {"Id": 2, "Evento": "B", "Ubicacion": "", "Estado": "Nuevo", "Telefono": "922222222", "Dia_Secuencia": 0},
+    ])
+    assert agent_service._buscar_lead_por_telefono("56922222222")[2]["Evento"] == "B"
+
+
+def test_borrador_de_rafaga_no_repite_los_mensajes_en_el_historial(tmp_path, monkeypatch, csvs):
+    monkeypatch.setattr(agent_service.store, "DB_PATH", str(tmp_path / "agent.db"))
+    agent_service.store.inicializar_db()
+    tel = "56911111111"
+    primero = agent_service.store.guardar_mensaje(tel, "in", "hola, ¿atienden sábados?")
+    respuesta, _, _ = agent_service.store.crear_borrador(tel, primero, "¡Hola! Sí, hasta las 14:00.")
+    agent_service.store.marcar_borrador(respuesta, "sent")
+    agent_service.store.guardar_mensaje(tel, "out", "¡Hola! Sí, hasta las 14:00.")
+    rafaga = [agent_service.store.guardar_mensaje(tel, "in", t) for t in ("perfecto", "¿y precios?", "gracias")]
+
+    recibido = {}
+
+    async def generar(historial, contexto_lead, mensaje_entrante):
+        recibido.update(historial=[m["texto"] for m in historial], mensaje=mensaje_entrante)
+        return "borrador"
+
+    monkeypatch.setattr(agent_service, "generar_borrador_async", generar)
+    asyncio.run(agent_service._generar_y_guardar_borrador(tel, rafaga[-1], "perfecto\n¿y precios?\ngracias", rafaga[0]))
+
+    assert recibido["historial"] == ["hola, ¿atienden sábados?", "¡Hola! Sí, hasta las 14:00."]
+    assert recibido["mensaje"] == "perfecto\n¿y precios?\ngracias"
+    pendientes = agent_service.store.listar_borradores_pendientes()
+    assert [b["mensaje_entrante"] for b in pendientes] == ["perfecto\n¿y precios?\ngracias"]
+
+
+def test_envio_fallido_del_operador_devuelve_el_cupo(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent_service.store, "DB_PATH", str(tmp_path / "agent.db"))
+    agent_service.store.inicializar_db()
+    gobernador = agent_service.GobernadorEnvios(str(tmp_path / "gobernador.json"), por_hora=2, por_dia=5)
+    monkeypatch.setattr(agent_service, "gobernador", gobernador)
+    monkeypatch.setattr(agent_service, "AGENT_SERVICE_TOKEN", None)
+    tel = "56911111111"
+    draft_id, _, _ = agent_service.store.crear_borrador(tel, agent_service.store.guardar_mensaje(tel, "in", "hola"), "¡Hola!")
+
+    async def enviar_texto(telefono, texto):
+        return False
+
+    monkeypatch.setattr(agent_service.evo, "enviar_texto", enviar_texto)
+    with pytest.raises(agent_service.HTTPException) as error:
+        asyncio.run(agent_service.approve_draft(draft_id, agent_service.DecisionBorrador(), None))
+    assert error.value.status_code == 502
+    assert gobernador.disponibles()["hora"][agent_service.PRIORIDAD_OPERADOR] == 2
+    assert gobernador.disponibles()["dia"][agent_service.PRIORIDAD_OPERADOR] == 5
+
+
+def test_lifespan_arranca_y_detiene_los_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent_service.store, "DB_PATH", str(tmp_path / "agent.db"))
+    monkeypatch.setattr(agent_service, "AGENT_SERVICE_TOKEN", None)
+    cerrados = []
+
+    async def sin_chequeo():
+        await asyncio.sleep(3600)
+
+    async def cerrar():
+        cerrados.append("evo")
+
+    monkeypatch.setattr(agent_service, "_chequear_salud", sin_chequeo)
+    monkeypatch.setattr(agent_service.evo, "cerrar", cerrar)
+    tareas = {}
+
+    async def ciclo_de_vida():
+        async with agent_service._lifespan(agent_service.app):
+            assert agent_service.metrics(None)["cola"]["profundidad"] == 0
+            tareas["vivas"] = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        assert all(t.done() for t in tareas["vivas"])
+
+    asyncio.run(ciclo_de_vida())
+    assert len(tareas["vivas"]) == agent_service.BORRADOR_WORKERS + 2
+    assert cerrados == ["evo"]
@@ -0,0 +1,43 @@
+import pytest
+
+import conversation_store as store
+
+
+@pytest.fixture(autouse=True)
+def base(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "DB_PATH", str(tmp_path / "agent.db"))
+    store.inicializar_db()
+
+
+def _pendientes(telefono):
+    return [b for b in store.listar_borradores_pendientes() if b["telefono_normalizado"] == telefono]
+
+
+def test_borrador_nuevo_reemplaza_a_los_pendientes_anteriores():
+    tel = "56911111111"
+    m1 = store.guardar_mensaje(tel, "in", "hola")
+    m2 = store.guardar_mensaje(tel, "in", "¿precios?")
+
+    _, vigente, reemplazados = store.crear_borrador(tel, m1, "borrador 1")
+    assert (vigente, reemplazados) == (True, 0)
+    draft_id, vigente, reemplazados = store.crear_borrador(tel, m2, "borrador 2")
+    assert (vigente, reemplazados) == (True, 1)
+    assert [b["id"] for b in _pendientes(tel)] == [draft_id]
+
+
+@pytest.mark.parametrize("estado_posterior", ["pending", "approved", "sent"])
+def test_borrador_que_termina_tarde_no_queda_pendiente(estado_posterior):
+    # Dos workers: el de la ráfaga nueva guarda primero; el de la anterior llega después.
+    tel = "56911111111"
+    viejo = store.guardar_mensaje(tel, "in", "hola")
+    nuevo = store.guardar_mensaje(tel, "in", "¿siguen ahí?")
+    nuevo_id, _, _ = store.crear_borrador(tel, nuevo, "borrador nuevo")
+    if estado_posterior != "pending":
+        store.marcar_borrador(nuevo_id, estado_posterior)
+
+    viejo_id, vigente, reemplazados = store.crear_borrador(tel, viejo, "borrador viejo")
+
+    assert (vigente, reemplazados) == (False, 0)
+    assert store.obtener_borrador(viejo_id)["estado"] == "superseded"
+    assert store.obtener_borrador(nuevo_id)["estado"] == estado_posterior
+    assert [b["id"] for b in _pendientes(tel)] == ([nuevo_id] if estado_posterior == "pending" else [])
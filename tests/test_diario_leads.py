@@ -0,0 +1,89 @@
+import pandas as pd
+
+import diario_leads
+
+
+def _base(ids):
+    return pd.DataFrame({
+        "Id": ids,
+        "Evento": [f"Lead {i}" for i in ids],
+        "Telefono": [f"9{i:08d}" for i in ids],
+        "Estado": ["Nuevo"] * len(ids),
+    })
+
+
+def _alta(original, evento, telefono):
+    nueva = pd.DataFrame({"Id": [pd.NA], "Evento": [evento], "Telefono": [telefono], "Estado": ["Nuevo"]})
+    return diario_leads.calcular_cambios(original, pd.concat([original, nueva], ignore_index=True))
+
+
+def test_alta_y_cambio_posterior_se_resuelven_por_clave():
+    # El dashboard vio la base con Ids 1-3; el worker aplica sobre una base que
+    # ya tiene el 4 (otro lead): el alta queda con Id distinto en cada lado.
+    dashboard = _base([1, 2, 3])
+    worker = _base([1, 2, 3, 4])
+    altas = _alta(dashboard, "Clinica Nueva", "912345678")
+    assert [c["op"] for c in altas] == ["alta"] and altas[0]["clave"]
+
+    visto = diario_leads.aplicar_cambios(dashboard, altas)
+    fila = visto[visto["Evento"] == "Clinica Nueva"].iloc[0]
+    assert fila["Id"] == 4 and fila[diario_leads.COLUMNA_CLAVE_ALTA] == altas[0]["clave"]
+
+    editado = visto.copy()
+    editado.loc[editado["Evento"] == "Clinica Nueva", "Estado"] = "Contactado"
+    cambios = diario_leads.calcular_cambios(visto, editado)
+    assert cambios == [{"op": "cambio", "Id": 4, "cambios": {"Estado": "Contactado"}, "clave": altas[0]["clave"]}]
+
+    for base in (dashboard, worker):
+        # Por separado y en el mismo llamado (dos archivos pendientes aplicados juntos).
+        for resultado in (
+            diario_leads.aplicar_cambios(diario_leads.aplicar_cambios(base, altas), cambios),
+            diario_leads.aplicar_cambios(base, altas + cambios),
+        ):
+            estados = resultado.set_index("Evento")["Estado"]
+            assert estados["Clinica Nueva"] == "Contactado"
+            assert (estados.drop("Clinica Nueva") == "Nuevo").all()
+            assert resultado["Id"].is_unique
+
+
+def test_baja_de_un_alta_por_clave():
+    base = _base([1, 2])
+    altas = _alta(base, "Spa Centro", "987654321")
+    baja = [{"op": "baja", "Id": 99, "clave": altas[0]["clave"]}]
+    for resultado in (
+        diario_leads.aplicar_cambios(diario_leads.aplicar_cambios(_base([1, 2, 3]), altas), baja),
+        diario_leads.aplicar_cambios(_base([1, 2, 3]), altas + baja),
+    ):
+        assert list(resultado["Evento"]) == ["Lead 1", "Lead 2", "Lead 3"]
+
+
+def test_reaplicar_un_alta_no_la_duplica():
+    base = _base([1, 2])
+    altas = _alta(base, "Almacen Don Pepe", "955555555")
+    una_vez = diario_leads.aplicar_cambios(base, altas)
+    dos_veces = diario_leads.aplicar_cambios(una_vez, altas)
+    pd.testing.assert_frame_equal(una_vez, dos_veces)
+    # Las filas que ya estaban no quedan con "nan" en la columna de la clave.
+    assert list(una_vez[diario_leads.COLUMNA_CLAVE_ALTA])[:2] == ["", ""]
+
+
+def test_armar_cambios_pendientes_no_escribe_en_disco(tmp_path, monkeypatch):
+    monkeypatch.setattr(diario_leads, "DIRECTORIO_CAMBIOS", str(tmp_path / "cambios_pendientes"))
+    ruta, contenido = diario_leads.armar_cambios_pendientes("leads.csv", [{"op": "baja", "Id": 1}])
+    assert ruta.startswith(str(tmp_path / "cambios_pendientes" / "leads.csv."))
+    assert '"baja"' in contenido
+    assert not (tmp_path / "cambios_pendientes").exists()
+
+
+def test_volver_a_guardar_sobre_la_base_con_lo_subido_no_repite_altas():
+    # Lo que hace el dashboard después de subir: la base que se muestra (y
+    # contra la que se diferencia el próximo guardado) ya trae el alta.
+    base = _base([1, 2])
+    altas = _alta(base, "Clinica Nueva", "912345678")
+    mostrada = diario_leads.aplicar_cambios(base, altas)
+    editada = mostrada.copy()
+    editada.loc[editada["Evento"] == "Lead 1", "Estado"] = "Contactado"
+    cambios = diario_leads.calcular_cambios(mostrada, editada)
+    assert cambios == [{"op": "cambio", "Id": 1, "cambios": {"Estado": "Contactado"}}]
+    resultado = diario_leads.aplicar_cambios(base, altas + cambios)
+    assert list(resultado["Evento"]) == ["Lead 1", "Lead 2", "Clinica Nueva"]
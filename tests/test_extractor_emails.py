@@ -0,0 +1,146 @@
+import random
+import re
+
+import pytest
+import requests
+
+import extractor_emails
+from extractor_emails import _SOLAPE, _EscanerEmails
+
+RELLENO = b"<p>Lorem ipsum dolor sit amet, clinica estetica providencia.</p>\n" * 20
+
+
+def _escanear(pagina, tamano_chunk):
+    escaner = _EscanerEmails()
+    for i in range(0, len(pagina), tamano_chunk):
+        if escaner.alimentar(pagina[i:i + tamano_chunk]):
+            return escaner.resultado()
+    escaner.alimentar(b"", final=True)
+    return escaner.resultado()
+
+
+def _escanear_partido_en(pagina, corte):
+    escaner = _EscanerEmails()
+    if not escaner.alimentar(pagina[:corte]) and not escaner.alimentar(pagina[corte:]):
+        escaner.alimentar(b"", final=True)
+    return escaner.resultado()
+
+
+def _extraer_emails_de_html(html):
+    """El extractor de antes (worker.py), como referencia."""
+    emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', html)
+    filtrados = [e for e in emails if not e.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg'))]
+    if not filtrados:
+        return ""
+    prioritarios = [e for e in filtrados if any(p in e.lower() for p in ['contacto', 'info', 'ventas'])]
+    return (prioritarios[0] if prioritarios else filtrados[0]).lower()
+
+
+def test_email_partido_entre_chunks():
+    # Con un subdominio, un corte a mitad del dominio también es un email
+    # válido ("contacto@centro.clinicasol"): no debe tomarse el pedazo.
+    email = b"contacto@centro.clinicasol.cl"
+    pagina = RELLENO + b"<footer>Escribanos: " + email + b"</footer>" + RELLENO
+    inicio = pagina.index(email)
+    for corte in range(inicio - 3, inicio + len(email) + 3):
+        assert _escanear_partido_en(pagina, corte) == "contacto@centro.clinicasol.cl", corte
+
+
+def test_mailto_codificado_partido_entre_chunks():
+    href = b'<a href="mailto:ventas%40spa.depilacion.cl?subject=Hola">Escribenos</a>'
+    pagina = RELLENO + href + RELLENO
+    inicio = pagina.index(href)
+    for corte in range(inicio, inicio + len(href)):
+        assert _escanear_partido_en(pagina, corte) == "ventas@spa.depilacion.cl", corte
+
+
+@pytest.mark.parametrize("distancia_al_corte", range(_SOLAPE - 40, _SOLAPE + 40, 3))
+def test_solape_no_parte_la_parte_local(distancia_al_corte):
+    # El primer chunk termina `distancia_al_corte` bytes después del inicio del
+    # email: el punto de solape cae antes, dentro o después de la parte local.
+    # Ningún email es prioritario, así que gana el primero en aparecer.
+    primero = b"dr.perez.gonzalez@gmail.com"
+    pagina = RELLENO + b" " + primero + b" " + b"x" * 2 * _SOLAPE + b" recepcion@centro.cl" + RELLENO
+    corte = pagina.index(primero) + distancia_al_corte
+    assert _escanear_partido_en(pagina, corte) == "dr.perez.gonzalez@gmail.com"
+
+
+@pytest.mark.parametrize("tamano_chunk", [1, 7, 64, 4096])
+def test_mismo_resultado_que_el_extractor_anterior(tamano_chunk):
+    # Semilla fija: las partes locales que arman las piezas quedan por debajo
+    # de _MAX_PARTE_LOCAL, donde el escáner corta a propósito.
+    rng = random.Random(tamano_chunk)
+    piezas = [
+        b"contacto@clinica.cl", b"info@spa.cl", b"dr.perez@gmail.com", b"logo@2x.png",
+        b"recepcion@centro.cl", b"a@b", b"@@", b"foo.bar@", b"x" * 40, b" ", b"<br>", b"\n",
+    ]
+    for _ in range(30):
+        pagina = b"".join(rng.choice(piezas) for _ in range(rng.randint(0, 60)))
+        assert _escanear(pagina, tamano_chunk) == _extraer_emails_de_html(pagina.decode("ascii")), pagina
+
+
+class _Respuesta:
+    def __init__(self, estado, cuerpo=b""):
+        self.status_code = estado
+        self.headers = {"Content-Type": "text/html"}
+        self._cuerpo = cuerpo
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self._cuerpo), chunk_size):
+            yield self._cuerpo[i:i + chunk_size]
+
+
+class _Sesion:
+    """Responde por URL: una _Respuesta, o una excepción que se lanza."""
+
+    def __init__(self, respuestas):
+        self.respuestas = respuestas
+
+    def get(self, url, **kwargs):
+        respuesta = self.respuestas.get(url, _Respuesta(404))
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+
+@pytest.fixture
+def cache_emails(tmp_path, monkeypatch):
+    monkeypatch.setattr(extractor_emails, "ARCHIVO_CACHE_EMAILS", str(tmp_path / "cache_emails.json"))
+
+    def usar(respuestas):
+        monkeypatch.setattr(extractor_emails, "_session", lambda: _Sesion(respuestas))
+
+    return usar
+
+
+@pytest.mark.parametrize("falla", [
+    requests.ConnectTimeout("timeout"),
+    requests.ConnectionError("connection refused"),
+    _Respuesta(503),
+])
+def test_sitio_caido_no_queda_en_el_cache_negativo(cache_emails, falla):
+    cache_emails({"https://clinica.cl": falla})
+    assert extractor_emails.buscar_email_en_web("https://clinica.cl") == ""
+    assert "clinica.cl" not in extractor_emails._cargar_cache()
+
+    # En el ciclo siguiente el sitio ya responde: se rastrea de nuevo.
+    cache_emails({"https://clinica.cl": _Respuesta(200, RELLENO + b"contacto@clinica.cl")})
+    assert extractor_emails.buscar_email_en_web("https://clinica.cl") == "contacto@clinica.cl"
+
+
+def test_pagina_de_contacto_caida_tampoco_es_concluyente(cache_emails):
+    cache_emails({"https://clinica.cl": _Respuesta(200, RELLENO), "https://clinica.cl/contacto": requests.ReadTimeout("lento")})
+    assert extractor_emails.buscar_email_en_web("https://clinica.cl") == ""
+    assert "clinica.cl" not in extractor_emails._cargar_cache()
+
+
+def test_sitio_que_responde_sin_email_se_cachea(cache_emails):
+    cache_emails({"https://clinica.cl": _Respuesta(200, RELLENO)})
+    assert extractor_emails.buscar_email_en_web("https://clinica.cl") == ""
+    assert extractor_emails._cargar_cache()["clinica.cl"]["email"] == ""
@@ -0,0 +1,16 @@
+import gemini_client
+
+
+def test_rafaga_cuenta_dentro_del_limite_por_minuto(monkeypatch):
+    monkeypatch.setattr(gemini_client.time, "monotonic", lambda: 1000.0)
+    limite = gemini_client._limite_por_minuto(15, 3)
+    # Todas llegan juntas con el balde lleno: cada una sale después de su espera.
+    salidas = [limite._reservar(1) for _ in range(40)]
+    assert sum(1 for espera in salidas if espera < 60) <= 15
+    assert sum(1 for espera in salidas if espera < 120) <= 30
+    assert salidas[:3] == [0.0, 0.0, 0.0]
+
+
+def test_retry_after_tiene_tope():
+    assert gemini_client._espera_reintento(0, "3600") == 60.0
+    assert gemini_client._espera_reintento(0, "5") == 5.0
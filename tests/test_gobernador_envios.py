@@ -0,0 +1,57 @@
+import pytest
+
+from gobernador_envios import PRIORIDAD_OPERADOR, PRIORIDAD_PROSPECCION, GobernadorEnvios
+
+T0 = 1_800_000_000.0
+
+
+@pytest.fixture
+def gobernador(tmp_path):
+    return GobernadorEnvios(str(tmp_path / "gobernador.json"), por_hora=6, por_dia=10, reserva_hora=2, reserva_dia=3)
+
+
+def _tomar(gobernador, prioridad, ahora, maximo=100):
+    tomados = 0
+    while tomados < maximo and gobernador.adquirir(prioridad, ahora)[0]:
+        tomados += 1
+    return tomados
+
+
+def test_prospeccion_no_toca_la_reserva_del_operador(gobernador):
+    assert _tomar(gobernador, PRIORIDAD_PROSPECCION, T0) == 4
+    permitido, espera = gobernador.adquirir(PRIORIDAD_PROSPECCION, T0)
+    # Falta un token en la ventana por hora: 3600 / 6 s.
+    assert not permitido and espera == pytest.approx(600)
+    assert _tomar(gobernador, PRIORIDAD_OPERADOR, T0) == 2
+    assert gobernador.disponibles(T0)["hora"] == {PRIORIDAD_OPERADOR: 0, PRIORIDAD_PROSPECCION: 0}
+
+
+def test_ventana_por_hora_se_recarga_y_la_diaria_limita(gobernador):
+    assert _tomar(gobernador, PRIORIDAD_OPERADOR, T0) == 6
+    assert not gobernador.adquirir(PRIORIDAD_OPERADOR, T0 + 599)[0]
+    assert gobernador.adquirir(PRIORIDAD_OPERADOR, T0 + 600)[0]
+    # Una hora después la ventana por hora está llena, pero al día le quedan 3.
+    assert _tomar(gobernador, PRIORIDAD_OPERADOR, T0 + 4200) == 3
+    permitido, espera = gobernador.adquirir(PRIORIDAD_OPERADOR, T0 + 4200)
+    assert not permitido and espera > 3600
+
+
+def test_estado_persiste_entre_instancias(gobernador):
+    assert _tomar(gobernador, PRIORIDAD_OPERADOR, T0, maximo=5) == 5
+    otro = GobernadorEnvios(gobernador.archivo, por_hora=6, por_dia=10, reserva_hora=2, reserva_dia=3)
+    assert otro.disponibles(T0)["dia"][PRIORIDAD_OPERADOR] == 5
+
+
+def test_devolver_repone_el_envio_que_no_salio(gobernador):
+    assert _tomar(gobernador, PRIORIDAD_OPERADOR, T0) == 6
+    for _ in range(3):
+        gobernador.devolver(T0)
+    assert gobernador.disponibles(T0)["hora"][PRIORIDAD_OPERADOR] == 3
+    assert gobernador.disponibles(T0)["dia"][PRIORIDAD_OPERADOR] == 7
+    # Nunca por encima de la capacidad.
+    for _ in range(10):
+        gobernador.devolver(T0)
+    assert gobernador.disponibles(T0) == {
+        "hora": {PRIORIDAD_OPERADOR: 6, PRIORIDAD_PROSPECCION: 4},
+        "dia": {PRIORIDAD_OPERADOR: 10, PRIORIDAD_PROSPECCION: 7},
+    }
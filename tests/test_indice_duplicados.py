@@ -0,0 +1,35 @@
+import pandas as pd
+
+from indice_duplicados import IndiceDuplicados
+
+
+def _leads(*filas):
+    return pd.DataFrame([{"Id": i, "Evento": n, "Ubicacion": "Ñuñoa", "Telefono": t} for i, n, t in filas])
+
+
+def test_baja_del_dueno_no_pierde_el_telefono_repetido():
+    indice = IndiceDuplicados()
+    indice.sincronizar("clinicas", _leads((1, "Clínica Sol", "+56 9 1111 1111"), (2, "Centro Luna", "911111111")))
+    assert indice.duplicado_de("Otro Nombre", "911111111") == ("telefono", "clinicas:1")
+
+    indice.sincronizar("clinicas", _leads((2, "Centro Luna", "911111111")))
+    assert indice.duplicado_de("Otro Nombre", "911111111") == ("telefono", "clinicas:2")
+
+    indice.sincronizar("clinicas", _leads((3, "Spa Mar", "922222222")))
+    assert indice.duplicado_de("Otro Nombre", "911111111") is None
+
+
+def test_baja_del_dueno_no_pierde_el_sitio_repetido():
+    indice = IndiceDuplicados()
+    indice.agregar("clinicas", 1, "Clínica Sol", "911111111", sitio="https://www.clinicasol.cl/")
+    indice.agregar("almacenes", 7, "Almacén Sol", "933333333", sitio="https://clinicasol.cl/contacto")
+    indice.sincronizar("clinicas", _leads())
+    assert indice.duplicado_de("Otro Nombre", "", sitio="http://clinicasol.cl") == ("sitio", "almacenes:7")
+
+
+def test_reindexar_un_lead_con_otro_telefono():
+    indice = IndiceDuplicados()
+    indice.sincronizar("clinicas", _leads((1, "Clínica Sol", "911111111"), (2, "Centro Luna", "911111111")))
+    indice.sincronizar("clinicas", _leads((1, "Clínica Sol", "944444444"), (2, "Centro Luna", "911111111")))
+    assert indice.duplicado_de("Otro Nombre", "911111111") == ("telefono", "clinicas:2")
+    assert indice.duplicado_de("Otro Nombre", "944444444") == ("telefono", "clinicas:1")
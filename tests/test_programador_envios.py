@@ -0,0 +1,39 @@
+import json
+import time
+
+import programador_envios
+import worker
+
+
+def test_cancelar_reinicia_fallos_seguidos(tmp_path):
+    archivo = str(tmp_path / "cola.json")
+    programador_envios.programar("clinicas", [(1, 1), (2, 1), (3, 1)], (0, 0), ahora=time.time() - 60, archivo=archivo)
+
+    despacho = programador_envios.despachar("clinicas", lambda entrada: False, 0, archivo=archivo)
+    assert despacho["fallos_seguidos"] == 3
+
+    assert programador_envios.cancelar("clinicas", archivo=archivo) == 0
+    with open(archivo, encoding="utf-8") as f:
+        assert json.load(f)["lineas"]["clinicas"]["fallos_seguidos"] == 0
+    assert programador_envios.despachar("clinicas", lambda entrada: False, 0, archivo=archivo)["fallos_seguidos"] == 0
+
+
+def test_despachar_envios_alerta_una_sola_vez(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / worker.ARCHIVO_LEADS).write_text("", encoding="utf-8")
+    monkeypatch.setattr(worker, "PAUSA_ENTRE_ENVIOS_SEG", (0, 0))
+    monkeypatch.setattr(worker, "_en_horario_envio", lambda ahora: True)
+    monkeypatch.setattr(worker, "_cargar_leads", lambda: object())
+    monkeypatch.setattr(worker, "_enviar_programado", lambda df, entrada, ahora, resumen: False)
+    monkeypatch.setattr(worker.diario_leads, "compactar", lambda df, archivo: None)
+    alertas = []
+    monkeypatch.setattr(worker.evo, "enviar_alerta", lambda numero, texto: alertas.append(texto))
+
+    envios = [(i, 1) for i in range(1, 6)]
+    programador_envios.programar("clinicas", envios, (0, 0), ahora=time.time() - 60, archivo="cola_envios.json")
+
+    for _ in range(3):
+        worker.despachar_envios()
+
+    assert len(alertas) == 1
+    assert programador_envios.en_cola("clinicas", archivo="cola_envios.json") == []
@@ -0,0 +1,111 @@
+import pytest
+
+from sincronizador_github import SincronizadorGitHub, StubGitHub
+
+
+@pytest.fixture
+def stub():
+    stub = StubGitHub(archivos={"leads.csv": "Id,Evento\n1,Lead 1\n"}).iniciar()
+    yield stub
+    stub.detener()
+
+
+@pytest.fixture
+def sinc(stub):
+    sinc = SincronizadorGitHub(stub.repo, "token", rama=stub.rama, api_url=stub.url)
+    yield sinc
+    sinc.cerrar()
+
+
+def _estados(sinc):
+    """Registra (método, ruta, estado HTTP) de cada respuesta que recibe `sinc`."""
+    registro = []
+    request = sinc.sesion.request
+
+    def _request(metodo, url, **kwargs):
+        res = request(metodo, url, **kwargs)
+        registro.append((metodo, url.split("/git/", 1)[1], res.status_code))
+        return res
+
+    sinc.sesion.request = _request
+    return registro
+
+
+def _commits(stub):
+    return [ruta for metodo, ruta in stub.solicitudes if metodo == "POST" and ruta.endswith("/commits")]
+
+
+def test_varios_archivos_en_un_solo_commit(stub, sinc):
+    ok, sha = sinc.subir({
+        "cambios_pendientes/leads.csv.1.json": '{"cambios": []}',
+        "cambios_pendientes/leads.csv.2.json": '{"cambios": []}',
+        "leads.csv": None,
+    }, "Dashboard")
+    assert ok and stub.refs[stub.rama] == sha
+    assert len(_commits(stub)) == 1
+    assert stub.archivos() == {
+        "cambios_pendientes/leads.csv.1.json": b'{"cambios": []}',
+        "cambios_pendientes/leads.csv.2.json": b'{"cambios": []}',
+    }
+    # Dos archivos con el mismo contenido: un solo blob.
+    assert sum(1 for metodo, ruta in stub.solicitudes if ruta.endswith("/blobs")) == 1
+
+
+@pytest.mark.parametrize("estado", [409, 422])
+def test_conflicto_forzado_se_reintenta(stub, sinc, estado):
+    stub.estado_conflicto = estado
+    stub.conflictos_forzados = 2
+    ok, _ = sinc.subir({"nuevo.json": "{}"}, "Dashboard")
+    assert ok and stub.archivos()["nuevo.json"] == b"{}"
+    assert len(_commits(stub)) == 3
+
+
+def test_push_de_un_worker_entremedio_se_rebasa(stub, sinc):
+    # Un worker pushea entre que se lee la punta y se mueve la rama: el PATCH
+    # falla (no es fast forward) y el commit se rearma sobre la punta nueva
+    # sin pisar lo del worker.
+    punta_rama = sinc.punta_rama
+    pendientes = [{"leads.csv": "Id,Evento\n1,Lead 1\n2,Lead 2\n"}]
+
+    def _punta_con_carrera():
+        sha = punta_rama()
+        if pendientes:
+            stub.commit_externo(pendientes.pop(), "worker")
+        return sha
+
+    sinc.punta_rama = _punta_con_carrera
+    estados = _estados(sinc)
+    ok, sha = sinc.subir({"cambios_pendientes/leads.csv.1.json": "{}"}, "Dashboard")
+    assert ok and stub.refs[stub.rama] == sha
+    assert [e for m, _, e in estados if m == "PATCH"] == [422, 200]
+    assert stub.archivos() == {
+        "leads.csv": b"Id,Evento\n1,Lead 1\n2,Lead 2\n",
+        "cambios_pendientes/leads.csv.1.json": b"{}",
+    }
+
+
+def test_conflictos_sin_fin_devuelven_error(stub, sinc):
+    stub.conflictos_forzados = 10
+    ok, detalle = sinc.subir({"nuevo.json": "{}"}, "Dashboard")
+    assert not ok and "siguió cambiando" in detalle
+    assert "nuevo.json" not in stub.archivos()
+
+
+def test_punta_rama_usa_etag(stub, sinc):
+    estados = _estados(sinc)
+    sha = sinc.punta_rama()
+    assert sinc.punta_rama() == sha
+    stub.commit_externo({"otro.csv": "x"})
+    nueva = sinc.punta_rama()
+    assert nueva != sha and nueva == stub.refs[stub.rama]
+    assert [e for _, _, e in estados] == [200, 304, 200]
+
+
+def test_blobs_subidos_no_pasan_de_una_llamada_a_otra(stub, sinc):
+    # Un blob que no quedó en ningún commit GitHub lo puede borrar: cada
+    # llamada vuelve a subir lo que usa.
+    stub.conflictos_forzados = 10
+    assert not sinc.subir({"nuevo.json": "{}"}, "Dashboard")[0]
+    stub.conflictos_forzados = 0
+    assert sinc.subir({"nuevo.json": "{}"}, "Dashboard")[0]
+    assert sum(1 for metodo, ruta in stub.solicitudes if ruta.endswith("/blobs")) == 2
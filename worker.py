@@ -1,24 +1,25 @@
 import pandas as pd
-import requests
 import os
 import random
 import sys
-import time
 import unicodedata
 import re
 import json
 import math
 import calendar
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import logging
-
-from evo_client import (
-    normalizar_telefono_chile as _normalizar_telefono_chile,
-    verificar_estado_conexion,
-    enviar_mensaje_texto as _evo_enviar_mensaje_texto,
-    enviar_alerta_whatsapp,
-)
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from evo_client import EvolutionClient, normalizar_telefono_chile as _normalizar_telefono_chile
+import diario_leads
+import programador_envios
+from gobernador_envios import PRIORIDAD_PROSPECCION, adquirir_envio
+from barrido_serpapi import buscar_paginado, registrar_busquedas, siguientes_combos
+from extractor_emails import buscar_emails_en_lote, estadisticas_cache
+from indice_duplicados import cargar_indice
+from seleccion_candidatos import parsear_fecha_contacto, seleccionar_candidatos
 
 # --- CONFIGURACIÓN ---
 EVO_URL = os.getenv("EVO_URL")
@@ -26,11 +27,16 @@ EVO_TOKEN = os.getenv("EVO_TOKEN")
 EVO_INSTANCE = os.getenv("EVO_INSTANCE")
 SERP_KEY = os.getenv("SERP_KEY")
 NUMERO_OPERADOR = os.getenv("NUMERO_OPERADOR", "")
+# Cliente con sesión HTTP reutilizada (presencia + envío + alertas del ciclo).
+evo = EvolutionClient(EVO_URL, EVO_TOKEN, EVO_INSTANCE)
 ARCHIVO_LEADS = "prospeccion_gestionvital_pro.csv"
 ARCHIVO_ALERTA = "alert_status.json"
 ARCHIVO_COBERTURA = "cobertura_clinicas.json"
 ARCHIVO_PRESUPUESTO_SERP = "presupuesto_serpapi.json"
 LIMITE_MENSUAL_SERPAPI = int(os.getenv("LIMITE_MENSUAL_SERPAPI", "250"))
+# Máximo de combos comuna+término que se buscan (en paralelo) en un mismo
+# ciclo, si el cupo del día alcanza.
+SERPAPI_BUSQUEDAS_POR_CICLO = int(os.getenv("SERPAPI_BUSQUEDAS_POR_CICLO", "4"))
 RECONTACTO_DIAS = int(os.getenv("RECONTACTO_DIAS", "21"))
 MAX_RECICLADOS_POR_CICLO = int(os.getenv("MAX_RECICLADOS_POR_CICLO", "8"))
 MAX_FALLOS_SEGUIDOS = 3
@@ -99,16 +105,18 @@ def enviar_resumen_email(asunto, cuerpo):
 
 
 def _nuevo_resumen():
-    return {"nuevos_leads": [], "mensajes": [], "reciclados": 0, "alertas": []}
+    return {"nuevos_leads": [], "mensajes": [], "programados": 0, "reciclados": 0, "alertas": [],
+            "cache_emails": None}
 
 
 def _enviar_resumen_si_corresponde(resumen, ahora):
     """
     Solo envía el email si pasó algo relevante en el ciclo (leads nuevos,
-    mensajes enviados, alertas, o reciclaje) — si no hubo nada que reportar
-    (ej. fuera de horario o ciclo vacío), no manda correo.
+    mensajes enviados o programados, alertas, o reciclaje) — si no hubo nada
+    que reportar (ej. fuera de horario o ciclo vacío), no manda correo.
     """
-    if not (resumen["nuevos_leads"] or resumen["mensajes"] or resumen["reciclados"] or resumen["alertas"]):
+    if not (resumen["nuevos_leads"] or resumen["mensajes"] or resumen["programados"]
+            or resumen["reciclados"] or resumen["alertas"]):
         print("📪 Nada relevante que reportar este ciclo, no se envía resumen por email.")
         return
 
@@ -133,9 +141,17 @@ def _enviar_resumen_si_corresponde(resumen, ahora):
             lineas.append(f"- [{'OK' if m['ok'] else 'FALLO'}] {m['Evento']} - Día {m['dia']}")
         lineas.append("")
 
+    if resumen["programados"]:
+        lineas.append(f"Mensajes programados para los próximos minutos: {resumen['programados']}")
+
     if resumen["reciclados"]:
         lineas.append(f"Leads reciclados para recontacto: {resumen['reciclados']}")
 
+    cache = resumen["cache_emails"]
+    if cache and cache["consultas"]:
+        lineas.append(f"Cache de emails: {cache['aciertos']}/{cache['consultas']} sitios sin re-rastrear "
+                      f"({cache['tasa']:.0%} de acierto)")
+
     enviar_resumen_email(asunto, "\n".join(lineas))
 
 # --- UTILIDADES DE HUMANIZACIÓN ---
@@ -177,22 +193,12 @@ def reciclar_leads_antiguos(df, ahora):
     if df.empty:
         return df, 0
 
-    candidatos = []
-    for idx, row in df.iterrows():
-        estado = str(row.get("Estado", ""))
-        fecha_contacto = str(row.get("Fecha_Contacto", "")).strip()
-
-        if estado not in ["Finalizado", "Error", "Rechazado"]:
-            continue
-        if not fecha_contacto:
-            continue
-
-        try:
-            ultima_fecha = datetime.strptime(fecha_contacto, "%d/%m/%Y %H:%M")
-            if (ahora - ultima_fecha).days >= RECONTACTO_DIAS:
-                candidatos.append(idx)
-        except Exception:
-            continue
+    ultima_fecha = parsear_fecha_contacto(df["Fecha_Contacto"])
+    reciclable = (
+        df["Estado"].astype(str).isin(["Finalizado", "Error", "Rechazado"])
+        & ((ahora - ultima_fecha).dt.days >= RECONTACTO_DIAS)
+    )
+    candidatos = df.index[reciclable].tolist()
 
     if not candidatos:
         return df, 0
@@ -206,51 +212,6 @@ def reciclar_leads_antiguos(df, ahora):
 
     return df, len(reciclados)
 
-# --- EXTRACTOR DE CORREOS ---
-PAGINAS_CONTACTO = ["/contacto", "/contact", "/contactenos", "/nosotros", "/about", "/sobre-nosotros"]
-
-
-def _extraer_emails_de_html(html):
-    emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', html)
-    filtrados = [e for e in emails if not e.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg'))]
-    if not filtrados:
-        return ""
-    prioritarios = [e for e in filtrados if any(p in e.lower() for p in ['contacto', 'info', 'ventas'])]
-    return (prioritarios[0] if prioritarios else filtrados[0]).lower()
-
-
-def buscar_email_en_web(url):
-    """
-    Busca un email en la home del sitio; si no encuentra nada, intenta un par de
-    páginas de contacto típicas antes de rendirse (mejora la tasa de captura de
-    email sin disparar más búsquedas de SerpAPI, ya que son requests directos).
-    """
-    if not url or not url.startswith("http"):
-        return ""
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    base = url.rstrip('/')
-
-    try:
-        response = requests.get(url, headers=headers, timeout=12)
-        email = _extraer_emails_de_html(response.text)
-        if email:
-            return email
-    except Exception:
-        pass
-
-    for pagina in PAGINAS_CONTACTO:
-        try:
-            response = requests.get(base + pagina, headers=headers, timeout=8)
-            if response.status_code != 200:
-                continue
-            email = _extraer_emails_de_html(response.text)
-            if email:
-                return email
-        except Exception:
-            continue
-
-    return ""
-
 # --- BÚSQUEDA AUTOMÁTICA ---
 # Las 52 comunas de la Región Metropolitana, para cobertura exhaustiva.
 COMUNAS_OBJETIVO = [
@@ -286,66 +247,11 @@ TERMINOS_BUSQUEDA = [
 ]
 
 
-def _cargar_cobertura():
-    if os.path.exists(ARCHIVO_COBERTURA):
-        try:
-            with open(ARCHIVO_COBERTURA, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            logging.exception("No se pudo leer %s, se reconstruye desde cero.", ARCHIVO_COBERTURA)
-    return None
-
-
-def _guardar_cobertura(estado):
-    try:
-        with open(ARCHIVO_COBERTURA, "w", encoding="utf-8") as f:
-            json.dump(estado, f, ensure_ascii=False, indent=2)
-    except Exception:
-        logging.exception("No se pudo escribir %s.", ARCHIVO_COBERTURA)
-
-
-def _nueva_vuelta(vuelta_anterior=0):
-    combos = [[comuna, termino] for comuna in COMUNAS_OBJETIVO for termino in TERMINOS_BUSQUEDA]
-    random.shuffle(combos)
-    return {"pendientes": combos, "vuelta": vuelta_anterior + 1}
+def _combos_clinicas():
+    return [[comuna, termino] for comuna in COMUNAS_OBJETIVO for termino in TERMINOS_BUSQUEDA]
 
 
-def obtener_siguiente_combo():
-    """
-    Devuelve (zona, termino) siguiente a buscar, sin marcarla aún como cubierta
-    (eso lo hace marcar_combo_cubierto una vez que la búsqueda efectivamente
-    corrió). Lleva un registro persistente de qué combinaciones comuna+término
-    ya se cubrieron en esta "vuelta" de barrido exhaustivo (52 comunas x N
-    términos). Al agotar todas las combinaciones, comienza una vuelta nueva
-    (re-mezclada) automáticamente.
-    """
-    estado = _cargar_cobertura()
-    if not estado or not estado.get("pendientes"):
-        estado = _nueva_vuelta(estado.get("vuelta", 0) if estado else 0)
-        _guardar_cobertura(estado)
-        print(f"🔄 Iniciando vuelta de barrido exhaustivo N°{estado['vuelta']} "
-              f"({len(estado['pendientes'])} combinaciones comuna+término).")
-
-    zona, termino = estado["pendientes"][0]
-    print(f"📍 Combinación elegida (vuelta {estado['vuelta']}, quedan "
-          f"{len(estado['pendientes'])} por cubrir): {termino} en {zona}")
-    return zona, termino
-
-
-def marcar_combo_cubierto(zona, termino):
-    """
-    Confirma que la combinación se buscó de verdad y la saca de pendientes.
-    Se llama solo cuando SerpAPI respondió (ok o sin_resultados) — si hubo
-    cuota agotada o error de red, la combinación se deja pendiente para
-    reintentarla en el próximo ciclo, en vez de darla por cubierta sin haberla
-    buscado realmente.
-    """
-    estado = _cargar_cobertura()
-    if not estado or not estado.get("pendientes"):
-        return
-    if estado["pendientes"][0] == [zona, termino]:
-        estado["pendientes"].pop(0)
-        _guardar_cobertura(estado)
+_presupuesto_lock = threading.Lock()
 
 
 def _cargar_presupuesto_serp():
@@ -366,110 +272,193 @@ def _guardar_presupuesto_serp(estado):
         logging.exception("No se pudo escribir %s.", ARCHIVO_PRESUPUESTO_SERP)
 
 
-def _reservar_busqueda_serp(ahora):
+def _reservar_busqueda_serp(ahora, cantidad=1):
     """
     Reparte el cupo mensual de SerpAPI (LIMITE_MENSUAL_SERPAPI, por defecto 250)
     de forma pareja a lo largo del mes, en vez de dejar que un cron por hora
-    queme todo el cupo en los primeros días. Si hay cupo disponible para el día
-    de hoy, lo reserva (incrementa el contador) y devuelve True; si no, False.
+    queme todo el cupo en los primeros días. Reserva de una vez hasta
+    `cantidad` búsquedas (las que alcancen del cupo disponible para el día de
+    hoy, incrementando el contador) y devuelve cuántas reservó: 0 si no hay cupo.
     """
-    mes_actual = ahora.strftime("%Y-%m")
-    estado = _cargar_presupuesto_serp()
-    if estado.get("mes") != mes_actual:
-        estado = {"mes": mes_actual, "usadas": 0}
-
-    dias_en_mes = calendar.monthrange(ahora.year, ahora.month)[1]
-    permitido_hasta_hoy = min(
-        LIMITE_MENSUAL_SERPAPI,
-        math.ceil(ahora.day * LIMITE_MENSUAL_SERPAPI / dias_en_mes),
-    )
+    with _presupuesto_lock:
+        mes_actual = ahora.strftime("%Y-%m")
+        estado = _cargar_presupuesto_serp()
+        if estado.get("mes") != mes_actual:
+            estado = {"mes": mes_actual, "usadas": 0}
+
+        dias_en_mes = calendar.monthrange(ahora.year, ahora.month)[1]
+        permitido_hasta_hoy = min(
+            LIMITE_MENSUAL_SERPAPI,
+            math.ceil(ahora.day * LIMITE_MENSUAL_SERPAPI / dias_en_mes),
+        )
+
+        if estado["usadas"] >= permitido_hasta_hoy:
+            _guardar_presupuesto_serp(estado)
+            print(f"💸 Cupo de SerpAPI del día agotado ({estado['usadas']}/{permitido_hasta_hoy} "
+                  f"permitidas a esta altura del mes, límite mensual {LIMITE_MENSUAL_SERPAPI}). "
+                  f"Se omite la búsqueda de este ciclo.")
+            return 0
 
-    if estado["usadas"] >= permitido_hasta_hoy:
+        reservadas = min(cantidad, permitido_hasta_hoy - estado["usadas"])
+        estado["usadas"] += reservadas
         _guardar_presupuesto_serp(estado)
-        print(f"💸 Cupo de SerpAPI del día agotado ({estado['usadas']}/{permitido_hasta_hoy} "
-              f"permitidas a esta altura del mes, límite mensual {LIMITE_MENSUAL_SERPAPI}). "
-              f"Se omite la búsqueda de este ciclo.")
-        return False
+        print(f"💳 Presupuesto SerpAPI: {estado['usadas']}/{LIMITE_MENSUAL_SERPAPI} usadas este mes "
+              f"({permitido_hasta_hoy} permitidas a esta altura del mes"
+              + (f", {reservadas} reservadas para este lote)." if cantidad > 1 else ")."))
+        return reservadas
+
+
+def _devolver_busquedas_serp(ahora, cantidad):
+    """Devuelve al cupo búsquedas reservadas que no se usaron (ej. la página vino del cache)."""
+    if cantidad <= 0:
+        return
+    with _presupuesto_lock:
+        estado = _cargar_presupuesto_serp()
+        if estado.get("mes") == ahora.strftime("%Y-%m"):
+            estado["usadas"] = max(0, estado["usadas"] - cantidad)
+            _guardar_presupuesto_serp(estado)
+
 
-    estado["usadas"] += 1
-    _guardar_presupuesto_serp(estado)
-    print(f"💳 Presupuesto SerpAPI: {estado['usadas']}/{LIMITE_MENSUAL_SERPAPI} usadas este mes "
-          f"({permitido_hasta_hoy} permitidas a esta altura del mes).")
-    return True
+def _telefono_lead(place):
+    """Teléfono (sin espacios ni guiones) si el resultado sirve como lead, o None."""
+    raw_tel = str(place.get("phone", "")).replace(" ", "").replace("-", "")
+    if not place.get("website") or not raw_tel or len(raw_tel) < 8:
+        return None
+    return raw_tel
 
 
 def buscar_y_agregar_nuevos(df_actual):
     """
-    Busca nuevos leads en SerpAPI para la siguiente combinación comuna+término
-    pendiente del barrido exhaustivo (ver obtener_siguiente_combo), respetando
-    el cupo mensual configurado en LIMITE_MENSUAL_SERPAPI.
+    Busca nuevos leads en SerpAPI para las siguientes combinaciones
+    comuna+término pendientes del barrido exhaustivo (ver
+    barrido_serpapi.siguientes_combos), respetando el cupo mensual configurado
+    en LIMITE_MENSUAL_SERPAPI. Si el cupo del día alcanza, reserva de una vez
+    hasta SERPAPI_BUSQUEDAS_POR_CICLO búsquedas y las corre en paralelo; los
+    resultados se juntan y deduplican en una sola pasada y el estado del
+    barrido se actualiza en una sola escritura. Cada combo pagina mientras
+    siga rindiendo leads nuevos (ver barrido_serpapi); las páginas que ya
+    están en el cache de SerpAPI (ver serpapi_cache) no consumen cupo.
+    Un lugar se descarta si ya está (por teléfono, sitio web o nombre
+    parecido en la misma comuna) en cualquiera de las dos líneas; ver
+    indice_duplicados.
     Devuelve (df_actualizado, resultado) donde resultado es uno de:
-    "ok", "sin_resultados", "cuota_agotada", "error_api", "presupuesto_agotado".
+    "ok", "sin_resultados", "cuota_agotada", "error_api", "presupuesto_agotado",
+    "sin_grabacion" (modo replay sin respuesta grabada).
     """
     ahora_cl = obtener_ahora_chile()
-    if not _reservar_busqueda_serp(ahora_cl):
-        return df_actual, "presupuesto_agotado"
-
-    zona_objetivo, termino_objetivo = obtener_siguiente_combo()
-    print(f"🔍 Buscando nuevos leads: '{termino_objetivo}' en {zona_objetivo}...")
-    params = {
-        "engine": "google_maps",
-        "q": f"{termino_objetivo} {zona_objetivo} Chile",
-        "api_key": SERP_KEY,
-        "num": 15,
-    }
-    try:
-        response = requests.get("https://serpapi.com/search", params=params, timeout=30)
-        print(f"🔎 SerpAPI status: {response.status_code}")
-        data = response.json()
-
-        if "error" in data:
-            # SerpAPI devuelve HTTP 200 con {"error": "..."} en casos de cuota
-            # agotada / api_key inválida, distinto de "sin resultados".
-            print(f"🚫 SerpAPI error: {data['error']}")
-            logging.error("SerpAPI error (clínicas): %s", data["error"])
-            return df_actual, "cuota_agotada"
-
-        results = data.get("local_results", [])
-        print(f"🔎 SerpAPI local_results: {len(results)}")
-        nuevos_leads = []
-        tels_en_base = set()
-        if not df_actual.empty and "Telefono" in df_actual.columns:
-            tels_en_base = set(
-                df_actual["Telefono"]
-                .astype(str)
-                .str.replace(".0", "", regex=False)
-                .str[-9:]
-                .tolist()
-            )
-        ultimo_id = int(df_actual['Id'].max()) if not df_actual.empty else 0
-        for place in results:
-            raw_tel = str(place.get("phone", "")).replace(" ", "").replace("-", "")
-            if not place.get("website") or not raw_tel or len(raw_tel) < 8: continue
-            if raw_tel[-9:] not in tels_en_base:
-                ultimo_id += 1
-                nuevos_leads.append({
-                    "Id": int(ultimo_id), "Fecha": ahora_cl.strftime("%d/%m/%Y"),
-                    "Hora": ahora_cl.strftime("%H:%M"), "Evento": place.get("title", "Clinica"),
-                    "Ministerio": f"Prospeccion Automatica - {termino_objetivo}", "Ubicacion": zona_objetivo, "Estado": "Nuevo",
-                    "Telefono": raw_tel, "Email": buscar_email_en_web(place.get("website")),
-                    "Email_Enviado": "No", "Dia_Secuencia": 0, "Fecha_Contacto": ""
-                })
-                tels_en_base.add(raw_tel[-9:])
-        marcar_combo_cubierto(zona_objetivo, termino_objetivo)
-        if nuevos_leads:
-            print(f"➕ Leads agregados: {len(nuevos_leads)}")
-            return pd.concat([df_actual, pd.DataFrame(nuevos_leads)], ignore_index=True), "ok"
+    indice = cargar_indice({"clinicas": df_actual})
+
+    # Sin cupo igual se busca un combo: si su respuesta está en el cache (ej.
+    # reintento tras una caída) no cuesta nada; si no, buscar_paginado corta
+    # con "presupuesto_agotado" al intentar reservar.
+    prepagadas = _reservar_busqueda_serp(ahora_cl, SERPAPI_BUSQUEDAS_POR_CICLO)
+    lock_prepagadas = threading.Lock()
+
+    def reservar():
+        nonlocal prepagadas
+        with lock_prepagadas:
+            if prepagadas > 0:
+                prepagadas -= 1
+                return True
+        return _reservar_busqueda_serp(ahora_cl) > 0
+
+    def buscar_combo(zona, termino, start):
+        print(f"🔍 Buscando nuevos leads: '{termino}' en {zona}...")
+        params = {
+            "engine": "google_maps",
+            "q": f"{termino} {zona} Chile",
+            "api_key": SERP_KEY,
+            "num": 15,
+        }
+        lugares = []
+        vistos = set()
+
+        def procesar_pagina(results):
+            print(f"🔎 SerpAPI local_results ({zona}): {len(results)}")
+            lugares.extend(results)
+            nuevos = 0
+            for place in results:
+                raw_tel = _telefono_lead(place)
+                if not raw_tel or raw_tel[-9:] in vistos:
+                    continue
+                # Solo lectura del índice: seguro desde los hilos del pool.
+                if not indice.duplicado_de(place.get("title", ""), raw_tel, place.get("website"), zona):
+                    vistos.add(raw_tel[-9:])
+                    nuevos += 1
+            return nuevos
+
+        try:
+            avance = buscar_paginado(params, procesar_pagina, reservar=reservar, start=start)
+        except Exception as e:
+            print(f"❌ Error búsqueda ({termino} en {zona}): {e}")
+            logging.exception("Error al buscar nuevos leads (clínicas).")
+            avance = {"resultado": "error_api", "paginas": 0, "siguiente_start": start}
+        return avance, lugares
+
+    combos = siguientes_combos(ARCHIVO_COBERTURA, _combos_clinicas(), max(1, prepagadas))
+    with ThreadPoolExecutor(max_workers=len(combos)) as pool:
+        busquedas = list(pool.map(lambda combo: buscar_combo(*combo), combos))
+    _devolver_busquedas_serp(ahora_cl, prepagadas)
+
+    # Una sola pasada sobre todos los resultados del lote: un mismo negocio
+    # puede aparecer en varios combos (comunas vecinas, términos parecidos).
+    nuevos_leads = []
+    sitios = []
+    duplicados = {}
+    ultimo_id = int(df_actual['Id'].max()) if not df_actual.empty else 0
+    for (zona, termino, _), (_, lugares) in zip(combos, busquedas):
+        for place in lugares:
+            raw_tel = _telefono_lead(place)
+            if not raw_tel:
+                continue
+            duplicado = indice.duplicado_de(place.get("title", ""), raw_tel, place.get("website"), zona)
+            if duplicado:
+                duplicados[duplicado[0]] = duplicados.get(duplicado[0], 0) + 1
+                continue
+            ultimo_id += 1
+            nuevos_leads.append({
+                "Id": int(ultimo_id), "Fecha": ahora_cl.strftime("%d/%m/%Y"),
+                "Hora": ahora_cl.strftime("%H:%M"), "Evento": place.get("title", "Clinica"),
+                "Ministerio": f"Prospeccion Automatica - {termino}", "Ubicacion": zona, "Estado": "Nuevo",
+                "Telefono": raw_tel, "Email": "",
+                "Email_Enviado": "No", "Dia_Secuencia": 0, "Fecha_Contacto": ""
+            })
+            sitios.append(place.get("website"))
+            indice.agregar("clinicas", ultimo_id, place.get("title", ""), raw_tel, place.get("website"), zona)
+    indice.guardar()
+    if duplicados:
+        print("🔁 Duplicados descartados: " + ", ".join(f"{n} por {motivo}" for motivo, n in duplicados.items()))
+
+    registrar_busquedas(
+        ARCHIVO_COBERTURA, [(zona, termino, avance) for (zona, termino, _), (avance, _) in zip(combos, busquedas)]
+    )
+    resultados = [avance["resultado"] for avance, _ in busquedas]
+    if "cuota_agotada" in resultados:
+        logging.error("SerpAPI error (clínicas): cuota agotada o api_key inválida.")
+        resultado = "cuota_agotada"
+    elif nuevos_leads:
+        resultado = "ok"
+    else:
+        resultado = next((r for r in resultados if r not in ("ok", "sin_resultados")), "sin_resultados")
+
+    if nuevos_leads:
+        # Todos los sitios del lote se rastrean en paralelo (antes, uno por uno).
+        emails = buscar_emails_en_lote(sitios)
+        for lead, sitio in zip(nuevos_leads, sitios):
+            lead["Email"] = emails.get(sitio, "")
+        cache = estadisticas_cache()
+        print(f"📧 Emails encontrados: {sum(1 for l in nuevos_leads if l['Email'])}/{len(nuevos_leads)} "
+              f"(cache: {cache['aciertos']}/{cache['consultas']} aciertos)")
+        paginas = sum(avance["paginas"] for avance, _ in busquedas)
+        print(f"➕ Leads agregados: {len(nuevos_leads)} en {len(combos)} combinaciones ({paginas} páginas).")
+        return pd.concat([df_actual, pd.DataFrame(nuevos_leads)], ignore_index=True), resultado
+    if resultado == "sin_resultados":
         print("📭 SerpAPI no devolvió leads nuevos (duplicados o sin teléfono/web válido).")
-        return df_actual, "sin_resultados"
-    except Exception as e:
-        print(f"❌ Error búsqueda: {e}")
-        logging.exception("Error al buscar nuevos leads (clínicas).")
-        return df_actual, "error_api"
+    return df_actual, resultado
 
 # --- COMUNICACIONES ---
 def enviar_mensaje_texto(numero, mensaje):
-    return _evo_enviar_mensaje_texto(EVO_URL, EVO_TOKEN, EVO_INSTANCE, numero, mensaje)
+    return evo.enviar_texto(numero, mensaje)
 
 def obtener_mensaje_secuencia(nombre, ubicacion, dia):
     """
@@ -505,16 +494,135 @@ def obtener_mensaje_secuencia(nombre, ubicacion, dia):
     return aplicar_spintax(msg.replace("{nombre}", nombre).replace("{zona}", zona))
 
 # --- CICLO PRINCIPAL ---
+ESTADOS_SIN_ENVIO = ["Finalizado", "Rechazado", "Cita Agendada", "Error"]
+MAX_ENVIOS_POR_CICLO = 5
+# Pausa humanizada entre dos envíos de clínicas (4 a 8 minutos). Ya no se
+# duerme en el ciclo: los envíos se programan (ver programador_envios).
+PAUSA_ENTRE_ENVIOS_SEG = (240, 480)
+
+
+def _seleccionar_candidatos(df, ahora, limite=MAX_ENVIOS_POR_CICLO):
+    return seleccionar_candidatos(
+        df, ahora,
+        estados_excluidos=ESTADOS_SIN_ENVIO,
+        max_dia_secuencia=4,
+        limite=limite,
+    )
+
+
+def _en_horario_envio(ahora):
+    # Restricción Lunes-Sábado 10:00 a 18:30 (Horario más conservador)
+    return ahora.weekday() <= 5 and 10 <= ahora.hour <= 18
+
+
+def _cargar_leads():
+    df = diario_leads.cargar_leads(ARCHIVO_LEADS)
+    df["Dia_Secuencia"] = pd.to_numeric(df["Dia_Secuencia"], errors='coerce').fillna(0).astype(int)
+    return df
+
+
+def _enviar_programado(df, entrada, ahora, resumen):
+    """
+    Envía el mensaje de una entrada de la cola. Devuelve True/False según el
+    envío, None si el lead ya no está pendiente de ese día de la secuencia
+    (el CSV cambió desde que se programó, ej. lo editaron en el dashboard), o
+    programador_envios.SIN_CUPO si el gobernador de envíos no dio cupo.
+    """
+    filas = df.index[pd.to_numeric(df["Id"], errors="coerce") == entrada["id"]]
+    if len(filas) == 0:
+        return None
+    idx, dia_obj = filas[0], entrada["dia"]
+    vigente = _seleccionar_candidatos(df.loc[[idx]], ahora, limite=1)
+    if not vigente or vigente[0]["dia"] != dia_obj:
+        return None
+
+    row = df.loc[idx]
+    tel_final = _normalizar_telefono_chile(row["Telefono"])
+    msg = obtener_mensaje_secuencia(row["Evento"], row["Ubicacion"], dia_obj)
+    if not msg:
+        return None
+
+    # Cupo compartido de la instancia (ambas líneas + respuestas del agente).
+    permitido, espera = adquirir_envio(PRIORIDAD_PROSPECCION)
+    if not permitido:
+        print(f"⏸️ Sin cupo de envíos en la instancia (próximo en ~{espera / 60:.0f} min); queda en la cola.")
+        return programador_envios.SIN_CUPO
+
+    print(f"📤 Enviando a: {row['Evento']} (día {dia_obj})...")
+    if enviar_mensaje_texto(tel_final, msg):
+        cambios = {
+            "Estado": "Contactado" if dia_obj < 4 else "Finalizado",
+            "Dia_Secuencia": dia_obj,
+            "Fecha_Contacto": ahora.strftime("%d/%m/%Y %H:%M"),
+        }
+        print(f"   ✅ Día {dia_obj} enviado.")
+        _limpiar_alerta()
+    else:
+        cambios = {"Estado": "Error", "Fecha_Contacto": ahora.strftime("%d/%m/%Y %H:%M")}
+        print(f"   ❌ Fallo técnico.")
+    resumen["mensajes"].append({"Evento": row["Evento"], "dia": dia_obj, "ok": cambios["Estado"] != "Error"})
+
+    # Solo se agregan al diario las celdas que cambiaron; el CSV completo
+    # se escribe una vez al final (compactar).
+    diario_leads.actualizar_lead(df, idx, ARCHIVO_LEADS, cambios)
+    return cambios["Estado"] != "Error"
+
+
+def despachar_envios(df=None, resumen=None):
+    """
+    Envía los mensajes de clínicas programados que ya vencieron, como mucho
+    uno cada PAUSA_ENTRE_ENVIOS_SEG[0] (ver programador_envios). Lo llaman
+    ejecutar_ciclo y despachador_envios.py. Si no se le pasa `df`, carga el
+    CSV solo si hay algo que enviar, y lo compacta al terminar. Devuelve el df
+    (o None si no hizo falta cargarlo).
+    """
+    ahora = obtener_ahora_chile()
+    resumen = _nuevo_resumen() if resumen is None else resumen
+    if not _en_horario_envio(ahora):
+        return df
+
+    propio = df is None
+    cargado = {"df": df}
+
+    def ejecutar(entrada):
+        if cargado["df"] is None:
+            if not os.path.exists(ARCHIVO_LEADS):
+                return None
+            cargado["df"] = _cargar_leads()
+        return _enviar_programado(cargado["df"], entrada, ahora, resumen)
+
+    despacho = programador_envios.despachar("clinicas", ejecutar, PAUSA_ENTRE_ENVIOS_SEG[0])
+    df = cargado["df"]
+
+    # Solo alerta si en esta corrida hubo un fallo (cancelar reinicia el contador).
+    fallos_seguidos = despacho["fallos_seguidos"]
+    fallo_ahora = any(resultado is False for _, resultado in despacho["resultados"])
+    if fallo_ahora and fallos_seguidos >= MAX_FALLOS_SEGUIDOS:
+        cancelados = programador_envios.cancelar("clinicas")
+        motivo = f"{fallos_seguidos} envíos seguidos fallaron con sesión reportada como 'open' (posible degradación/soft-ban)."
+        print(f"🔴 {motivo} Se cancelan {cancelados} envíos programados.")
+        logging.error(motivo)
+        _escribir_alerta("fallos_envio_seguidos", motivo)
+        resumen["alertas"].append(motivo)
+        evo.enviar_alerta(
+            NUMERO_OPERADOR,
+            f"⚠️ GestiónVital (clínicas): {motivo}",
+        )
+
+    if propio and df is not None and despacho["resultados"]:
+        diario_leads.compactar(df, ARCHIVO_LEADS)
+    return df
+
+
 def ejecutar_ciclo():
     ahora = obtener_ahora_chile()
     resumen = _nuevo_resumen()
 
-    # Restricción Lunes-Sábado 10:00 a 18:30 (Horario más conservador)
-    if ahora.weekday() > 5 or not (10 <= ahora.hour <= 18):
+    if not _en_horario_envio(ahora):
         print(f"🕒 Fuera de horario de envío (Hora Chile: {ahora.strftime('%H:%M')}).")
         return
 
-    estado_conexion = verificar_estado_conexion(EVO_URL, EVO_INSTANCE, EVO_TOKEN)
+    estado_conexion = evo.estado_conexion()
     if estado_conexion != "open":
         print(f"🔴 Sesión de WhatsApp no está 'open' (estado: {estado_conexion}). Abortando ciclo sin tocar leads.")
         logging.error("Sesión de WhatsApp caída o desconocida (estado=%s). Deteniendo ciclo.", estado_conexion)
@@ -525,32 +633,23 @@ def ejecutar_ciclo():
 
     if not os.path.exists(ARCHIVO_LEADS): return
 
-    df = pd.read_csv(ARCHIVO_LEADS)
-    df["Dia_Secuencia"] = pd.to_numeric(df["Dia_Secuencia"], errors='coerce').fillna(0).astype(int)
-    hoy_str = ahora.strftime("%d/%m/%Y")
-    
-    candidatos = []
-    for idx, row in df.iterrows():
-        if hoy_str in str(row.get('Fecha_Contacto', '')): continue
-        if row["Estado"] in ["Finalizado", "Rechazado", "Cita Agendada", "Error"]: continue
-
-        dia_act = int(row.get("Dia_Secuencia", 0))
-        if row["Estado"] == "Contactado":
-            try:
-                ultima_fecha = datetime.strptime(str(row['Fecha_Contacto']), "%d/%m/%Y %H:%M")
-                if (ahora - ultima_fecha).total_seconds() < 90000: continue
-            except: pass
-
-        if row["Estado"] == "Contactado" and dia_act < 4:
-            candidatos.append({'idx': idx, 'dia': dia_act + 1})
-        elif row["Estado"] == "Nuevo":
-            candidatos.append({'idx': idx, 'dia': 1})
-
-    # MEZCLAR Y LIMITAR (Máximo 5 envíos por ciclo para seguridad)
-    random.shuffle(candidatos)
-    candidatos = candidatos[:5]
+    df = _cargar_leads()
 
-    if not candidatos:
+    # Los envíos que siguen en la cola (programados en un ciclo anterior)
+    # cuentan contra el máximo por ciclo y no se vuelven a elegir.
+    en_cola = programador_envios.en_cola("clinicas")
+    cupo = MAX_ENVIOS_POR_CICLO - len(en_cola)
+
+    def candidatos_libres():
+        if cupo <= 0:
+            return []
+        libres = df[~pd.to_numeric(df["Id"], errors="coerce").isin([e["id"] for e in en_cola])]
+        # MEZCLAR Y LIMITAR (Máximo 5 envíos por ciclo para seguridad)
+        return _seleccionar_candidatos(libres, ahora, cupo)
+
+    candidatos = candidatos_libres()
+
+    if not candidatos and not en_cola:
         print("📭 Nada pendiente. Buscando nuevos leads...")
         total_antes = len(df)
         df, resultado_busqueda = buscar_y_agregar_nuevos(df)
@@ -559,39 +658,18 @@ def ejecutar_ciclo():
             resumen["nuevos_leads"] = [
                 {"Evento": r["Evento"], "Ubicacion": r["Ubicacion"]} for _, r in nuevos.iterrows()
             ]
-        df.to_csv(ARCHIVO_LEADS, index=False)
+        resumen["cache_emails"] = estadisticas_cache()
+        diario_leads.compactar(df, ARCHIVO_LEADS)
         if resultado_busqueda == "cuota_agotada":
             _escribir_alerta("serpapi_cuota_agotada", "SerpAPI devolvió un error (posible cuota agotada o api_key inválida).")
             resumen["alertas"].append("SerpAPI dejó de responder (posible cuota agotada o api_key inválida).")
-            enviar_alerta_whatsapp(
-                EVO_URL, EVO_TOKEN, EVO_INSTANCE, NUMERO_OPERADOR,
+            evo.enviar_alerta(
+                NUMERO_OPERADOR,
                 "⚠️ GestiónVital: SerpAPI dejó de responder (posible cuota agotada). Revisar api_key de clínicas.",
             )
 
         # Recalcular candidatos luego de agregar leads nuevos para enviar en el mismo run
-        candidatos = []
-        for idx, row in df.iterrows():
-            if hoy_str in str(row.get("Fecha_Contacto", "")):
-                continue
-            if row["Estado"] in ["Finalizado", "Rechazado", "Cita Agendada", "Error"]:
-                continue
-
-            dia_act = int(row.get("Dia_Secuencia", 0))
-            if row["Estado"] == "Contactado":
-                try:
-                    ultima_fecha = datetime.strptime(str(row["Fecha_Contacto"]), "%d/%m/%Y %H:%M")
-                    if (ahora - ultima_fecha).total_seconds() < 90000:
-                        continue
-                except Exception:
-                    pass
-
-            if row["Estado"] == "Contactado" and dia_act < 4:
-                candidatos.append({"idx": idx, "dia": dia_act + 1})
-            elif row["Estado"] == "Nuevo":
-                candidatos.append({"idx": idx, "dia": 1})
-
-        random.shuffle(candidatos)
-        candidatos = candidatos[:5]
+        candidatos = candidatos_libres()
 
         if not candidatos:
             print("📭 Aun así no hay candidatos para enviar después de buscar nuevos leads.")
@@ -600,63 +678,28 @@ def ejecutar_ciclo():
             resumen["reciclados"] = total_reciclados
             if total_reciclados > 0:
                 print(f"♻️ Leads reciclados para recontacto: {total_reciclados}")
-                df.to_csv(ARCHIVO_LEADS, index=False)
+                diario_leads.compactar(df, ARCHIVO_LEADS)
             else:
                 print("📭 Sin leads reciclables. Conviene ampliar comunas/canales de captación.")
             _enviar_resumen_si_corresponde(resumen, ahora)
             return
 
-    print(f"🚀 Procesando ráfaga de {len(candidatos)} envíos (Hora Chile: {ahora.strftime('%H:%M')})...")
-
-    fallos_seguidos = 0
-    for i, item in enumerate(candidatos):
-        idx, dia_obj = item['idx'], item['dia']
-        row = df.loc[idx]
-
-        tel_final = _normalizar_telefono_chile(row["Telefono"])
-
-        msg = obtener_mensaje_secuencia(row["Evento"], row["Ubicacion"], dia_obj)
-        if not msg: continue
-
-        print(f"[{i+1}/{len(candidatos)}] Enviando a: {row['Evento']}...")
-
-        if enviar_mensaje_texto(tel_final, msg):
-            df.at[idx, "Estado"] = "Contactado" if dia_obj < 4 else "Finalizado"
-            df.at[idx, "Dia_Secuencia"] = dia_obj
-            df.at[idx, "Fecha_Contacto"] = ahora.strftime("%d/%m/%Y %H:%M")
-            print(f"   ✅ Día {dia_obj} enviado.")
-            resumen["mensajes"].append({"Evento": row["Evento"], "dia": dia_obj, "ok": True})
-            fallos_seguidos = 0
-            _limpiar_alerta()
-        else:
-            df.at[idx, "Estado"] = "Error"
-            df.at[idx, "Fecha_Contacto"] = ahora.strftime("%d/%m/%Y %H:%M")
-            print(f"   ❌ Fallo técnico.")
-            resumen["mensajes"].append({"Evento": row["Evento"], "dia": dia_obj, "ok": False})
-            fallos_seguidos += 1
-
-        df.to_csv(ARCHIVO_LEADS, index=False)
-
-        if fallos_seguidos >= MAX_FALLOS_SEGUIDOS:
-            motivo = f"{fallos_seguidos} envíos seguidos fallaron con sesión reportada como 'open' (posible degradación/soft-ban)."
-            print(f"🔴 {motivo} Abortando el resto del ciclo.")
-            logging.error(motivo)
-            _escribir_alerta("fallos_envio_seguidos", motivo)
-            resumen["alertas"].append(motivo)
-            enviar_alerta_whatsapp(
-                EVO_URL, EVO_TOKEN, EVO_INSTANCE, NUMERO_OPERADOR,
-                f"⚠️ GestiónVital (clínicas): {motivo}",
-            )
-            break
+    # En vez de enviar la ráfaga con time.sleep entre mensajes (hasta ~40 min
+    # de runner ocupado), se programan con la misma pausa humanizada: el
+    # primero sale ahora mismo y el resto los envía despachador_envios.py.
+    programados = programador_envios.programar(
+        "clinicas", [(df.at[c["idx"], "Id"], c["dia"]) for c in candidatos], PAUSA_ENTRE_ENVIOS_SEG
+    )
+    resumen["programados"] = len(programados)
+    if programados:
+        print(f"🗓️ {len(programados)} envíos programados (Hora Chile: {ahora.strftime('%H:%M')}).")
 
-        # Pausa larga entre mensajes (4 a 8 minutos)
-        if i < len(candidatos) - 1:
-            espera = random.randint(240, 480)
-            print(f"   ⏳ Pausa de seguridad: {espera} seg...")
-            time.sleep(espera)
+    df = despachar_envios(df, resumen)
+    resumen["programados"] = len(programador_envios.en_cola("clinicas"))
 
+    diario_leads.compactar(df, ARCHIVO_LEADS)
     print("🏁 Ciclo completado.")
     _enviar_resumen_si_corresponde(resumen, ahora)
 
 if __name__ == "__main__":
-    ejecutar_ciclo()
\ No newline at end of file
+    ejecutar_ciclo()
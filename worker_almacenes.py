@@ -1,20 +1,31 @@
 import pandas as pd
-import requests
 import os
 import random
-import time
 import unicodedata
 import re
 from datetime import datetime, timedelta
 import logging
 
+import diario_leads
+import programador_envios
+from gobernador_envios import PRIORIDAD_PROSPECCION, adquirir_envio
+import serpapi_cache
+from evo_client import EvolutionClient, normalizar_telefono_chile
+from barrido_serpapi import buscar_paginado, registrar_busqueda, siguiente_combo
+from indice_duplicados import cargar_indice
+from seleccion_candidatos import seleccionar_candidatos
+
 # --- CONFIGURACIÓN ---
 EVO_URL = os.getenv("EVO_URL")
 EVO_TOKEN = os.getenv("EVO_TOKEN")
 EVO_INSTANCE = os.getenv("EVO_INSTANCE")
 SERP_KEY = os.getenv("SERP_KEY")
+evo = EvolutionClient(EVO_URL, EVO_TOKEN, EVO_INSTANCE)
 # Usamos un CSV diferente para no mezclar las bases de datos
 ARCHIVO_ALMACENES = "prospeccion_almacenes_pro.csv"
+# Estado del barrido por comuna (rendimiento histórico de cada búsqueda)
+ARCHIVO_COBERTURA = "cobertura_almacenes.json"
+TERMINO_BUSQUEDA = "Minimarket o Almacen"
 # Lista de comunas objetivo (puedes editarla sin tocar el código)
 COMUNAS_OBJETIVO = ["Providencia", "Las Condes", "La Florida", "San Miguel", "El Bosque", "San Bernardo"]
 # Límite diario de mensajes enviados para evitar baneos
@@ -49,84 +60,48 @@ def limpiar_acentos(text):
     return "".join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
 
 
-def normalizar_telefono_chile(raw):
-    """
-    Normaliza distintos formatos de teléfono chileno a un formato consistente.
-    Preferimos devolver '56XXXXXXXXX' cuando es posible.
-    """
-    digits = "".join(filter(str.isdigit, str(raw)))
-    if not digits:
-        return ""
-
-    # Ya viene con código de país
-    if digits.startswith("56") and len(digits) >= 11:
-        return digits
-
-    # Quitar ceros iniciales típicos (09..., 02..., etc.)
-    while digits.startswith("0"):
-        digits = digits[1:]
-
-    # Celular típico 9XXXXXXXX
-    if len(digits) == 9 and digits.startswith("9"):
-        return "56" + digits
-
-    # Fijo típico 2XXXXXXX u otros códigos de área de 1 dígito + 7
-    if len(digits) == 9 and not digits.startswith("9"):
-        return "56" + digits
-
-    # Si hay más de 9 dígitos, intenta con los últimos 9
-    if len(digits) > 9:
-        ultimos = digits[-9:]
-        if len(ultimos) == 9:
-            return "56" + ultimos
-
-    return digits
-
 # --- BÚSQUEDA DE ALMACENES EN GOOGLE MAPS ---
 def buscar_y_agregar_almacenes(df_actual):
-    if not SERP_KEY:
+    if not SERP_KEY and not serpapi_cache.SERPAPI_REPLAY:
         print("❌ SERP_KEY no configurado, no se buscarán nuevos almacenes.")
         logging.error("SERP_KEY no configurado; omitiendo búsqueda de almacenes.")
         return df_actual
 
-    comunas = COMUNAS_OBJETIVO
-    zona = random.choice(comunas)
+    # La comuna ya no se elige al azar: el barrido prioriza las que más
+    # almacenes nuevos vienen rindiendo (ver barrido_serpapi).
+    zona, termino, start = siguiente_combo(ARCHIVO_COBERTURA, [[c, TERMINO_BUSQUEDA] for c in COMUNAS_OBJETIVO])
     ahora_cl = obtener_ahora_chile()
 
     print(f"🏪 Buscando Minimarkets y Almacenes en: {zona}...")
     params = {
         "engine": "google_maps",
-        "q": f"Minimarket o Almacen en {zona} Chile",
+        "q": f"{termino} en {zona} Chile",
         "api_key": SERP_KEY,
         "num": 20,
     }
 
-    try:
-        response = requests.get("https://serpapi.com/search", params=params, timeout=30)
-        # Nota: no imprimimos la respuesta completa para no saturar logs.
-        # Si SerpAPI falla normalmente retorna JSON con campos de error.
-        print(f"🔎 SerpAPI status: {response.status_code}")
-        results = response.json().get("local_results", [])
-        print(f"🔎 SerpAPI local_results: {len(results)}")
-        nuevos_leads = []
-
-        tels_en_base = set()
-        if not df_actual.empty and "Telefono" in df_actual.columns:
-            for t in df_actual["Telefono"]:
-                digits = "".join(filter(str.isdigit, str(t)))
-                if len(digits) >= 8:
-                    tels_en_base.add(digits[-9:])
+    nuevos_leads = []
+    duplicados = {}
+    # Compartido con la línea de clínicas: un negocio que ya está en
+    # cualquiera de los dos CSV no se vuelve a agregar (ver indice_duplicados).
+    indice = cargar_indice({"almacenes": df_actual})
 
-        ultimo_id = int(df_actual['Id'].max()) if not df_actual.empty and "Id" in df_actual.columns else 0
+    ultimo_id = int(df_actual['Id'].max()) if not df_actual.empty and "Id" in df_actual.columns else 0
 
+    def procesar_pagina(results):
+        nonlocal ultimo_id
+        print(f"🔎 SerpAPI local_results: {len(results)}")
+        antes = len(nuevos_leads)
         for place in results:
             raw_tel = place.get("phone", "")
             tel_norm = normalizar_telefono_chile(raw_tel)
             if not tel_norm or len(tel_norm) < 8:
                 continue
 
-            clave_tel = "".join(filter(str.isdigit, tel_norm))[-9:]
-            if clave_tel not in tels_en_base:
+            duplicado = indice.duplicado_de(place.get("title", ""), tel_norm, place.get("website"), zona)
+            if duplicado:
+                duplicados[duplicado[0]] = duplicados.get(duplicado[0], 0) + 1
+            else:
                 ultimo_id += 1
                 nuevos_leads.append({
                     "Id": int(ultimo_id),
@@ -143,53 +118,32 @@ def buscar_y_agregar_almacenes(df_actual):
                     "Notas": "",
                     "Version_Mensaje": "",
                 })
-                tels_en_base.add(clave_tel)
+                indice.agregar("almacenes", ultimo_id, place.get("title", ""), tel_norm, place.get("website"), zona)
+        return len(nuevos_leads) - antes
 
-        if nuevos_leads:
-            return pd.concat([df_actual, pd.DataFrame(nuevos_leads)], ignore_index=True)
-        print("📭 SerpAPI no devolvió leads nuevos (por duplicados o sin teléfonos válidos).")
+    try:
+        # Nota: no imprimimos la respuesta completa para no saturar logs.
+        # Pagina mientras cada página siga trayendo almacenes nuevos (ver barrido_serpapi).
+        avance = buscar_paginado(params, procesar_pagina, start=start)
+        if avance["resultado"] == "cuota_agotada":
+            logging.error("SerpAPI error (almacenes): cuota agotada o api_key inválida.")
+        registrar_busqueda(ARCHIVO_COBERTURA, zona, termino, avance)
     except Exception:
         logging.exception("❌ Error en búsqueda de almacenes")
         print("❌ Error en búsqueda de almacenes (ver logs).")
+
+    indice.guardar()
+    if duplicados:
+        print("🔁 Duplicados descartados: " + ", ".join(f"{n} por {motivo}" for motivo, n in duplicados.items()))
+    if nuevos_leads:
+        return pd.concat([df_actual, pd.DataFrame(nuevos_leads)], ignore_index=True)
+    print("📭 SerpAPI no devolvió leads nuevos (por duplicados o sin teléfonos válidos).")
     return df_actual
 
 # --- COMUNICACIONES ---
 def enviar_mensaje_texto(numero, mensaje):
-    if not EVO_URL or not EVO_TOKEN:
-        logging.error("EVO_URL o EVO_TOKEN no configurados; no se puede enviar mensaje.")
-        return False
-    base_url = EVO_URL.strip().rstrip('/')
-    headers = {"Content-Type": "application/json", "apikey": EVO_TOKEN}
-    try:
-        requests.post(
-            f"{base_url}/chat/sendPresence/{EVO_INSTANCE}",
-            json={"number": numero, "presence": "composing"},
-            headers=headers,
-            timeout=10,
-        )
-        time.sleep(random.randint(15, 30))  # Simular escritura
-
-        payload = {
-            "number": numero, 
-            "options": {"delay": 2000, "presence": "composing"}, 
-            "textMessage": {"text": mensaje}
-        }
-        res = requests.post(
-            f"{base_url}/message/sendText/{EVO_INSTANCE}",
-            json=payload,
-            headers=headers,
-            timeout=20,
-        )
-        if res.status_code not in [200, 201]:
-            logging.error(
-                "Error al enviar mensaje. Código HTTP: %s, respuesta: %s",
-                res.status_code,
-                res.text,
-            )
-        return res.status_code in [200, 201]
-    except Exception:
-        logging.exception("Excepción al enviar mensaje de texto.")
-        return False
+    # Mismo cliente que worker.py (sesión reutilizada, reintentos, circuit breaker).
+    return evo.enviar_texto(numero, mensaje)
 
 def obtener_mensaje_almacen(nombre, ubicacion, dia):
     """
@@ -245,28 +199,41 @@ def obtener_mensaje_almacen(nombre, ubicacion, dia):
     return "", ""
 
 # --- CICLO PRINCIPAL ---
-def ejecutar_ciclo():
-    ahora = obtener_ahora_chile()
-    
+ESTADOS_SIN_ENVIO = ["Finalizado", "Rechazado", "Error", "Cita Agendada"]
+# No seguir contactando leads ya clasificados como interesados / no interesados
+RESULTADOS_SIN_ENVIO = ["Interesado", "No interesado", "Numero equivocado"]
+MAX_ENVIOS_POR_CICLO = 3  # Solo 3 almacenes por ciclo
+# Pausa humanizada entre dos envíos de almacenes (5 a 10 minutos), ver programador_envios.
+PAUSA_ENTRE_ENVIOS_SEG = (300, 600)
+COLUMNAS_MINIMAS = [
+    "Id","Fecha","Hora","Evento","Ministerio","Ubicacion","Estado",
+    "Telefono","Dia_Secuencia","Fecha_Contacto","Resultado","Notas","Version_Mensaje"
+]
+
+
+def _seleccionar_candidatos(df, ahora, limite=MAX_ENVIOS_POR_CICLO):
+    return seleccionar_candidatos(
+        df, ahora,
+        estados_excluidos=ESTADOS_SIN_ENVIO,
+        max_dia_secuencia=2,  # Secuencia más corta (2 días)
+        limite=limite,
+        resultados_excluidos=RESULTADOS_SIN_ENVIO,
+    )
+
+
+def _en_horario_envio(ahora):
     # Horario Almacenero: 10 AM a 19 PM (Lunes a Sábado)
-    if ahora.weekday() > 5 or not (10 <= ahora.hour <= 19): 
-        print(f"🕒 Fuera de horario para almacenes.")
-        return 
+    return ahora.weekday() <= 5 and 10 <= ahora.hour <= 19
+
 
+def _cargar_almacenes():
     if not os.path.exists(ARCHIVO_ALMACENES):
-        df = pd.DataFrame(columns=[
-            "Id","Fecha","Hora","Evento","Ministerio","Ubicacion","Estado",
-            "Telefono","Dia_Secuencia","Fecha_Contacto","Resultado","Notas","Version_Mensaje"
-        ])
+        df = pd.DataFrame(columns=COLUMNAS_MINIMAS)
     else:
-        df = pd.read_csv(ARCHIVO_ALMACENES)
+        df = diario_leads.cargar_leads(ARCHIVO_ALMACENES)
 
     # Aseguramos que estén todas las columnas requeridas
-    columnas_minimas = [
-        "Id","Fecha","Hora","Evento","Ministerio","Ubicacion","Estado",
-        "Telefono","Dia_Secuencia","Fecha_Contacto","Resultado","Notas","Version_Mensaje"
-    ]
-    for col in columnas_minimas:
+    for col in COLUMNAS_MINIMAS:
         if col not in df.columns:
             if col == "Dia_Secuencia":
                 df[col] = 0
@@ -274,123 +241,145 @@ def ejecutar_ciclo():
                 df[col] = ""
 
     df["Dia_Secuencia"] = pd.to_numeric(df["Dia_Secuencia"], errors='coerce').fillna(0).astype(int)
+    return df
+
+
+def _enviar_programado(df, entrada, ahora):
+    """
+    Envía el mensaje de una entrada de la cola. Devuelve True/False según el
+    envío, None si el lead ya no está pendiente de ese día de la secuencia, o
+    programador_envios.SIN_CUPO si el gobernador de envíos no dio cupo.
+    """
+    filas = df.index[pd.to_numeric(df["Id"], errors="coerce") == entrada["id"]]
+    if len(filas) == 0:
+        return None
+    idx, dia_obj = filas[0], entrada["dia"]
+    vigente = _seleccionar_candidatos(df.loc[[idx]], ahora, limite=1)
+    if not vigente or vigente[0]["dia"] != dia_obj:
+        return None
+
+    row = df.loc[idx]
+    tel_final = normalizar_telefono_chile(row.get("Telefono", ""))
+    if not tel_final or len("".join(filter(str.isdigit, tel_final))) < 8:
+        logging.error("Teléfono inválido para Id %s: %s", row.get("Id"), row.get("Telefono"))
+        diario_leads.actualizar_lead(df, idx, ARCHIVO_ALMACENES, {
+            "Estado": "Error",
+            "Fecha_Contacto": ahora.strftime("%d/%m/%Y %H:%M"),
+        })
+        return None
+
+    msg, version = obtener_mensaje_almacen(row["Evento"], row["Ubicacion"], dia_obj)
+    if not msg:
+        return None
+
+    # Cupo compartido de la instancia (ambas líneas + respuestas del agente).
+    permitido, espera = adquirir_envio(PRIORIDAD_PROSPECCION)
+    if not permitido:
+        print(f"⏸️ Sin cupo de envíos en la instancia (próximo en ~{espera / 60:.0f} min); queda en la cola.")
+        return programador_envios.SIN_CUPO
+
+    if enviar_mensaje_texto(tel_final, msg):
+        cambios = {
+            "Estado": "Contactado" if dia_obj < 2 else "Finalizado",
+            "Dia_Secuencia": dia_obj,
+            "Fecha_Contacto": ahora.strftime("%d/%m/%Y %H:%M"),
+        }
+        if dia_obj == 1:
+            cambios["Version_Mensaje"] = version
+        print(f"   ✅ Día {dia_obj} enviado a {row['Evento']}.")
+    else:
+        cambios = {"Estado": "Error", "Fecha_Contacto": ahora.strftime("%d/%m/%Y %H:%M")}
+
+    diario_leads.actualizar_lead(df, idx, ARCHIVO_ALMACENES, cambios)
+    return cambios["Estado"] != "Error"
+
+
+def despachar_envios(df=None):
+    """
+    Envía los mensajes de almacenes programados que ya vencieron, como mucho
+    uno cada PAUSA_ENTRE_ENVIOS_SEG[0] (ver programador_envios). Si no se le
+    pasa `df`, carga el CSV solo si hay algo que enviar y lo compacta al
+    terminar. Devuelve el df (o None si no hizo falta cargarlo).
+    """
+    ahora = obtener_ahora_chile()
+    if not _en_horario_envio(ahora):
+        return df
+
+    propio = df is None
+    cargado = {"df": df}
+
+    def ejecutar(entrada):
+        if cargado["df"] is None:
+            cargado["df"] = _cargar_almacenes()
+        return _enviar_programado(cargado["df"], entrada, ahora)
+
+    despacho = programador_envios.despachar("almacenes", ejecutar, PAUSA_ENTRE_ENVIOS_SEG[0])
+    df = cargado["df"]
+    if propio and df is not None and despacho["resultados"]:
+        diario_leads.compactar(df, ARCHIVO_ALMACENES)
+    return df
+
+
+def ejecutar_ciclo():
+    ahora = obtener_ahora_chile()
+    
+    if not _en_horario_envio(ahora):
+        print(f"🕒 Fuera de horario para almacenes.")
+        return 
+
+    df = _cargar_almacenes()
     hoy_str = ahora.strftime("%d/%m/%Y")
 
-    # Control de límite diario de envíos
+    # Control de límite diario de envíos (los que siguen en la cola también cuentan)
     if "Fecha_Contacto" in df.columns:
         enviados_hoy = df["Fecha_Contacto"].astype(str).str.startswith(hoy_str).sum()
     else:
         enviados_hoy = 0
+    en_cola = programador_envios.en_cola("almacenes")
 
-    if enviados_hoy >= MAX_MENSAJES_DIARIOS:
+    if enviados_hoy + len(en_cola) >= MAX_MENSAJES_DIARIOS:
         print(f"📵 Límite diario de mensajes alcanzado ({MAX_MENSAJES_DIARIOS}).")
         logging.warning("Límite diario de mensajes alcanzado: %s", MAX_MENSAJES_DIARIOS)
+        despachar_envios(df)
+        diario_leads.compactar(df, ARCHIVO_ALMACENES)
         return
 
-    candidatos = []
-    for idx, row in df.iterrows():
-        if hoy_str in str(row.get('Fecha_Contacto', '')):
-            continue
-        if row["Estado"] in ["Finalizado", "Rechazado", "Error", "Cita Agendada"]:
-            continue
-        # No seguir contactando leads ya clasificados como interesados / no interesados
-        if row.get("Resultado") in ["Interesado", "No interesado", "Numero equivocado"]:
-            continue
-
-        dia_act = int(row.get("Dia_Secuencia", 0))
-        if row["Estado"] == "Contactado":
-            try:
-                ultima_fecha = datetime.strptime(str(row['Fecha_Contacto']), "%d/%m/%Y %H:%M")
-                if (ahora - ultima_fecha).total_seconds() < 90000: continue
-            except Exception:
-                logging.warning(
-                    "No se pudo parsear Fecha_Contacto para Id %s: %s",
-                    row.get("Id"),
-                    row.get("Fecha_Contacto"),
-                )
-
-        if row["Estado"] == "Contactado" and dia_act < 2: # Secuencia más corta (2 días)
-            candidatos.append({'idx': idx, 'dia': dia_act + 1})
-        elif row["Estado"] == "Nuevo":
-            candidatos.append({'idx': idx, 'dia': 1})
-
-    # Límite muy conservador para evitar baneo
-    random.shuffle(candidatos)
-    candidatos = candidatos[:3] # Solo 3 almacenes por ciclo
-
-    if not candidatos:
+    cupo = min(MAX_ENVIOS_POR_CICLO, MAX_MENSAJES_DIARIOS - enviados_hoy) - len(en_cola)
+
+    def candidatos_libres():
+        if cupo <= 0:
+            return []
+        libres = df[~pd.to_numeric(df["Id"], errors="coerce").isin([e["id"] for e in en_cola])]
+        # Límite muy conservador para evitar baneo
+        return _seleccionar_candidatos(libres, ahora, cupo)
+
+    candidatos = candidatos_libres()
+
+    if not candidatos and not en_cola:
         print("📭 Buscando nuevos almacenes...")
         antes = len(df)
         df = buscar_y_agregar_almacenes(df)
-        df.to_csv(ARCHIVO_ALMACENES, index=False)
+        diario_leads.compactar(df, ARCHIVO_ALMACENES)
         despues = len(df)
         print(f"➕ Leads agregados: {max(0, despues-antes)}")
 
         # Si se agregaron leads, intentamos enviar en el mismo ciclo (para no esperar al próximo cron).
-        candidatos = []
-        for idx, row in df.iterrows():
-            if hoy_str in str(row.get("Fecha_Contacto", "")):
-                continue
-            if row["Estado"] in ["Finalizado", "Rechazado", "Error", "Cita Agendada"]:
-                continue
-            if row.get("Resultado") in ["Interesado", "No interesado", "Numero equivocado"]:
-                continue
-
-            dia_act = int(row.get("Dia_Secuencia", 0))
-            if row["Estado"] == "Contactado":
-                try:
-                    ultima_fecha = datetime.strptime(str(row["Fecha_Contacto"]), "%d/%m/%Y %H:%M")
-                    if (ahora - ultima_fecha).total_seconds() < 90000:
-                        continue
-                except Exception:
-                    logging.warning(
-                        "No se pudo parsear Fecha_Contacto para Id %s: %s",
-                        row.get("Id"),
-                        row.get("Fecha_Contacto"),
-                    )
-
-            if row["Estado"] == "Contactado" and dia_act < 2:
-                candidatos.append({"idx": idx, "dia": dia_act + 1})
-            elif row["Estado"] == "Nuevo":
-                candidatos.append({"idx": idx, "dia": 1})
-
-        random.shuffle(candidatos)
-        candidatos = candidatos[:3]
+        candidatos = candidatos_libres()
 
         if not candidatos:
             print("📭 Aún no hay candidatos después de buscar nuevos almacenes.")
             return
 
-    print(f"🚀 Enviando a {len(candidatos)} almacenes...")
-    
-    for i, item in enumerate(candidatos):
-        idx, dia_obj = item['idx'], item['dia']
-        row = df.loc[idx]
-        tel_final = normalizar_telefono_chile(row.get("Telefono", ""))
-        if not tel_final or len("".join(filter(str.isdigit, tel_final))) < 8:
-            logging.error("Teléfono inválido para Id %s: %s", row.get("Id"), row.get("Telefono"))
-            df.at[idx, "Estado"] = "Error"
-            df.at[idx, "Fecha_Contacto"] = ahora.strftime("%d/%m/%Y %H:%M")
-            continue
-
-        msg, version = obtener_mensaje_almacen(row["Evento"], row["Ubicacion"], dia_obj)
-        if not msg:
-            continue
-
-        if enviar_mensaje_texto(tel_final, msg):
-            df.at[idx, "Estado"] = "Contactado" if dia_obj < 2 else "Finalizado"
-            df.at[idx, "Dia_Secuencia"] = dia_obj
-            df.at[idx, "Fecha_Contacto"] = ahora.strftime("%d/%m/%Y %H:%M")
-            if dia_obj == 1:
-                df.at[idx, "Version_Mensaje"] = version
-            print(f"   ✅ Día {dia_obj} enviado a {row['Evento']}.")
-        else:
-            df.at[idx, "Estado"] = "Error"
-            df.at[idx, "Fecha_Contacto"] = ahora.strftime("%d/%m/%Y %H:%M")
+    # Se programan con la pausa de 5-10 minutos en vez de dormir entre
+    # envíos: el primero sale ahora y el resto los envía despachador_envios.py.
+    programados = programador_envios.programar(
+        "almacenes", [(df.at[c["idx"], "Id"], c["dia"]) for c in candidatos], PAUSA_ENTRE_ENVIOS_SEG
+    )
+    if programados:
+        print(f"🗓️ {len(programados)} envíos a almacenes programados.")
 
-        df.to_csv(ARCHIVO_ALMACENES, index=False)
-        if i < len(candidatos) - 1:
-            time.sleep(random.randint(300, 600)) # Pausas de 5-10 minutos
+    despachar_envios(df)
+    diario_leads.compactar(df, ARCHIVO_ALMACENES)
 
 if __name__ == "__main__":
-    ejecutar_ciclo()
\ No newline at end of file
+    ejecutar_ciclo()